@@ -18,7 +18,18 @@ def load_inputs(datafiles):
     for key in inputs:
         final_inputs.append(inputs[key])
     return final_inputs
-        
+
+'''
+    load_inputs_store
+    Same as load_inputs over the start and end location files, read from the columnar observation store
+'''
+def load_inputs_store(store_path):
+    import preprocessing.store as store
+    columns, meta = store.load(store_path)
+    starts = store.location_strings(columns, meta, 'start')
+    ends = store.location_strings(columns, meta, 'end')
+    return [start + ' ' + end for start, end in zip(starts, ends)]
+
 
 def run(inputs):
     counts = {}
@@ -59,8 +70,11 @@ def output(counts, output_file):
         for tup in counts:
             wf.write("%s\t%f\n" % (tup[0], tup[1]))
 
-def model(files, outputfile):
-    inputs = load_inputs(files)
+def model(files, outputfile, store_path=None):
+    if store_path is not None:
+        inputs = load_inputs_store(store_path)
+    else:
+        inputs = load_inputs(files)
     counts, anchors = run(inputs)
     counts = sorted(counts.items(), key=lambda x: x[1])
     anchors = sorted(anchors.items(), key=lambda x: x[1])
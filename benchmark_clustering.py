@@ -0,0 +1,223 @@
+'''
+    benchmark_clustering.py
+    Compare the clustering engines on speed and quality
+    Every engine clusters the same synthetic and real location sets of increasing
+    size, each run in its own process so its wall time and peak memory are its own.
+    Runs are scored on the ground truth anchors (how many have a cluster center
+    nearby and how many clusters their locations are split into) and on their
+    agreement with the first engine, as the adjusted Rand index of the clusterings
+    and as the fraction of locations given the same center (what
+    ClusterGPS.TILES_AGREEMENT bounds), and written to a JSON report
+'''
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+
+import cluster.ClusterGPS as ClusterGPS
+
+# ClusterGPS engines plus the gaussian mixture path of preprocessing.py
+ENGINES = ClusterGPS.ENGINES + ['gmm']
+DEFAULT_ENGINES = ['grid', 'numpy', 'tiles', 'snap', 'gmm']
+
+# Most components the gmm engine tries
+GMM_MAX_COMPONENTS = 60
+
+'''
+    cluster_points
+    Cluster an (n, 2) array of distinct lon/lat rows with engine
+    Returns (center of every row, number of clusters)
+'''
+def cluster_points(engine, radius, points):
+    if engine == 'gmm':
+        import preprocessing.preprocessing as preprocesser
+        gmm = preprocesser.select_mixture(points, 2, min(GMM_MAX_COMPONENTS, len(points)) + 1, subsample=preprocesser.MAX_FIT_LOCATIONS)
+        labels = gmm.predict(points)
+        return gmm.means_[labels], len(np.unique(labels))
+    order = [tuple(point) for point in points.tolist()]
+    clustered, num_clusters = ClusterGPS.cluster_locations(radius, dict((location, 0) for location in order), engine)
+    return np.array([clustered[location] for location in order], dtype=np.float64).reshape(-1, 2), num_clusters
+
+def peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+'''
+    run_worker
+    Body of a benchmark process, cluster the points saved at points_path and
+    save the centers to centers_path, timings go to stdout as JSON
+'''
+def run_worker(engine, radius, points_path, centers_path):
+    points = np.load(points_path)
+    baseline = peak_rss_kb()
+    start = time.time()
+    centers, num_clusters = cluster_points(engine, radius, points)
+    seconds = time.time() - start
+    np.save(centers_path, centers)
+    print(json.dumps({'seconds': seconds, 'peak_rss_kb': peak_rss_kb(), 'baseline_rss_kb': baseline, 'clusters': num_clusters}))
+
+'''
+    run_engine
+    Run engine on points in a fresh process
+    Returns (the worker's timings, centers of the points)
+'''
+def run_engine(engine, radius, points, work_directory):
+    points_path = os.path.join(work_directory, 'points.npy')
+    centers_path = os.path.join(work_directory, 'centers.npy')
+    np.save(points_path, points)
+    here = os.path.dirname(os.path.abspath(__file__))
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--worker', engine, str(radius), points_path, centers_path], cwd=here)
+    timings = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    return timings, np.load(centers_path)
+
+def haversine_to(point, lon, lat):
+    # Distance in km from point to every (lon, lat), on absolute coordinates like ClusterGPS
+    lon1, lat1 = np.radians(abs(point[0])), np.radians(abs(point[1]))
+    lon2, lat2 = np.radians(np.abs(lon)), np.radians(np.abs(lat))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return ClusterGPS.EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+'''
+    anchor_scores
+    How well centers recover the anchors: the fraction of anchors with a cluster
+    center within match_km, and the mean number of clusters the locations within
+    match_km of an anchor are spread over (1 is best)
+'''
+def anchor_scores(points, centers, anchors, match_km):
+    if len(anchors) == 0:
+        return None, None
+    distinct = np.unique(centers, axis=0)
+    found, spread = 0, []
+    for anchor in anchors:
+        if len(distinct) and haversine_to(anchor, distinct[:, 0], distinct[:, 1]).min() <= match_km:
+            found += 1
+        near = haversine_to(anchor, points[:, 0], points[:, 1]) <= match_km
+        if near.any():
+            spread.append(len(np.unique(centers[near], axis=0)))
+    return found / float(len(anchors)), (float(np.mean(spread)) if spread else None)
+
+def center_labels(centers):
+    return np.unique(centers, axis=0, return_inverse=True)[1]
+
+'''
+    load_anchors
+    (lon, lat) rows of an anchor_truth.txt (location, tab, truth value), only anchors with a truth value of 1
+'''
+def load_anchors(path):
+    anchors = []
+    with open(path, 'r') as rf:
+        for line in rf:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 2 or float(fields[1]) < 1:
+                continue
+            anchors.append(ClusterGPS.get_lat_long(fields[0]))
+    return np.array(anchors, dtype=np.float64).reshape(-1, 2)
+
+'''
+    load_real_points
+    Distinct locations of an observation store, or of start and end location files,
+    in the order they first occur
+'''
+def load_real_points(store_path=None, location_files=None):
+    if store_path is not None:
+        import preprocessing.store as store
+        columns, meta = store.load(store_path)
+        points = store.all_locations(columns)
+    else:
+        import preprocessing.preprocessing as preprocesser
+        points = np.vstack([preprocesser.load_location_file(path) for path in location_files])
+    points = np.ascontiguousarray(points, dtype=np.float64)
+    unique_rows, first = np.unique(points.view(np.dtype((np.void, 16))).ravel(), return_index=True)
+    return points[np.sort(first)]
+
+'''
+    location_sets
+    (name, size, points, anchors) of every set to benchmark, synthetic sets of
+    each size plus prefixes of the real locations when given
+'''
+def location_sets(sizes, seed, real_points=None, real_anchors=None):
+    import cluster.BenchClusterGPS as bench
+    for size in sizes:
+        locations, anchors = bench.synthetic_anchored_locations(size, seed)
+        yield 'synthetic', size, np.array(list(locations), dtype=np.float64).reshape(-1, 2), anchors
+    if real_points is not None:
+        anchors = real_anchors if real_anchors is not None else np.zeros((0, 2))
+        for size in sizes:
+            if size >= len(real_points):
+                yield 'real', len(real_points), real_points, anchors
+                break
+            yield 'real', size, real_points[:size], anchors
+
+'''
+    benchmark
+    Run every engine on every location set, engines slower than limit seconds
+    are not run on the larger sets
+    Returns the report
+'''
+def benchmark(engines, radius, sets, limit, match_km):
+    runs = []
+    too_slow = set()
+    work_directory = tempfile.mkdtemp(prefix='benchmark_clustering')
+    try:
+        print('Set\tSize\tDistinct\tEngine\tSeconds\tPeak RSS (KB)\tClusters\tAnchor recall\tAnchor spread\tAgreement\tSame center')
+        for name, size, points, anchors in sets:
+            reference, reference_centers = None, None
+            for engine in engines:
+                run = {'set': name, 'size': size, 'distinct': len(points), 'engine': engine}
+                if (name, engine) in too_slow:
+                    run['skipped'] = True
+                    runs.append(run)
+                    print('%s\t%d\t%d\t%s\tskipped' % (name, size, len(points), engine))
+                    continue
+                timings, centers = run_engine(engine, radius, points, work_directory)
+                run.update(timings)
+                run['anchor_recall'], run['anchor_spread'] = anchor_scores(points, centers, anchors, match_km)
+                labels = center_labels(centers)
+                if reference is None:
+                    reference, reference_centers = labels, centers
+                run['agreement'] = float(adjusted_rand_score(reference, labels))
+                run['same_center'] = float(np.all(centers == reference_centers, axis=1).mean()) if len(points) else 1.0
+                runs.append(run)
+                print('%s\t%d\t%d\t%s\t%0.3f\t%d\t%d\t%s\t%s\t%0.4f\t%0.6f' % (name, size, len(points), engine, run['seconds'],
+                    run['peak_rss_kb'], run['clusters'], run['anchor_recall'], run['anchor_spread'], run['agreement'], run['same_center']))
+                if run['seconds'] > limit:
+                    too_slow.add((name, engine))
+    finally:
+        shutil.rmtree(work_directory)
+    return {'radius': radius, 'match_km': match_km, 'engines': engines, 'runs': runs}
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        run_worker(sys.argv[2], float(sys.argv[3]), sys.argv[4], sys.argv[5])
+        sys.exit(0)
+    parser = argparse.ArgumentParser(description='Benchmark the clustering engines on speed and anchor quality')
+    parser.add_argument('-n', '--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='Numbers of locations per set')
+    parser.add_argument('-e', '--engines', nargs='+', choices=ENGINES, default=DEFAULT_ENGINES, help='Engines to compare, the first is the agreement reference')
+    parser.add_argument('-r', '--radius', type=float, default=0.1, help='Clustering radius in km')
+    parser.add_argument('-m', '--match', type=float, default=None, help='Distance in km a center may be from an anchor to recover it (default: the radius)')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='Random seed of the synthetic sets')
+    parser.add_argument('--store', default=None, help='Also benchmark the locations of this observation store')
+    parser.add_argument('--locations', nargs=2, default=None, metavar=('START', 'END'), help='Also benchmark the locations of these start and end location files')
+    parser.add_argument('--anchors', default=None, help='anchor_truth.txt to score the real locations with')
+    parser.add_argument('-l', '--limit', type=float, default=60.0, help='Skip an engine on larger sets once a run takes longer than this many seconds')
+    parser.add_argument('-o', '--output', default='clustering_benchmark.json', help='Path of the JSON report')
+    args = parser.parse_args()
+    real_points, real_anchors = None, None
+    if args.store or args.locations:
+        real_points = load_real_points(args.store, args.locations)
+    if args.anchors:
+        real_anchors = load_anchors(args.anchors)
+    report = benchmark(args.engines, args.radius, location_sets(args.sizes, args.seed, real_points, real_anchors), args.limit, args.match or args.radius)
+    with open(args.output, 'w+') as wf:
+        json.dump(report, wf, indent=2)
+    print('Wrote %s' % args.output)
@@ -0,0 +1,96 @@
+'''
+    benchmark_inference.py
+    Compare the in process ADMM engine with the Groovy programs on the same data
+    Both run InferFrequentTrips and InferTripInfo on a data directory into their own
+    output directories; the wall times and how far apart the inferred truth values
+    are (atoms one side leaves out count as 0) are printed and written to a JSON report
+    The ADMM engine leaves out the atoms no rule grounds, PSL prints them at their
+    prior, so they are counted separately as dropped. trip_engine = 'admm' should
+    only be configured for data where no atom is over DEFAULT_TOLERANCE
+'''
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+import inference.atoms as atoms
+import inference.frequent_trips as frequent_trips
+import inference.trip_info as trip_info
+
+# Program, python engine, Groovy script and the output files to compare
+PROGRAMS = [
+    ('frequents', frequent_trips.run, './run_infer_frequents.sh', [frequent_trips.OUTPUT_FILE]),
+    ('info', trip_info.run, './run_infer_info.sh', [trip_info.TIMES_OUTPUT_FILE, trip_info.MODES_OUTPUT_FILE])
+]
+
+# The Groovy programs print two decimals
+DEFAULT_TOLERANCE = 0.02
+
+'''
+    compare_atoms
+    Largest and mean absolute difference of the truth values of two atom files and
+    how many atoms differ by more than tolerance, and how many reference atoms path leaves out
+'''
+def compare_atoms(path, reference_path, tolerance):
+    inferred, reference = atoms.read_atoms(path), atoms.read_atoms(reference_path)
+    keys = sorted(set(inferred) | set(reference))
+    if not keys:
+        return {'atoms': 0, 'max_difference': 0.0, 'mean_difference': 0.0, 'over_tolerance': 0, 'dropped': 0}
+    differences = np.abs(np.array([inferred.get(key, 0.0) - reference.get(key, 0.0) for key in keys]))
+    return {'atoms': len(keys), 'max_difference': float(differences.max()), 'mean_difference': float(differences.mean()),
+        'over_tolerance': int(np.count_nonzero(differences > tolerance)),
+        'dropped': sum(1 for key in reference if key not in inferred)}
+
+def timed(run):
+    start = time.time()
+    run()
+    return time.time() - start
+
+'''
+    benchmark
+    Run every program with both engines, the Groovy ones only with psl
+    Returns the report
+'''
+def benchmark(data_directory, psl, threads, tolerance):
+    work_directory = tempfile.mkdtemp(prefix='benchmark_inference')
+    runs = []
+    try:
+        print('Program\tEngine\tSeconds\tAtoms\tMax difference\tMean difference\tOver tolerance\tDropped')
+        for name, python_run, script, files in PROGRAMS:
+            python_output = os.path.join(work_directory, name, 'admm')
+            seconds = timed(lambda: python_run(data_directory, python_output, threads=threads))
+            run = {'program': name, 'admm_seconds': seconds}
+            print('%s\tadmm\t%0.3f' % (name, seconds))
+            if psl:
+                psl_output = os.path.join(work_directory, name, 'psl')
+                os.makedirs(psl_output)
+                run['psl_seconds'] = timed(lambda: subprocess.check_call([script, data_directory, psl_output]))
+                run['files'] = {}
+                for filename in files:
+                    comparison = compare_atoms(os.path.join(python_output, filename), os.path.join(psl_output, filename), tolerance)
+                    run['files'][filename] = comparison
+                    print('%s\tpsl\t%0.3f\t%d\t%0.4f\t%0.4f\t%d\t%d' % (name, run['psl_seconds'], comparison['atoms'],
+                        comparison['max_difference'], comparison['mean_difference'], comparison['over_tolerance'], comparison['dropped']))
+            runs.append(run)
+    finally:
+        shutil.rmtree(work_directory)
+    return {'data_directory': data_directory, 'threads': threads, 'tolerance': tolerance, 'runs': runs}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the ADMM inference engine against the Groovy programs')
+    parser.add_argument('data_directory', help='Data directory with the observations, grounded_anchors.txt and grounded_frequents.txt')
+    parser.add_argument('--no-psl', action='store_true', help='Only time the ADMM engine, without Java')
+    parser.add_argument('-j', '--threads', type=int, default=1, help='Threads of the ADMM engine')
+    parser.add_argument('-t', '--tolerance', type=float, default=DEFAULT_TOLERANCE, help='Largest difference in truth value counted as agreeing')
+    parser.add_argument('-o', '--output', default='inference_benchmark.json', help='Path of the JSON report')
+    args = parser.parse_args()
+    report = benchmark(args.data_directory, not args.no_psl, args.threads, args.tolerance)
+    with open(args.output, 'w+') as wf:
+        json.dump(report, wf, indent=2)
+    print('Wrote %s' % args.output)
@@ -5,51 +5,175 @@
 '''
 
 import config
+import stages
 import preprocessing.parser.parse as ps
+import preprocessing.parser.users as users
+import preprocessing.parser.incremental as incremental
 import preprocessing.preprocessing as preprocesser
+import preprocessing.sharding as sharding
+import preprocessing.candidates as candidates
+import preprocessing.segment_pairs as segment_pairs
+import preprocessing.location_relations as location_relations
 import partition.read_ground_anchors as rga
 import partition.read_ground_trips as rgt
-import cluster.ClusterGPS as cluster
-import subprocess
+import cluster.centroids as centroids
+import inference.anchors as anchors
+import inference.frequent_trips as frequent_trips
+import inference.trip_info as trip_info
+import inference.preflight as preflight
+import inference.launcher as launcher
 import output.filter_truth as ft
 import sys
 import os
 import argparse
 import ParseGeosheets as pg
-import shutil
 import MarkovModel.model as mc
 import NaiveBayes.naivebayes as nb
 
-def preprocess():
-    # Parser cleaned segments, write them to data files
-    cleaned_obs = ps.parse_cleaned_segments(config.data_path)
+OBS_PATHS = [config.seg_path, config.start_loc_path, config.end_loc_path, config.start_time_path, config.end_time_path,
+config.mode_path, config.segment_day_path, config.dataset_path, config.anchor_dataset_path]
+
+DATASET_PATHS = [config.anchor_dataset_path, config.dataset_path, config.mode_dataset_path, config.time_dataset_path]
+
+def write_truth():
     rga.write_anchor_truth(config.anchor_truth_path, config.anchor_ground_path)
     rgt.write_trip_truth(config.trip_truth_path, config.trip_ground_path, config.times_ground_path, config.mode_ground_path)
-    ps.write_obs(cleaned_obs, config.seg_path, config.start_loc_path, config.end_loc_path, config.start_time_path,
-    config.end_time_path, config.mode_path, config.segment_day_path, config.dataset_path, config.anchor_dataset_path)
-    # Cluster to coalesce locations
-    
-    cluster.run(0.1, [config.start_loc_path, config.end_loc_path], ['temp1', 'temp2'])
-    shutil.copy('temp1', config.start_loc_path)
-    shutil.copy('temp2', config.end_loc_path)
-    os.remove('temp1')
-    os.remove('temp2')
-    write_datasets()
+
+def parse_observations(incremental_ingest):
+    if incremental_ingest:
+        # Only parse the sections written since the last run and append them
+        incremental.ingest_timeline(config.data_path, OBS_PATHS, config.obs_store_path, config.ingest_manifest_path)
+    else:
+        # Parse cleaned segments lazily, write_obs streams them to the data files
+        cleaned_obs = ps.iter_cleaned_segments(config.data_path)
+        ps.write_obs(cleaned_obs, *OBS_PATHS, store_path=config.obs_store_path)
+        # The files were rewritten, the next incremental run has to start over
+        if os.path.exists(config.ingest_manifest_path):
+            os.remove(config.ingest_manifest_path)
+
+def cluster_locations(incremental_cluster):
+    # Cluster to coalesce locations, the store is read so the files can be rewritten in place
+    location_paths = [config.start_loc_path, config.end_loc_path]
+    if incremental_cluster:
+        # Only cluster the appended rows against the saved centers, earlier labels never change
+        centroids.run_incremental(config.cluster_radius, config.obs_store_path, location_paths, config.centroid_store_path, config.cluster_engine)
+    else:
+        centroids.run_full(config.cluster_radius, config.obs_store_path, location_paths, config.centroid_store_path, config.cluster_engine)
+
+def write_shards():
+    report = sharding.run(config.data_directory, config.obs_store_path, config.shards_path, config.num_shards)
+    # Each shard gets the pairs and relations of its own segments and locations
+    for directory in report['directories']:
+        segment_pairs.run(os.path.join(config.shards_path, directory))
+        location_relations.run(os.path.join(config.shards_path, directory), config.near_cutoff)
+
+def write_segment_pairs():
+    segment_pairs.run(config.data_directory)
+
+def write_location_relations():
+    location_relations.run(config.data_directory, config.near_cutoff)
+
+'''
+    write_candidates
+    Write the target atoms the PSL programs load instead of cross products, or remove
+    them so the programs fall back to the cross products
+'''
+def write_candidates():
+    for directory in [config.data_directory] + shard_directories():
+        if config.use_candidates:
+            candidates.run(directory, config.candidate_radius)
+        else:
+            candidates.remove(directory)
+
+'''
+    shard_directories
+    Observation directories of the shards written by the shards stage, none when unsharded
+'''
+def shard_directories():
+    if config.num_shards <= 1 or not os.path.exists(os.path.join(config.shards_path, sharding.REPORT_FILE)):
+        return []
+    return sharding.shard_directories(config.shards_path)
+
+'''
+    split_grounded
+    Split a grounded file into the shards as soon as the step grounding it wrote it
+'''
+def split_grounded(path):
+    if shard_directories():
+        sharding.split_location_files(config.data_directory, config.shards_path, [os.path.basename(path)])
+
+'''
+    preprocess_stages
+    The preprocessing pipeline as stages, see stages.py
+    Clustering rewrites the parsed locations in place, so it can only rerun on a fresh parse
+'''
+def preprocess_stages(incremental_ingest=False):
+    truth_outputs = [config.anchor_ground_path, config.trip_ground_path, config.times_ground_path, config.mode_ground_path]
+    pipeline = [
+        stages.Stage('truth', write_truth,
+            inputs=[config.anchor_truth_path, config.trip_truth_path],
+            outputs=truth_outputs),
+        stages.Stage('parse', lambda: parse_observations(incremental_ingest),
+            inputs=[config.data_path],
+            outputs=OBS_PATHS + [config.obs_store_path]),
+        stages.Stage('cluster', lambda: cluster_locations(incremental_ingest),
+            params={'radius': config.cluster_radius, 'engine': config.cluster_engine},
+            outputs=[config.start_loc_path, config.end_loc_path, config.obs_store_path, config.centroid_store_path],
+            after=['parse'], rewrites=['parse']),
+        stages.Stage('pairs', write_segment_pairs,
+            outputs=[config.same_day_pairs_path, config.same_day_pair_counts_path],
+            after=['cluster']),
+        stages.Stage('relations', write_location_relations,
+            params={'near_cutoff': config.near_cutoff},
+            outputs=[config.equal_locations_path] + ([config.near_locations_path] if config.near_cutoff is not None else []),
+            after=['cluster']),
+        stages.Stage('datasets', write_datasets,
+            inputs=truth_outputs,
+            outputs=DATASET_PATHS,
+            after=['truth', 'cluster'])
+    ]
+    if config.num_shards > 1:
+        pipeline.append(stages.Stage('shards', write_shards,
+            params={'shards': config.num_shards, 'near_cutoff': config.near_cutoff},
+            inputs=truth_outputs,
+            # Only the report, the grounded files and candidates split into the shards later
+            # would otherwise make the stage stale on every run
+            outputs=[os.path.join(config.shards_path, sharding.REPORT_FILE)],
+            after=['truth', 'cluster']))
+    return pipeline
+
+'''
+    preprocess
+    Run the preprocessing stages whose inputs or parameters changed since the last run,
+    with rebuild every stage runs
+'''
+def preprocess(incremental_ingest=False, rebuild=False):
+    stages.run_stages(preprocess_stages(incremental_ingest), config.stage_cache_path, rebuild)
+
+'''
+    ingest_users
+    Parse many users' timelines in parallel, each into data_directory/<user>
+'''
+def ingest_users(timelines, processes):
+    users.ingest_users(users.expand_timelines(timelines), config.data_directory, OBS_PATHS, config.obs_store_path,
+    config.ingest_summary_path, processes)
 
 def write_datasets():
-    rgt.write_dataset([config.start_loc_path, config.end_loc_path, config.mode_path, config.start_time_path, config.end_time_path], config.anchor_dataset_path)
+    trip_columns = ['start_location', 'end_location', 'mode', 'start_time', 'end_time']
+    time_columns = ['start_location', 'end_location', 'start_time', 'end_time', 'mode']
+    rgt.write_dataset_store(config.obs_store_path, trip_columns, config.anchor_dataset_path)
     rgt.label_anchor_dataset(config.anchor_ground_path, config.anchor_dataset_path)
-    rgt.write_dataset([config.start_loc_path, config.end_loc_path, config.mode_path, config.start_time_path, config.end_time_path], config.dataset_path)
+    rgt.write_dataset_store(config.obs_store_path, trip_columns, config.dataset_path)
     rgt.label_dataset(config.trip_ground_path, config.dataset_path)
 
-    rgt.write_dataset([config.start_loc_path, config.end_loc_path, config.mode_path, config.start_time_path, config.end_time_path], config.mode_dataset_path)
+    rgt.write_dataset_store(config.obs_store_path, trip_columns, config.mode_dataset_path)
     rgt.label_mode_set(config.mode_ground_path, config.mode_dataset_path)
 
-    rgt.write_dataset([config.start_loc_path, config.end_loc_path, config.start_time_path, config.end_time_path, config.mode_path], config.time_dataset_path)
+    rgt.write_dataset_store(config.obs_store_path, time_columns, config.time_dataset_path)
     rgt.label_time_set(config.times_ground_path, config.time_dataset_path)
 
-def build_naivebayes():
-    preprocess()
+def build_naivebayes(rebuild=False):
+    preprocess(rebuild=rebuild)
     build_naivebayes_nopreprocess()
 
 def build_naivebayes_nopreprocess():
@@ -58,49 +182,86 @@ def build_naivebayes_nopreprocess():
     nb.run_trip(config.mode_dataset_path, ['Start Location', 'End Location', 'Mode', 'Label'])
     nb.run_trip(config.time_dataset_path, ['Start Location', 'End Location', 'Start Time', 'End Time', 'Label'])
 
-def build_markov_chains():
-    preprocess()
+def build_markov_chains(rebuild=False):
+    preprocess(rebuild=rebuild)
     build_markov_chains_nopreprocess()
 
 def build_markov_chains_nopreprocess():
-    mc.model([config.start_loc_path, config.end_loc_path], config.markov_chains_results)
+    mc.model([config.start_loc_path, config.end_loc_path], config.markov_chains_results, config.obs_store_path)
 
 '''
     build_cleaned_clustered
     Run entire pipeline, with preprocessing
 '''
-def build_cleaned_clustered(create_geosheets):
-    preprocess()
+def build_cleaned_clustered(create_geosheets, incremental_ingest=False, rebuild=False):
+    preprocess(incremental_ingest, rebuild)
     build_cleaned_clustered_nopreprocess(create_geosheets)
 
+psl_programs = launcher.Launcher(config.psl_launcher, config.max_heap_gb)
+
+'''
+    run_psl
+    Estimate the grounding of a Groovy stage, refuse it over grounding_budget_gb and
+    otherwise run it with a heap sized from the estimate
+'''
+def run_psl(stage):
+    report = preflight.guard(stage, config.data_directory, config.grounding_budget_gb, config.grounding_fallback_candidates, config.candidate_radius)
+    args = [] if config.psl_launcher == 'scripts' else [config.data_directory]
+    psl_programs.run(stage, args, report['bytes'])
+
+def infer_anchors():
+    if config.anchor_engine == 'closed_form':
+        anchors.run(config.data_directory, anchors.DEFAULT_OUTPUT)
+    else:
+        run_psl('anchors')
+
+def infer_frequent_trips():
+    if config.trip_engine == 'admm':
+        frequent_trips.run(config.data_directory, './output/default', threads=config.inference_threads)
+    else:
+        run_psl('frequents')
+
+def infer_trip_info():
+    if config.trip_engine == 'admm':
+        trip_info.run(config.data_directory, './output/default', threads=config.inference_threads)
+    else:
+        run_psl('info')
+
 '''
     build_cleaned_clustered_nopreprocess
     Run the pipeline without parsing or preprocessing
 '''
 def build_cleaned_clustered_nopreprocess(create_geosheets):
     # Infer anchors
-    subprocess.call(['./run.sh'])
+    write_candidates()
+    infer_anchors()
     # filter and ground anchors
     if config.write_anchors:
         ft.filter('./output/default/anchors.txt', './anchors_results')
     ft.filter_top_n('./output/default/anchors.txt', config.anchors_path, config.num_anchors)
+    split_grounded(config.anchors_path)
 
     if create_geosheets:
         ft.anchor_geosheets('./output/default/anchors.txt', './anchors_geosheet.csv')
 
     # Infer Frequent Trips
-    subprocess.call(['./run_infer_frequents.sh'])
+    infer_frequent_trips()
     ft.filter('./output/default/frequents_infer.txt', config.cleaned_grouped_results_path)
 
     if create_geosheets:
         ft.create_geosheets_csv(config.cleaned_grouped_results_path, 'geosheets_cleaned.txt')
 
     ft.filter_top_n_frequents('./output/default/frequents_infer.txt', config.frequents_path, config.num_frequent_trips)
+    split_grounded(config.frequents_path)
 
+    # Trip times and modes are only candidates for the grounded frequent trips
+    write_candidates()
     #Infer trip information
-    subprocess.call(['./run_infer_info.sh'])
+    infer_trip_info()
 
     filter_and_merge(create_geosheets)
+    # Stop the inference worker, it would also exit with this process
+    psl_programs.close()
 
 def filter_and_merge(create_geosheets):
     # Filter and output results
@@ -111,7 +272,7 @@ def filter_and_merge(create_geosheets):
         pg.write()
 '''
     pg.filter_top_n_modes_trips()
-    subprocess.call(['./run_infer_merge.sh'])
+    run_psl('merge')
 
     ft.filter('./output/default/frequent_modes_times_infer.txt', config.trip_modes_times_path)
     if create_geosheets:
@@ -125,9 +286,15 @@ parser.add_argument('-f', '--filtermerge', action='store_true', help='Run the fi
 parser.add_argument('-m', '--markov', action='store_true', help='Run the Markov chains baseline and output results')
 parser.add_argument('-b', '--bayes', action='store_true', help='Run the Naive Bayes baseline and output results')
 parser.add_argument('-d', '--datasets', action='store_true', help='Write the datasets')
+parser.add_argument('-t', '--timelines', nargs='+', default=config.timeline_paths, help='Timeline paths or glob patterns to parse in parallel, one data directory per user')
+parser.add_argument('-i', '--incremental', action='store_true', help='Only parse the part of the timeline added since the last run, append it to the observations and cluster just the new locations')
+parser.add_argument('-p', '--processes', type=int, default=config.ingest_processes, help='Worker processes for parsing timelines (default: every core)')
+parser.add_argument('-r', '--rebuild', action='store_true', help='Run every preprocessing stage even if its inputs are unchanged since the last run')
 args = parser.parse_args()
 geosheets = args.geosheets
-if args.nopreprocess:
+if args.timelines:
+    ingest_users(args.timelines, args.processes)
+elif args.nopreprocess:
     if args.markov:
         build_markov_chains_nopreprocess()
     if args.bayes:
@@ -137,11 +304,11 @@ if args.nopreprocess:
 elif args.filtermerge:
     filter_and_merge(geosheets)
 elif args.markov:
-    build_markov_chains()
+    build_markov_chains(args.rebuild)
 elif args.bayes:
-    build_naivebayes()
+    build_naivebayes(args.rebuild)
 elif args.datasets:
     write_datasets()
 else:
-    build_cleaned_clustered(geosheets)
+    build_cleaned_clustered(geosheets, args.incremental, args.rebuild)
 
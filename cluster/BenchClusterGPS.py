@@ -0,0 +1,58 @@
+'''
+    BenchClusterGPS.py
+    Time the ClusterGPS engines on seeded synthetic locations
+    Locations are GPS fixes scattered around anchors (with 4 decimals, the way
+    write_obs stores them) plus one-off places, engines slower than the time
+    limit on a smaller size are not run on larger ones
+'''
+
+import argparse
+import time
+
+import numpy as np
+
+import ClusterGPS
+
+'''
+    synthetic_anchored_locations
+    Synthetic locations and the (lon, lat) anchors they are scattered around
+'''
+def synthetic_anchored_locations(n, seed=0, anchors_per_1000=5, jitter=0.0003, noise=0.1):
+    rs = np.random.RandomState(seed)
+    anchors = np.column_stack((rs.uniform(-122.4, -121.9, max(1, n * anchors_per_1000 // 1000)), rs.uniform(37.0, 37.8, max(1, n * anchors_per_1000 // 1000))))
+    picks = anchors[rs.randint(0, len(anchors), n)] + rs.normal(0, jitter, (n, 2))
+    one_off = rs.rand(n) < noise
+    picks[one_off] = np.column_stack((rs.uniform(-122.4, -121.9, one_off.sum()), rs.uniform(37.0, 37.8, one_off.sum())))
+    return dict(((lon, lat), 0) for lon, lat in np.round(picks, 4).tolist()), anchors
+
+def synthetic_locations(n, seed=0, anchors_per_1000=5, jitter=0.0003, noise=0.1):
+    return synthetic_anchored_locations(n, seed, anchors_per_1000, jitter, noise)[0]
+
+def run_engine(engine, radius, locations):
+    start = time.time()
+    result = ClusterGPS.cluster_locations(radius, locations, engine)
+    return result, time.time() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the ClusterGPS engines')
+    parser.add_argument('-n', '--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='Numbers of locations to cluster')
+    parser.add_argument('-r', '--radius', type=float, default=0.1, help='Clustering radius in km')
+    parser.add_argument('-e', '--engines', nargs='+', default=ClusterGPS.ENGINES, help='Engines to time')
+    parser.add_argument('-l', '--limit', type=float, default=60.0, help='Skip an engine on larger sizes once a run takes longer than this many seconds')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+    print('Locations\tDistinct\tEngine\tSeconds\tClusters\tSame clusters as the first engine run\tAgreement')
+    too_slow = set()
+    for size in args.sizes:
+        locations = synthetic_locations(size, args.seed)
+        reference = None
+        for engine in args.engines:
+            if engine in too_slow:
+                print('%d\t%d\t%s\tskipped\t\t\t' % (size, len(locations), engine))
+                continue
+            result, seconds = run_engine(engine, args.radius, locations)
+            if reference is None:
+                reference = result
+            print('%d\t%d\t%s\t%0.3f\t%d\t%s\t%0.4f' % (size, len(locations), engine, seconds, result[1], result == reference, ClusterGPS.agreement_fraction(result[0], reference[0])))
+            if seconds > args.limit:
+                too_slow.add(engine)
@@ -3,7 +3,26 @@
     Clustering Locations
 '''
 
-from math import sin, cos, sqrt, atan2, radians
+from collections import defaultdict
+from math import sin, cos, sqrt, atan2, radians, degrees, asin, floor
+
+EARTH_RADIUS = 6373.0
+
+# brute scans every location for every center, grid only the cells around it,
+# numpy measures a center against all the locations in those cells at once,
+# tiles clusters geographic tiles in parallel with the grid engine, snap does
+# not mean shift at all but snaps every location to its grid cell (see snap.py)
+ENGINES = ['brute', 'grid', 'numpy', 'tiles', 'snap']
+DEFAULT_ENGINE = 'grid'
+
+# Tile side in grid cells, and how close (in cells) to a tile border a cluster
+# has to come to be reclustered across tiles
+TILE_CELLS = 64
+BORDER_CELLS = 2
+# Smallest fraction of TestClusterGPS' locations the tiles engine has to give the same
+# center as the grid engine. A test threshold only, larger sets have more locations in
+# the border bands, see cluster_locations_tiles
+TILES_AGREEMENT = 0.9999
 
 def load_data(files):
     locations = {}
@@ -35,15 +54,96 @@ def compute_haversine_distance(location1, location2):
     a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
     c = 2 * atan2(sqrt(a), sqrt(1 - a))
 
-    return 6373.0 * c
+    return EARTH_RADIUS * c
 
 def compute_marked_mean(locations):
     reduced = reduce(lambda x, y: (x[0] + y[0], x[1] + y[1]), locations)
     val = (round(reduced[0] / len(locations), 4), round(reduced[1] / len(locations), 4))
     return val
 
-def cluster(radius, files, output_files):
-    locations = load_data(files)
+'''
+    load_store
+    Same as load_data, but read the start and end locations from the columnar observation store
+'''
+def load_store(store_path):
+    import preprocessing.store as store
+    columns, meta = store.load(store_path)
+    locations = {}
+    for prefix in ['start', 'end']:
+        for lat_long in zip(columns[prefix + '_lon'].tolist(), columns[prefix + '_lat'].tolist()):
+            locations[lat_long] = 0
+    return locations
+
+def cluster(radius, files, output_files, engine=DEFAULT_ENGINE):
+    return cluster_locations(radius, load_data(files), engine)
+
+'''
+    GridIndex
+    Uniform grid over the absolute coordinates compute_haversine_distance works on.
+    Cells are as tall as radius and as wide as radius can span in longitude at the
+    highest latitude, so every location within radius of a center is in the 3x3
+    cells around it. Locations too close to the poles, or outside lon/lat range,
+    are all put in one cell
+'''
+class GridIndex(object):
+
+    def __init__(self, locations, radius):
+        self.size = len(locations)
+        self.cells = None
+        if self.size == 0:
+            return
+        angle = radius / EARTH_RADIUS
+        max_lon = max(abs(location[0]) for location in locations)
+        # Centers are means of locations, rounded to 4 places
+        max_lat = max(abs(location[1]) for location in locations) + degrees(angle) + 1e-3
+        if max_lon > 180 or max_lat >= 90 or angle >= 1:
+            return
+        # Slightly larger cells so rounding never drops a location right on the radius
+        self.lat_size = degrees(angle) * (1 + 1e-9) + 1e-12
+        self.lon_size = degrees(2 * asin(min(1.0, sin(angle / 2) / cos(radians(max_lat))))) * (1 + 1e-9) + 1e-12
+        self.cells = defaultdict(list)
+        for ind, location in enumerate(locations):
+            self.cells[self.cell(location)].append(ind)
+
+    def cell(self, location):
+        return (int(floor(abs(location[0]) / self.lon_size)), int(floor(abs(location[1]) / self.lat_size)))
+
+    '''
+        candidates
+        Indices of the locations that can be within radius of center, in order
+    '''
+    def candidates(self, center):
+        if self.cells is None:
+            return range(self.size)
+        lon_cell, lat_cell = self.cell(center)
+        found = []
+        for lon_step in (-1, 0, 1):
+            for lat_step in (-1, 0, 1):
+                found.extend(self.cells.get((lon_cell + lon_step, lat_cell + lat_step), ()))
+        found.sort()
+        return found
+
+'''
+    cluster_locations
+    Mean shift every unclustered location until its center stops moving, every
+    location marked along the way joins the cluster
+    Returns (location to center dict, number of clusters)
+'''
+def cluster_locations(radius, locations, engine=DEFAULT_ENGINE):
+    if engine == 'brute':
+        return cluster_locations_brute(radius, locations)
+    if engine == 'grid':
+        return cluster_locations_grid(radius, locations)
+    if engine == 'numpy':
+        return cluster_locations_numpy(radius, locations)
+    if engine == 'tiles':
+        return cluster_locations_tiles(radius, locations)
+    if engine == 'snap':
+        import snap
+        return snap.cluster_locations(radius, locations)
+    raise ValueError('Unknown clustering engine %s, expected one of %s' % (engine, ', '.join(ENGINES)))
+
+def cluster_locations_brute(radius, locations):
     clustered_locations = dict(locations)
     num_clusters = 0
     for location in locations:
@@ -71,8 +171,243 @@ def cluster(radius, files, output_files):
         #current_center += 1
     return clustered_locations, num_clusters
 
-def run(radius, files, output_files):
-    locations, num_clusters = cluster(radius, files, output_files)
+'''
+    cluster_locations_grid
+    Same clusters as cluster_locations_brute, candidates come from a GridIndex and
+    are visited in the same order, and the marked locations are summed in the same
+    order compute_marked_mean would sum them, so the centers are identical
+'''
+def cluster_locations_grid(radius, locations):
+    order = list(locations)
+    centers, num_clusters = cluster_order_grid(radius, order)
+    return dict(zip(order, centers)), num_clusters
+
+'''
+    cluster_order_grid
+    The grid engine on a list of locations visited in list order,
+    returns (center of each location, number of clusters)
+'''
+def cluster_order_grid(radius, order):
+    index = GridIndex(order, radius)
+    centers = [None] * len(order)
+    clustered = [False] * len(order)
+    num_clusters = 0
+    for ind, location in enumerate(order):
+        if clustered[ind]:
+            continue
+        current_center = location
+        unchanged_center = False
+        marked = []
+        total = None
+        while unchanged_center is False:
+            for next_ind in index.candidates(current_center):
+                if clustered[next_ind]:
+                    continue
+                next_location = order[next_ind]
+                if compute_haversine_distance(current_center, next_location) <= radius:
+                    marked.append(next_ind)
+                    total = next_location if total is None else (total[0] + next_location[0], total[1] + next_location[1])
+            new_mean = (round(total[0] / len(marked), 4), round(total[1] / len(marked), 4))
+            if current_center == new_mean:
+                unchanged_center = True
+            else:
+                current_center = new_mean
+        for mark in marked:
+            clustered[mark] = True
+            centers[mark] = current_center
+        num_clusters += 1
+    return centers, num_clusters
+
+'''
+    Neighborhoods
+    For the NumPy engine, the locations of the 3x3 cells around each grid cell
+    as arrays sorted by location index, built the first time a center lands in
+    the cell. Without a usable grid every location is in one neighborhood
+    columns are (index, abs lon, abs lat in radians, cos lat, lon, lat)
+'''
+class Neighborhoods(object):
+
+    def __init__(self, locations, points, radius):
+        import numpy as np
+        self.grid = GridIndex(locations, radius)
+        lon = np.radians(np.abs(points[:, 0]))
+        lat = np.radians(np.abs(points[:, 1]))
+        self.columns = (np.arange(len(points)), lon, lat, np.cos(lat), points[:, 0], points[:, 1])
+        self.cache = {}
+
+    def around(self, center):
+        import numpy as np
+        if self.grid.cells is None:
+            return self.columns
+        key = self.grid.cell(center)
+        found = self.cache.get(key)
+        if found is None:
+            members = []
+            for lon_step in (-1, 0, 1):
+                for lat_step in (-1, 0, 1):
+                    members.extend(self.grid.cells.get((key[0] + lon_step, key[1] + lat_step), ()))
+            members = np.array(sorted(members), dtype=np.int64)
+            found = tuple(column[members] for column in self.columns)
+            self.cache[key] = found
+        return found
+
+'''
+    haversine_block
+    compute_haversine_distance from center to a block of locations in one call,
+    lon and lat are the absolute coordinates of the block in radians
+'''
+def haversine_block(center, lon, lat, cos_lat):
+    import numpy as np
+    center_lon = radians(abs(center[0]))
+    center_lat = radians(abs(center[1]))
+    a = np.sin((lat - center_lat) / 2) ** 2 + cos(center_lat) * cos_lat * np.sin((lon - center_lon) / 2) ** 2
+    return EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+'''
+    running_sum
+    Add values to total left to right, the order reduce adds them in
+    compute_marked_mean, so the rounded means match the other engines exactly
+'''
+def running_sum(total, values):
+    import numpy as np
+    if total is not None:
+        values = np.concatenate(([total], values))
+    return float(np.cumsum(values)[-1])
+
+'''
+    cluster_locations_numpy
+    The grid engine with the distances from a center to its whole neighborhood
+    computed in one NumPy call and the marked locations reduced as arrays
+'''
+def cluster_locations_numpy(radius, locations):
+    order = list(locations)
+    centers, num_clusters = cluster_order_numpy(radius, order)
+    return dict(zip(order, centers)), num_clusters
+
+'''
+    cluster_order_numpy
+    The numpy engine on a list of locations visited in list order
+'''
+def cluster_order_numpy(radius, order):
+    import numpy as np
+    points = np.array(order, dtype=np.float64).reshape(-1, 2)
+    neighborhoods = Neighborhoods(order, points, radius)
+    alive = np.ones(len(order), dtype=bool)
+    centers = [None] * len(order)
+    num_clusters = 0
+    for ind in range(len(order)):
+        if not alive[ind]:
+            continue
+        current_center = order[ind]
+        marked = []
+        total_lon, total_lat, count = None, None, 0
+        while True:
+            members, lon, lat, cos_lat, raw_lon, raw_lat = neighborhoods.around(current_center)
+            within = (haversine_block(current_center, lon, lat, cos_lat) <= radius) & alive[members]
+            if within.any():
+                marked.append(members[within])
+                total_lon = running_sum(total_lon, raw_lon[within])
+                total_lat = running_sum(total_lat, raw_lat[within])
+                count += len(marked[-1])
+            new_mean = (round(total_lon / count, 4), round(total_lat / count, 4))
+            if current_center == new_mean:
+                break
+            current_center = new_mean
+        members = np.concatenate(marked)
+        alive[members] = False
+        for member in members.tolist():
+            centers[member] = current_center
+        num_clusters += 1
+    return centers, num_clusters
+
+'''
+    near_border
+    Whether a location lies within BORDER_CELLS of the edge of tile
+'''
+def near_border(location, grid, tile, tile_cells):
+    lon_cells = abs(location[0]) / grid.lon_size - tile[0] * tile_cells
+    lat_cells = abs(location[1]) / grid.lat_size - tile[1] * tile_cells
+    return min(lon_cells, lat_cells, tile_cells - lon_cells, tile_cells - lat_cells) < BORDER_CELLS
+
+'''
+    cluster_tile
+    Pool worker, cluster the locations of one tile in order with the grid engine
+    job is (radius, tile, locations, grid, tile cells)
+    Returns the center of each location and whether its cluster comes near the tile border
+'''
+def cluster_tile(job):
+    radius, tile, order, grid, tile_cells = job
+    centers, num_clusters = cluster_order_grid(radius, order)
+    border_centers = set()
+    for location, center in zip(order, centers):
+        if near_border(location, grid, tile, tile_cells) or near_border(center, grid, tile, tile_cells):
+            border_centers.add(center)
+    return centers, [center in border_centers for center in centers]
+
+'''
+    cluster_locations_tiles
+    Split the locations into square tiles of tile_cells grid cells, cluster every
+    tile on a pool of processes (None uses every core), then recluster the
+    locations of all clusters that come within BORDER_CELLS (about 2 x radius) of
+    a tile border together, in the original order.
+    Tolerance: clusters that stay clear of the borders are exactly the sequential
+    clusters, only locations in the border bands can get a different center than
+    cluster_locations_grid gives them (agreement_fraction measures how many keep theirs).
+    On the 1M synthetic locations of benchmark_clustering.py (591591 distinct) 0.99946
+    keep their center at a radius of 0.05 km, 0.99996 at 0.1 km, 0.99982 at 0.2 km and
+    0.99403 at 1 km, the bands widen with the radius
+'''
+def cluster_locations_tiles(radius, locations, processes=None, tile_cells=TILE_CELLS):
+    import multiprocessing
+    order = list(locations)
+    grid = GridIndex(order, radius)
+    if grid.cells is None:
+        return cluster_locations_grid(radius, locations)
+    # The cells are only needed to find tiles, workers get the cell sizes
+    cells, grid.cells = grid.cells, None
+    tiles = defaultdict(list)
+    for (lon_cell, lat_cell), members in cells.items():
+        tiles[(lon_cell // tile_cells, lat_cell // tile_cells)].extend(members)
+    tile_keys = sorted(tiles, key=lambda tile: -len(tiles[tile]))
+    jobs = []
+    for tile in tile_keys:
+        tiles[tile].sort()
+        jobs.append((radius, tile, [order[ind] for ind in tiles[tile]], grid, tile_cells))
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(cluster_tile, jobs, 1)
+    finally:
+        pool.close()
+        pool.join()
+    centers = [None] * len(order)
+    border = []
+    num_clusters = 0
+    for tile, (tile_centers, tile_border) in zip(tile_keys, results):
+        inner_centers = set()
+        for ind, center, on_border in zip(tiles[tile], tile_centers, tile_border):
+            if on_border:
+                border.append(ind)
+            else:
+                centers[ind] = center
+                inner_centers.add(center)
+        num_clusters += len(inner_centers)
+    border.sort()
+    border_centers, border_clusters = cluster_order_grid(radius, [order[ind] for ind in border])
+    for ind, center in zip(border, border_centers):
+        centers[ind] = center
+    return dict(zip(order, centers)), num_clusters + border_clusters
+
+'''
+    agreement_fraction
+    Fraction of the locations that got the same center in two clusterings
+'''
+def agreement_fraction(clustered, reference):
+    if not reference:
+        return 1.0
+    return sum(1 for location in reference if clustered.get(location) == reference[location]) / float(len(reference))
+
+def run(radius, files, output_files, engine=DEFAULT_ENGINE):
+    locations, num_clusters = cluster(radius, files, output_files, engine)
     filenum = 0
     for file in files:
         with open(file, 'r') as rf, open(output_files[filenum], 'w+') as wf:
@@ -81,4 +416,29 @@ def run(radius, files, output_files):
                 segment_num = line.split('\t', 1)[0]
                 wf.write('%s\t%f %f\n' % (segment_num, locations[lat_long][0], locations[lat_long][1]))
             filenum += 1
-                
\ No newline at end of file
+                
+'''
+    run_store
+    Same as run, but cluster the locations in the observation store, write the clustered
+    start and end locations to output_files and store the centers next to the parsed locations
+'''
+def run_store(radius, store_path, output_files, engine=DEFAULT_ENGINE):
+    locations, num_clusters = cluster_locations(radius, load_store(store_path), engine)
+    write_store_clusters(locations, store_path, output_files)
+    return num_clusters
+
+'''
+    write_store_clusters
+    Write the clustered locations of the store to output_files and store the centers
+'''
+def write_store_clusters(locations, store_path, output_files):
+    import preprocessing.store as store
+    columns, meta = store.load(store_path)
+    segments = columns['segment'].tolist()
+    for prefix, output_file in zip(['start', 'end'], output_files):
+        with open(output_file, 'w+') as wf:
+            for segment_num, lon, lat in zip(segments, columns[prefix + '_lon'].tolist(), columns[prefix + '_lat'].tolist()):
+                center = locations[(lon, lat)]
+                wf.write('%d\t%f %f\n' % (segment_num, center[0], center[1]))
+    del columns
+    store.apply_clusters(store_path, locations)
@@ -12,4 +12,47 @@ assert(round(dist,3) == 0.549)
 mean = ClusterGPS.compute_marked_mean([(1, 1), (2, 2), (3, 3)])
 assert(mean == (2, 2))
 
-ClusterGPS.run(50, ['location2.txt'], ['location2_output.txt'])
\ No newline at end of file
+ClusterGPS.run(50, ['location2.txt'], ['location2_output.txt'])
+
+# The grid and numpy engines have to give the same clusters as scanning every location
+locations = dict(((round(-122.0 + 0.0007 * (i % 37) + 0.01 * (i % 5), 4), round(37.0 + 0.0009 * (i % 23) + 0.01 * (i % 3), 4)), 0) for i in range(400))
+for radius in [0.05, 0.2, 1.0]:
+    brute = ClusterGPS.cluster_locations(radius, locations, 'brute')
+    assert(ClusterGPS.cluster_locations(radius, locations, 'grid') == brute)
+    assert(ClusterGPS.cluster_locations(radius, locations, 'numpy') == brute)
+for engine in ['grid', 'numpy']:
+    assert(ClusterGPS.cluster(50, ['location2.txt'], None, engine) == ClusterGPS.cluster(50, ['location2.txt'], None, 'brute'))
+# Tiles only differ from the sequential clusters near tile borders
+for radius in [0.05, 0.2, 1.0]:
+    grid = ClusterGPS.cluster_locations(radius, locations, 'grid')
+    tiles = ClusterGPS.cluster_locations_tiles(radius, locations, processes=2, tile_cells=4)
+    assert(ClusterGPS.agreement_fraction(tiles[0], grid[0]) >= ClusterGPS.TILES_AGREEMENT)
+assert(ClusterGPS.agreement_fraction(grid[0], grid[0]) == 1.0)
+
+# Snapping keeps every cell apart unless asked to merge, and a run of dense cells
+# merges into groups around their first cell instead of one location
+import snap
+band = dict(((round(-122.0 + 0.00005 * i, 6), 37.0), 0) for i in range(4000))
+snapped, cells = ClusterGPS.cluster_locations(0.1, band, 'snap')
+merged, groups = snap.cluster_locations(0.1, band, merge_count=10)
+assert(cells > 50 and groups >= cells // 3)
+
+# Grid and numpy have to stay far from the quadratic scan on larger sets, counted in
+# distance evaluations so the check does not depend on the machine (timings are in
+# benchmark_clustering.py)
+import BenchClusterGPS
+many = BenchClusterGPS.synthetic_locations(20000)
+haversine, haversine_block = ClusterGPS.compute_haversine_distance, ClusterGPS.haversine_block
+evaluations = [0]
+def counted_haversine(center, location):
+    evaluations[0] += 1
+    return haversine(center, location)
+def counted_block(center, lon, lat, cos_lat):
+    evaluations[0] += len(lon)
+    return haversine_block(center, lon, lat, cos_lat)
+ClusterGPS.compute_haversine_distance, ClusterGPS.haversine_block = counted_haversine, counted_block
+for engine in ['grid', 'numpy']:
+    evaluations[0] = 0
+    ClusterGPS.cluster_locations(0.1, many, engine)
+    assert(evaluations[0] < 10 * len(many))
+ClusterGPS.compute_haversine_distance, ClusterGPS.haversine_block = haversine, haversine_block
@@ -0,0 +1,259 @@
+'''
+    centroids.py
+    Persisted cluster centers for incremental clustering
+    Every cluster keeps the label (center) it was first written with, so the location
+    strings in the observation files, earlier PSL results and truth labels stay valid,
+    while a running mean of its member locations decides which new locations join it.
+    New locations within radius of a running mean join that cluster, the rest are
+    clustered among themselves into new clusters
+'''
+
+import json
+import os
+
+import numpy as np
+
+import cluster.ClusterGPS as ClusterGPS
+import preprocessing.store as store
+
+CENTER_COLUMNS = ['label_lon', 'label_lat', 'sum_lon', 'sum_lat', 'count']
+KNOWN_COLUMNS = ['known_lon', 'known_lat', 'known_cluster']
+COLUMNS = CENTER_COLUMNS + KNOWN_COLUMNS
+
+META_FILE = 'meta.json'
+
+# Rows of new locations measured against every center at once
+ASSIGN_BLOCK = 256
+
+def location_keys(lon, lat):
+    # Complex numbers sort by lon then lat, which makes exact lookups a searchsorted
+    return np.asarray(lon, dtype=np.float64) + 1j * np.asarray(lat, dtype=np.float64)
+
+'''
+    CentroidStore
+    Cluster labels with the running sums and member counts of their distinct
+    locations, every distinct location seen so far with its cluster, how many
+    store rows are clustered, where each clustered output file ends and the
+    engine of the clustering the centers came from
+'''
+class CentroidStore(object):
+
+    def __init__(self, radius, columns, rows=0, offsets=None, engine=None):
+        self.radius = radius
+        self.engine = engine
+        self.columns = columns
+        self.rows = rows
+        self.offsets = offsets or {}
+
+    def __len__(self):
+        return len(self.columns['count'])
+
+    def labels(self):
+        return np.column_stack((self.columns['label_lon'], self.columns['label_lat']))
+
+    def means(self):
+        count = self.columns['count']
+        return np.column_stack((self.columns['sum_lon'] / count, self.columns['sum_lat'] / count))
+
+    '''
+        lookup
+        Cluster of each (lon, lat) row of points that was seen before, -1 otherwise
+    '''
+    def lookup(self, points):
+        keys = location_keys(self.columns['known_lon'], self.columns['known_lat'])
+        order = np.argsort(keys)
+        wanted = location_keys(points[:, 0], points[:, 1])
+        found = np.searchsorted(keys[order], wanted)
+        found = np.minimum(found, max(len(keys) - 1, 0))
+        clusters = np.full(len(points), -1, dtype=np.int64)
+        if len(keys):
+            hit = keys[order][found] == wanted
+            clusters[hit] = self.columns['known_cluster'][order[found[hit]]]
+        return clusters
+
+    '''
+        nearest
+        Closest running mean within radius of each point, -1 when there is none
+    '''
+    def nearest(self, points):
+        clusters = np.full(len(points), -1, dtype=np.int64)
+        if len(self) == 0:
+            return clusters
+        means = np.radians(np.abs(self.means()))
+        cos_mean = np.cos(means[:, 1])
+        for first in range(0, len(points), ASSIGN_BLOCK):
+            block = np.radians(np.abs(points[first:first + ASSIGN_BLOCK]))
+            lon, lat = block[:, 0:1], block[:, 1:2]
+            a = np.sin((means[None, :, 1] - lat) / 2) ** 2 + np.cos(lat) * cos_mean[None, :] * np.sin((means[None, :, 0] - lon) / 2) ** 2
+            distances = ClusterGPS.EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+            closest = np.argmin(distances, axis=1)
+            within = distances[np.arange(len(block)), closest] <= self.radius
+            clusters[first:first + ASSIGN_BLOCK][within] = closest[within]
+        return clusters
+
+    '''
+        add_locations
+        Add new distinct locations to their clusters, clusters beyond the current
+        ones are created with the given labels
+    '''
+    def add_locations(self, points, clusters, new_labels):
+        columns = self.columns
+        if len(new_labels):
+            columns['label_lon'] = np.concatenate((columns['label_lon'], new_labels[:, 0]))
+            columns['label_lat'] = np.concatenate((columns['label_lat'], new_labels[:, 1]))
+            for name in ['sum_lon', 'sum_lat', 'count']:
+                columns[name] = np.concatenate((columns[name], np.zeros(len(new_labels), dtype=columns[name].dtype)))
+        size = len(columns['count'])
+        columns['sum_lon'] = columns['sum_lon'] + np.bincount(clusters, weights=points[:, 0], minlength=size)
+        columns['sum_lat'] = columns['sum_lat'] + np.bincount(clusters, weights=points[:, 1], minlength=size)
+        columns['count'] = columns['count'] + np.bincount(clusters, minlength=size)
+        columns['known_lon'] = np.concatenate((columns['known_lon'], points[:, 0]))
+        columns['known_lat'] = np.concatenate((columns['known_lat'], points[:, 1]))
+        columns['known_cluster'] = np.concatenate((columns['known_cluster'], clusters))
+
+    '''
+        assign
+        Cluster of every (lon, lat) row of distinct points, seen locations keep their
+        cluster, new ones join the nearest running mean within radius or are
+        clustered among themselves with engine
+        Returns (clusters, joined, created)
+    '''
+    def assign(self, points, engine=ClusterGPS.DEFAULT_ENGINE):
+        clusters = self.lookup(points)
+        new = np.flatnonzero(clusters < 0)
+        clusters[new] = self.nearest(points[new])
+        joined = int((clusters[new] >= 0).sum())
+        alone = new[clusters[new] < 0]
+        new_labels = np.zeros((0, 2))
+        if len(alone):
+            alone_points = [tuple(point) for point in points[alone].tolist()]
+            clustered, num_clusters = ClusterGPS.cluster_locations(self.radius, dict((point, 0) for point in alone_points), engine)
+            label_ids = {}
+            for ind, point in zip(alone.tolist(), alone_points):
+                label = clustered[point]
+                if label not in label_ids:
+                    label_ids[label] = len(self) + len(label_ids)
+                clusters[ind] = label_ids[label]
+            new_labels = np.array(sorted(label_ids, key=label_ids.get), dtype=np.float64).reshape(-1, 2)
+        self.add_locations(points[new], clusters[new], new_labels)
+        return clusters, joined, len(new_labels)
+
+'''
+    from_clusters
+    Centroid store of a full clustering, clustered maps each distinct location to its center
+'''
+def from_clusters(radius, clustered, engine):
+    points = np.array(list(clustered), dtype=np.float64).reshape(-1, 2)
+    label_ids = {}
+    clusters = np.zeros(len(points), dtype=np.int64)
+    for ind, point in enumerate(clustered):
+        label = clustered[point]
+        if label not in label_ids:
+            label_ids[label] = len(label_ids)
+        clusters[ind] = label_ids[label]
+    labels = np.array(sorted(label_ids, key=label_ids.get), dtype=np.float64).reshape(-1, 2)
+    columns = {
+        'label_lon': labels[:, 0],
+        'label_lat': labels[:, 1],
+        'sum_lon': np.bincount(clusters, weights=points[:, 0], minlength=len(labels)),
+        'sum_lat': np.bincount(clusters, weights=points[:, 1], minlength=len(labels)),
+        'count': np.bincount(clusters, minlength=len(labels)).astype(np.int64),
+        'known_lon': points[:, 0],
+        'known_lat': points[:, 1],
+        'known_cluster': clusters
+    }
+    return CentroidStore(radius, columns, engine=engine)
+
+def save(centroids, centroid_path):
+    if not os.path.isdir(centroid_path):
+        os.makedirs(centroid_path)
+    for name in COLUMNS:
+        np.save(os.path.join(centroid_path, name + '.npy'), centroids.columns[name])
+    with open(os.path.join(centroid_path, META_FILE), 'w+') as wf:
+        json.dump({'radius': centroids.radius, 'engine': centroids.engine, 'rows': centroids.rows, 'offsets': centroids.offsets}, wf, indent=2)
+
+def load(centroid_path):
+    if not os.path.exists(os.path.join(centroid_path, META_FILE)):
+        return None
+    with open(os.path.join(centroid_path, META_FILE), 'r') as rf:
+        meta = json.load(rf)
+    columns = dict((name, np.load(os.path.join(centroid_path, name + '.npy'))) for name in COLUMNS)
+    # Centers saved before the engine was recorded never match one, they are clustered again
+    return CentroidStore(meta['radius'], columns, meta['rows'], meta['offsets'], meta.get('engine'))
+
+'''
+    run_full
+    Cluster every location in the store like ClusterGPS.run_store and persist the
+    centers to centroid_path for later incremental runs
+'''
+def run_full(radius, store_path, output_files, centroid_path, engine=ClusterGPS.DEFAULT_ENGINE):
+    locations, num_clusters = ClusterGPS.cluster_locations(radius, ClusterGPS.load_store(store_path), engine)
+    ClusterGPS.write_store_clusters(locations, store_path, output_files)
+    centroids = from_clusters(radius, locations, engine)
+    centroids.rows = store.load_meta(store_path)['count']
+    centroids.offsets = dict((output_file, os.path.getsize(output_file)) for output_file in output_files)
+    save(centroids, centroid_path)
+    print('Clustered %d locations into %d clusters' % (len(locations), num_clusters))
+    return num_clusters
+
+'''
+    can_continue
+    The centroids describe the clustered rows of the store, clustered with engine,
+    and the output files still hold those rows followed by the appended ones
+'''
+def can_continue(centroids, radius, engine, meta, output_files):
+    if centroids is None or centroids.radius != radius or centroids.engine != engine:
+        return False
+    if store.clustered_rows(meta) == 0 or centroids.rows != store.clustered_rows(meta):
+        return False
+    for output_file in output_files:
+        offset = centroids.offsets.get(output_file)
+        if offset is None or not os.path.exists(output_file) or os.path.getsize(output_file) < offset:
+            return False
+    return True
+
+'''
+    run_incremental
+    Cluster only the store rows appended since the last run (incremental ingestion)
+    against the persisted centers, rewrite the tail of output_files after the
+    clustered rows and apply the labels to the new store rows. Falls back to
+    run_full, which clusters the parsed coordinates of every row, when the
+    centroids do not match the store (say the radius or the engine changed)
+    Returns the number of new store rows clustered
+'''
+def run_incremental(radius, store_path, output_files, centroid_path, engine=ClusterGPS.DEFAULT_ENGINE):
+    meta = store.load_meta(store_path)
+    centroids = load(centroid_path)
+    if not can_continue(centroids, radius, engine, meta, output_files):
+        if not store.has_parsed_locations(store_path):
+            # Clustering the old centers again would not give the clusters of the parsed locations
+            raise ValueError('%s only holds cluster centers, parse the timeline again without incremental ingestion' % store_path)
+        run_full(radius, store_path, output_files, centroid_path, engine)
+        return meta['count']
+    first = centroids.rows
+    if first == meta['count']:
+        print('No new locations to cluster')
+        return 0
+    columns, meta = store.load(store_path)
+    start = store.locations(columns, 'start')[first:]
+    end = store.locations(columns, 'end')[first:]
+    segments = columns['segment'][first:].tolist()
+    del columns
+    points = np.vstack((start, end))
+    keys, first_seen, inverse = np.unique(location_keys(points[:, 0], points[:, 1]), return_index=True, return_inverse=True)
+    clusters, joined, created = centroids.assign(points[first_seen], engine)
+    labels = centroids.labels()
+    start_labels = labels[clusters[inverse[:len(start)]]]
+    end_labels = labels[clusters[inverse[len(start):]]]
+    for output_file, tail in zip(output_files, [start_labels, end_labels]):
+        with open(output_file, 'r+') as wf:
+            wf.seek(centroids.offsets[output_file])
+            wf.truncate()
+            for segment_num, (lon, lat) in zip(segments, tail.tolist()):
+                wf.write('%d\t%f %f\n' % (segment_num, lon, lat))
+            centroids.offsets[output_file] = wf.tell()
+    store.apply_tail_clusters(store_path, start_labels, end_labels)
+    centroids.rows = meta['count']
+    save(centroids, centroid_path)
+    print('Clustered %d new rows: %d new locations, %d joined existing clusters, %d new clusters' % (len(segments), len(first_seen), joined, created))
+    return len(segments)
@@ -0,0 +1,197 @@
+'''
+    snap.py
+    Snap locations to grid cells
+    A single pass alternative to mean shift clustering that can run as locations
+    are read: every location is replaced by the center of its cell, either a
+    geohash cell of a given precision or a square cell of a given size in km.
+    Optionally adjacent dense cells are merged afterwards, which needs the cell
+    counts and so a second pass. Output files have the segment #, tab, lon lat
+    lines ClusterGPS.run writes
+'''
+
+import argparse
+from collections import defaultdict
+from math import cos, degrees, floor, radians
+
+import numpy as np
+
+import ClusterGPS
+
+# Geohash characters, each adds 5 bits alternating between longitude and latitude
+DEFAULT_PRECISION = 7
+MAX_PRECISION = 12
+
+# Cells with at least this many locations are dense enough to merge with dense neighbors
+DEFAULT_MERGE_COUNT = 10
+
+'''
+    Snapper
+    Maps a location to its cell and a cell to its center. With precision the cells
+    are geohash cells (precision 7 is about 150m wide), with cell_km they are
+    cell_km tall and about cell_km wide in their latitude band
+'''
+class Snapper(object):
+
+    def __init__(self, precision=DEFAULT_PRECISION, cell_km=None):
+        self.precision = precision
+        self.cell_km = cell_km
+        if cell_km is not None:
+            self.lat_size = degrees(cell_km / ClusterGPS.EARTH_RADIUS)
+            return
+        if not 1 <= precision <= MAX_PRECISION:
+            raise ValueError('Geohash precision has to be between 1 and %d, got %d' % (MAX_PRECISION, precision))
+        bits = 5 * precision
+        self.lon_size = 360.0 / (1 << ((bits + 1) // 2))
+        self.lat_size = 180.0 / (1 << (bits // 2))
+
+    def band_lon_size(self, lat_cell):
+        band = (lat_cell + 0.5) * self.lat_size
+        return self.lat_size / max(cos(radians(min(abs(band), 89.0))), 1e-6)
+
+    def cell(self, location):
+        lat_cell = int(floor(location[1] / self.lat_size)) if self.cell_km is not None else int(floor((location[1] + 90.0) / self.lat_size))
+        lon_size = self.band_lon_size(lat_cell) if self.cell_km is not None else self.lon_size
+        lon_cell = int(floor(location[0] / lon_size)) if self.cell_km is not None else int(floor((location[0] + 180.0) / lon_size))
+        return (lon_cell, lat_cell)
+
+    '''
+        cells
+        cell for an (n, 2) array of lon/lat rows at once, returns (lon cells, lat cells)
+    '''
+    def cells(self, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if self.cell_km is None:
+            return np.floor((points[:, 0] + 180.0) / self.lon_size).astype(np.int64), np.floor((points[:, 1] + 90.0) / self.lat_size).astype(np.int64)
+        lat_cells = np.floor(points[:, 1] / self.lat_size).astype(np.int64)
+        # Few latitude bands, their widths come from band_lon_size so cell and cells agree
+        bands, inverse = np.unique(lat_cells, return_inverse=True)
+        lon_sizes = np.array([self.band_lon_size(band) for band in bands.tolist()], dtype=np.float64)[inverse]
+        return np.floor(points[:, 0] / lon_sizes).astype(np.int64), lat_cells
+
+    def center(self, cell):
+        lon_cell, lat_cell = cell
+        if self.cell_km is None:
+            return (round((lon_cell + 0.5) * self.lon_size - 180.0, 6), round((lat_cell + 0.5) * self.lat_size - 90.0, 6))
+        return (round((lon_cell + 0.5) * self.band_lon_size(lat_cell), 6), round((lat_cell + 0.5) * self.lat_size, 6))
+
+    def snap(self, location):
+        return self.center(self.cell(location))
+
+'''
+    adjacent
+    Whether cell is one of the 8 cells around first, the default reach of a merged group
+'''
+def adjacent(first, cell):
+    return abs(first[0] - cell[0]) <= 1 and abs(first[1] - cell[1]) <= 1
+
+'''
+    merge_dense_cells
+    Group every cell holding at least min_count locations with its dense neighbors
+    (8 around it), returns a dict from each merged cell to the first cell of its
+    group, cells that are not merged are left out. Groups start at the densest cell
+    left and only take cells for which within(first cell, cell) holds, so a run of
+    dense cells does not chain into one location
+'''
+def merge_dense_cells(counts, min_count=DEFAULT_MERGE_COUNT, within=adjacent):
+    # Densest first, ties go to the smallest cell so groups do not depend on dict order
+    dense = sorted((cell for cell, count in counts.items() if count >= min_count), key=lambda cell: (-counts[cell], cell))
+    dense_cells = set(dense)
+    merged = {}
+    for first in dense:
+        if first in merged:
+            continue
+        group, frontier = [first], [first]
+        merged[first] = first
+        while frontier:
+            lon_cell, lat_cell = frontier.pop()
+            for lon_step in (-1, 0, 1):
+                for lat_step in (-1, 0, 1):
+                    neighbor = (lon_cell + lon_step, lat_cell + lat_step)
+                    if neighbor in dense_cells and neighbor not in merged and within(first, neighbor):
+                        merged[neighbor] = first
+                        group.append(neighbor)
+                        frontier.append(neighbor)
+        if len(group) < 2:
+            del merged[first]
+    return merged
+
+'''
+    snap_segments
+    Snap (segment #, lon, lat) rows as they come, yields (segment #, center)
+'''
+def snap_segments(rows, snapper):
+    for segment_num, lon, lat in rows:
+        yield segment_num, snapper.snap((lon, lat))
+
+def iter_location_lines(rf):
+    for line in rf:
+        segment_num = line.split('\t', 1)[0]
+        yield segment_num, ClusterGPS.input_to_lat_long(line)
+
+'''
+    run
+    Snap the locations of files (segment #, tab, lon lat lines) and write them to
+    output_files. Without merge_count every line is written as it is read, with
+    it the cells of all files are counted first and dense neighbors merged
+    Returns the number of distinct centers written
+'''
+def run(files, output_files, precision=DEFAULT_PRECISION, cell_km=None, merge_count=None):
+    snapper = Snapper(precision, cell_km)
+    merged = {}
+    if merge_count is not None:
+        counts = defaultdict(int)
+        for file in files:
+            with open(file, 'r') as rf:
+                for segment_num, location in iter_location_lines(rf):
+                    counts[snapper.cell(location)] += 1
+        merged = merge_dense_cells(counts, merge_count)
+    centers = set()
+    for file, output_file in zip(files, output_files):
+        with open(file, 'r') as rf, open(output_file, 'w+') as wf:
+            for segment_num, location in iter_location_lines(rf):
+                cell = snapper.cell(location)
+                center = snapper.center(merged.get(cell, cell))
+                centers.add(center)
+                wf.write('%s\t%f %f\n' % (segment_num, center[0], center[1]))
+    return len(centers)
+
+'''
+    cluster_locations
+    ClusterGPS.cluster_locations for snapping, locations is a dict of (lon, lat)
+    keys. Cells are as wide as the clustering diameter (2 x radius). With
+    merge_count dense neighbors whose centers are within 2 x radius of their
+    group's first cell are merged into it
+    Returns (location to center dict, number of centers)
+'''
+def cluster_locations(radius, locations, merge_count=None):
+    snapper = Snapper(cell_km=2 * radius)
+    order = list(locations)
+    if not order:
+        return {}, 0
+    lon_cells, lat_cells = snapper.cells(np.array(order, dtype=np.float64))
+    cells = list(zip(lon_cells.tolist(), lat_cells.tolist()))
+    counts = defaultdict(int)
+    for cell in cells:
+        counts[cell] += 1
+    merged = {}
+    if merge_count is not None:
+        # Side neighbors are a cell apart, the slack covers centers rounded to 6 decimals,
+        # diagonal ones are sqrt(2) cells away and stay out
+        reach = 2 * radius * 1.01
+        merged = merge_dense_cells(counts, merge_count,
+            lambda first, cell: ClusterGPS.compute_haversine_distance(snapper.center(first), snapper.center(cell)) <= reach)
+    centers = dict((cell, snapper.center(merged.get(cell, cell))) for cell in counts)
+    clustered = dict((location, centers[cell]) for location, cell in zip(order, cells))
+    return clustered, len(set(centers.values()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Snap locations to grid cells')
+    parser.add_argument('files', nargs='+', help='Location files (segment #, tab, lon lat) to snap')
+    parser.add_argument('-o', '--output', nargs='+', required=True, help='Output file for each location file')
+    parser.add_argument('-p', '--precision', type=int, default=DEFAULT_PRECISION, help='Geohash precision in characters')
+    parser.add_argument('-k', '--cell-km', type=float, default=None, help='Use square cells of this size in km instead of geohash cells')
+    parser.add_argument('-m', '--merge', type=int, default=None, help='Merge adjacent cells with at least this many locations (reads the files twice)')
+    args = parser.parse_args()
+    if len(args.output) != len(args.files):
+        parser.error('Expected one output file per location file')
+    print('Snapped to %d centers' % run(args.files, args.output, args.precision, args.cell_km, args.merge))
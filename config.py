@@ -32,6 +32,17 @@ def make_path(name):
 def make_results_path(name):
     return join_dir_path(results_directory, name)
 
+'''
+    Multi-user ingestion, every user gets their own data directory
+    holding the same files as data_directory
+'''
+
+# Timelines to ingest in parallel, paths or glob patterns (build.py -t overrides)
+timeline_paths = []
+
+# Worker processes for multi-user ingestion, None uses every core
+ingest_processes = None
+
 '''
     Initial Parsed data observations (Shouldn't need to change)
 '''
@@ -72,6 +83,53 @@ end_time_path = make_path('end_time_obs.txt')
 # Segment day observations
 segment_day_path = make_path('segment_days_obs.txt')
 
+# Columnar store of the observations above, read by the python stages
+obs_store_path = make_path('obs_store')
+
+# Where incremental ingestion (build.py -i) left off in the timeline
+ingest_manifest_path = make_path('ingest_manifest.json')
+
+# Combined summary of a multi-user ingestion
+ingest_summary_path = make_path('ingest_summary.tsv')
+
+# What every build.py stage last ran with, stages whose inputs are unchanged are skipped
+stage_cache_path = make_path('stage_cache.json')
+
+# Radius ClusterGPS coalesces locations with
+cluster_radius = 0.1
+
+# ClusterGPS engine, see cluster.ClusterGPS.ENGINES
+cluster_engine = 'grid'
+
+# Cluster centers kept between runs so incremental runs (build.py -i) only cluster new locations
+centroid_store_path = make_path('centroids')
+
+# At most this many shards of the observations for independent inference runs, 1 writes none
+num_shards = 1
+
+# One observation directory per shard, see preprocessing/sharding.py
+shards_path = make_path('shards')
+
+# Same day, time compatible segment pairs InferFrequentTrips joins instead of every two segments of a day
+same_day_pairs_path = make_path('same_day_pairs_obs.txt')
+
+same_day_pair_counts_path = make_path('same_day_pair_counts.txt')
+
+# EqualLocations and Near pairs the PSL programs load as closed predicates instead of parsing locations per grounding
+equal_locations_path = make_path('equal_obs.txt')
+
+near_locations_path = make_path('near_obs.txt')
+
+# Smallest ManhattanNear value kept in near_obs.txt, None writes no file and keeps the Near function
+# (no active rule uses Near, and it is 1 within a degree so a city's locations are all near)
+near_cutoff = None
+
+# Load only the target atoms some rule can ground instead of cross products, see preprocessing/candidates.py
+use_candidates = True
+
+# Also pair candidate trip ends with the locations within this many km, None for only the observed pairs
+candidate_radius = None
+
 '''
     Grounded Nodes
 '''
@@ -90,6 +148,34 @@ grounded_times = make_path('grounded_frequent_times.txt')
 
 trip_modes_times_path = make_path('trip_modes_times.txt')
 
+# How anchors are inferred: 'closed_form' solves Bipedal's anchor rules directly (inference/anchors.py),
+# 'psl' runs Bipedal.groovy, which is needed once its rules stop being per location
+anchor_engine = 'closed_form'
+
+# How frequent trips and their times and modes are inferred: 'psl' runs the Groovy programs,
+# 'admm' grounds and solves InferFrequentTrips' and InferTripInfo's rules in process (inference/)
+# and leaves out the atoms no rule grounds. Only use 'admm' once benchmark_inference.py finds no
+# atom more than its tolerance (0.02) from the Groovy programs on the data
+trip_engine = 'psl'
+
+# Threads of the ADMM engine
+inference_threads = 1
+
+# Heap in GB the PSL programs may use for grounding, build.py estimates every Groovy stage
+# first (inference/preflight.py) and refuses to launch one over it
+grounding_budget_gb = 48
+
+# Restrict a stage over the budget to candidate targets before refusing it
+grounding_fallback_candidates = True
+
+# How the Groovy programs are started: 'scripts' runs run*.sh, 'java' starts a JVM per stage
+# without recompiling unchanged sources, 'worker' runs every stage in one JVM (inference/launcher.py)
+# once the worker smoke run in the README passes
+psl_launcher = 'java'
+
+# Largest heap in GB a JVM gets, below it the heap is sized from the grounding estimate
+max_heap_gb = 57
+
 num_anchors = 50
 
 num_frequent_trips = 50
@@ -1,105 +1,423 @@
 '''
     generator.py
     Ankur Goswami, agoswam3@ucsc.edu
-    Generate dummy data
+    Generate synthetic e-mission timelines with matching truth files
+    Every user gets a home, a work place and a few other anchors, and every day
+    follows a commute chain drawn from the weekday or weekend templates below.
+    Sampling is vectorized with NumPy a chunk of days at a time and seeded, so the
+    same arguments always write the same files, from 10^3 to 10^7 segments
 '''
 
-import random
+import argparse
+import os
 
-def generate(n=20):
-    generate_segments(n)
-    generate_locations(n)
-    generate_times(n)
-    generate_modes(n)
-    generate_days(n)
+import numpy as np
+
+# Stop roles in the day templates, anchors 2 and up are the user's other places
+HOME = 0
+WORK = 1
+# A random one of the user's other anchors
+OTHER = -2
+# A one-off place that is not an anchor
+ERRAND = -1
+
+# (stops, departure hour of each trip between consecutive stops)
+WEEKDAY_TEMPLATES = [
+    ([HOME, WORK, HOME], [8.5, 17.5]),
+    ([HOME, WORK, OTHER, HOME], [8.5, 17.0, 19.0]),
+    ([HOME, WORK, ERRAND, WORK, HOME], [8.0, 12.0, 13.0, 17.5]),
+    ([HOME, OTHER, HOME], [10.0, 14.0])
+]
+WEEKDAY_WEIGHTS = [0.5, 0.25, 0.15, 0.1]
+
+WEEKEND_TEMPLATES = [
+    ([HOME], []),
+    ([HOME, OTHER, HOME], [11.0, 15.0]),
+    ([HOME, ERRAND, OTHER, HOME], [10.0, 13.0, 18.0])
+]
+WEEKEND_WEIGHTS = [0.3, 0.5, 0.2]
+
+# Modes in sensed_mode order, see parse.get_cleaned_mode
+MODES = ['automotive', 'cycling', 'walking']
+UNKNOWN_MODE = 4
+# km/h
+MODE_SPEEDS = np.array([35.0, 15.0, 5.0])
+
+# Areas users live in, (min lon, max lon, min lat, max lat)
+REGION = (-122.45, -121.85, 36.95, 37.8)
+
+METERS_PER_DEGREE = 111320.0
+TIMEZONE = 'America/Los_Angeles'
+UTC_OFFSET = 8 * 3600
+EPOCH = np.datetime64('1970-01-01T00:00', 'm')
+
+# Departure histogram resolution used for the estimated trip times
+TIME_BINS = 96
+
+PLACES_HEADER = 'Location\tTruth\tMap\tAnchor Rating\tLabel\n'
+TRIPS_HEADER = 'Location\tType\tColor\tTruth\tMap\tTrip Rating\tTrip Mode\tEstimated Start Time\tEstimated End Time\tLabel\n'
+
+LOCAL_DT = '{"year": %d, "month": %d, "day": %d, "hour": %d, "minute": %d, "second": %d, "weekday": %d, "timezone": "' + TIMEZONE + '"}'
+SECTION_ENTRY = ('{"_id": {"$oid": "%024x"}, "metadata": {"key": "analysis/cleaned_section", "write_ts": %.3f}, '
+    '"data": {"start_ts": %.3f, "end_ts": %.3f, '
+    '"start_loc": {"type": "Point", "coordinates": [%.7f, %.7f]}, "end_loc": {"type": "Point", "coordinates": [%.7f, %.7f]}, '
+    '"start_local_dt": %s, "end_local_dt": %s, "duration": %.1f, "distance": %.1f, "sensed_mode": %d}}')
+LOCATION_ENTRY = ('{"_id": {"$oid": "%024x"}, "metadata": {"key": "background/location", "write_ts": %.3f}, '
+    '"data": {"ts": %.3f, "longitude": %.7f, "latitude": %.7f, "accuracy": %.1f, "local_dt": %s}}')
+MOTION_ENTRY = ('{"_id": {"$oid": "%024x"}, "metadata": {"key": "background/motion_activity", "write_ts": %.3f}, '
+    '"data": {"ts": %.3f, "stationary": %s, "automotive": %s, "cycling": %s, "walking": %s, "running": false, "local_dt": %s}}')
+TRANSITION_ENTRY = ('{"_id": {"$oid": "%024x"}, "metadata": {"key": "statemachine/transition", "write_ts": %.3f}, '
+    '"data": {"ts": %.3f, "transition": "%s", "curr_state": "%s"}}')
+
+class UserModel(object):
+
+    '''
+        anchors: (n, 2) lon/lat of home, work and the other anchors
+        preferred: (n, n) mode index used between each pair of anchors
+    '''
+    def __init__(self, name, anchors, preferred):
+        self.name = name
+        self.anchors = anchors
+        self.preferred = preferred
 
 '''
-    generate_segments
-    generate n segments
+    offset
+    Move points by (east, north) meters
 '''
-def generate_segments(n):
-    with open('segment_obs.txt', 'w') as f:
-        for i in range(0, n):
-            f.write('%d\n' % i)
-        f.close()
+def offset(lon, lat, east, north):
+    return lon + east / (METERS_PER_DEGREE * np.cos(np.radians(lat))), lat + north / METERS_PER_DEGREE
+
+def distance_km(lon1, lat1, lon2, lat2):
+    x = (lon2 - lon1) * np.cos(np.radians((lat1 + lat2) / 2.0))
+    return np.hypot(x, lat2 - lat1) * METERS_PER_DEGREE / 1000.0
 
 '''
-    generate_locations
-    generate locations for our model
-    n is the number of segments
+    mode_for_distance
+    Walk short trips, drive long ones, otherwise sample from mode_mix
+'''
+def mode_for_distance(rs, distances, mode_mix):
+    modes = rs.choice(len(MODES), size=distances.shape, p=mode_mix)
+    modes[(distances > 5.0) & (modes == 2)] = 0
+    modes[(distances > 15.0) & (modes == 1)] = 0
+    modes[distances < 0.8] = 2
+    return modes
+
+def make_user(rs, name, anchors, mode_mix):
+    center_lon = rs.uniform(REGION[0], REGION[1])
+    center_lat = rs.uniform(REGION[2], REGION[3])
+    # Work 3 to 20km from home, the other anchors within 8km
+    radii = np.concatenate(([0.0, rs.uniform(3000, 20000)], rs.uniform(500, 8000, anchors - 2)))
+    angles = rs.uniform(0, 2 * np.pi, anchors)
+    lon, lat = offset(center_lon, center_lat, radii * np.cos(angles), radii * np.sin(angles))
+    points = np.column_stack((lon, lat))
+    distances = distance_km(lon[:, None], lat[:, None], lon[None, :], lat[None, :])
+    return UserModel(name, points, mode_for_distance(rs, distances, mode_mix))
 
-    general idea: There is a probability distribution for locations
-    generate the distribution and populate n entries based on it.
 '''
-def generate_locations(n):
-    location1 = (float(random.randint(0, 100)), float(random.randint(0, 100)))
-    location2 = (float(random.randint(0, 100)), float(random.randint(0, 100)))
-    print 'Location1: %s, Location2: %s' % (location1, location2)
-    with open('start_location_obs.txt', 'w') as f:
-        for i in range(0, n):
-            val = random.gauss(0, 1)
-            # Adding some noise to the location values
-            n1, n2 = random.uniform(-1, 1), random.uniform(-1, 1)
-            if val > 0 and val < 0.5:
-                f.write('%d\t%0.2f %0.2f\n' % (i, location1[0] + n1, location1[1] + n2))
-            elif val <= 0 and val > -0.5:
-                f.write('%d\t%0.2f %0.2f\n' % (i, location2[0] + n1, location2[1] + n2))
-            else:
-                f.write('%d\t%0.2f %0.2f\n' % (i, location1[0] + float(random.randint(-10, 10)) + n1, location1[1] + float(random.randint(-10, 10)) + n2))
-        f.close()
-    with open('end_location_obs.txt', 'w') as f:
-        for i in range(0, n):
-            val = random.gauss(0, 1)
-            n1, n2 = random.uniform(-1, 1), random.uniform(-1, 1)
-            if val > 0 and val < 0.5:
-                f.write('%d\t%0.2f %0.2f\n' % (i, location1[0] + n1, location1[1] + n2))
-            elif val <= 0 and val > -0.5:
-                f.write('%d\t%0.2f %0.2f\n' % (i, location2[0] + n1, location2[1] + n2))
+    template_table
+    Pad templates into (stops, hours, trip counts) arrays indexed by template
+'''
+def template_table(templates):
+    length = max(len(hours) for stops, hours in templates)
+    stops = np.full((len(templates), length + 1), HOME, dtype=np.int64)
+    hours = np.zeros((len(templates), length))
+    trips = np.zeros(len(templates), dtype=np.int64)
+    for ind, (template_stops, template_hours) in enumerate(templates):
+        stops[ind, :len(template_stops)] = template_stops
+        hours[ind, :len(template_hours)] = template_hours
+        trips[ind] = len(template_hours)
+    return stops, hours, trips
+
+'''
+    TripBatch
+    Columns of the trips of a chunk of days, one entry per trip
+'''
+class TripBatch(object):
+
+    def __init__(self, **columns):
+        self.__dict__.update(columns)
+
+    def __len__(self):
+        return len(self.depart)
+
+    def head(self, n):
+        return TripBatch(**dict((name, values[:n]) for name, values in self.__dict__.items()))
+
+'''
+    sample_days
+    Sample the trips of days first_day to first_day + days (days since start_date)
+'''
+def sample_days(rs, user, start_day, first_day, days, options):
+    day_index = np.arange(first_day, first_day + days)
+    weekday = (start_day + day_index + 3) % 7
+    weekend = weekday >= 5
+    weekday_stops, weekday_hours, weekday_trips = template_table(WEEKDAY_TEMPLATES)
+    weekend_stops, weekend_hours, weekend_trips = template_table(WEEKEND_TEMPLATES)
+    width = max(weekday_hours.shape[1], weekend_hours.shape[1])
+    stops = np.full((days, width + 1), HOME, dtype=np.int64)
+    hours = np.zeros((days, width))
+    trips = np.zeros(days, dtype=np.int64)
+    for mask, (t_stops, t_hours, t_trips), weights in [(~weekend, (weekday_stops, weekday_hours, weekday_trips), WEEKDAY_WEIGHTS), (weekend, (weekend_stops, weekend_hours, weekend_trips), WEEKEND_WEIGHTS)]:
+        choice = rs.choice(len(weights), size=mask.sum(), p=weights)
+        stops[mask, :t_stops.shape[1]] = t_stops[choice]
+        hours[mask, :t_hours.shape[1]] = t_hours[choice]
+        trips[mask] = t_trips[choice]
+    others = stops == OTHER
+    stops[others] = rs.randint(2, len(user.anchors), others.sum())
+    # Every stop gets coordinates, an errand is a fresh place within a few km of home
+    lon = user.anchors[np.maximum(stops, 0), 0]
+    lat = user.anchors[np.maximum(stops, 0), 1]
+    errands = stops == ERRAND
+    spread = rs.normal(0, 3000, (2, errands.sum()))
+    lon[errands], lat[errands] = offset(user.anchors[HOME, 0], user.anchors[HOME, 1], spread[0], spread[1])
+    valid = np.arange(width)[None, :] < trips[:, None]
+    origin, dest = stops[:, :-1][valid], stops[:, 1:][valid]
+    origin_lon, origin_lat = lon[:, :-1][valid], lat[:, :-1][valid]
+    dest_lon, dest_lat = lon[:, 1:][valid], lat[:, 1:][valid]
+    day = np.repeat(day_index, trips)
+    depart = day * 1440.0 + hours[valid] * 60.0 + rs.normal(0, 15, len(day))
+    distance = distance_km(origin_lon, origin_lat, dest_lon, dest_lat)
+    anchor_trip = (origin >= 0) & (dest >= 0)
+    mode = mode_for_distance(rs, distance, options['mode_mix'])
+    mode[anchor_trip] = user.preferred[origin[anchor_trip], dest[anchor_trip]]
+    switch = rs.rand(len(mode)) < options['mode_noise']
+    mode[switch] = rs.choice(len(MODES), size=switch.sum(), p=options['mode_mix'])
+    duration = distance / MODE_SPEEDS[mode] * 60.0 + 2.0 + rs.exponential(3.0, len(mode))
+    # GPS jitter on both ends of every trip
+    jitter = rs.normal(0, options['jitter'], (4, len(mode)))
+    origin_lon, origin_lat = offset(origin_lon, origin_lat, jitter[0], jitter[1])
+    dest_lon, dest_lat = offset(dest_lon, dest_lat, jitter[2], jitter[3])
+    sensed = mode.copy()
+    sensed[rs.rand(len(mode)) < options['unknown_mode']] = UNKNOWN_MODE
+    return TripBatch(origin=origin, dest=dest, origin_lon=origin_lon, origin_lat=origin_lat, dest_lon=dest_lon, dest_lat=dest_lat,
+        depart=depart, arrive=depart + duration, distance=distance, mode=mode, sensed=sensed)
+
+'''
+    local_fields
+    Calendar fields of minutes since start_date, as lists
+    (year, month, day, hour, minute, second, weekday, epoch seconds)
+'''
+def local_fields(start_date, minutes):
+    whole = np.floor(minutes)
+    dt = start_date + whole.astype(np.int64).astype('m8[m]')
+    days = dt.astype('M8[D]')
+    months = dt.astype('M8[M]')
+    year = dt.astype('M8[Y]').astype(np.int64) + 1970
+    month = months.astype(np.int64) % 12 + 1
+    day = (days - months.astype('M8[D]')).astype(np.int64) + 1
+    minute_of_day = (dt - days.astype('M8[m]')).astype(np.int64)
+    second = np.floor((minutes - whole) * 60).astype(np.int64)
+    weekday = (days.astype(np.int64) + 3) % 7
+    ts = (dt - EPOCH).astype(np.int64) * 60.0 + second + UTC_OFFSET
+    return [values.tolist() for values in [year, month, day, minute_of_day // 60, minute_of_day % 60, second, weekday]] + [ts.tolist()]
+
+def json_bool(value):
+    return 'true' if value else 'false'
+
+'''
+    TimelineWriter
+    Streams entries into a JSON array, separators are written before each entry
+'''
+class TimelineWriter(object):
+
+    def __init__(self, path):
+        self.handle = open(path, 'w', 1024 * 1024)
+        self.handle.write('[')
+        self.entries = 0
+
+    def write(self, entry):
+        self.handle.write(',\n' if self.entries else '\n')
+        self.handle.write(entry)
+        self.entries += 1
+
+    def close(self):
+        self.handle.write('\n]\n')
+        self.handle.close()
+
+'''
+    write_trips
+    Write the cleaned sections of batch, with raw the motion activity and location
+    entries around them as well so parse.iter_segments finds the same segments
+'''
+def write_trips(rs, writer, batch, start_date, raw, transition_rate):
+    start = local_fields(start_date, batch.depart)
+    end = local_fields(start_date, batch.arrive)
+    start_ts, end_ts = start[-1], end[-1]
+    start_dt = [LOCAL_DT % fields for fields in zip(*start[:-1])]
+    end_dt = [LOCAL_DT % fields for fields in zip(*end[:-1])]
+    columns = [batch.origin_lon.tolist(), batch.origin_lat.tolist(), batch.dest_lon.tolist(), batch.dest_lat.tolist(),
+        batch.distance.tolist(), batch.mode.tolist(), batch.sensed.tolist()]
+    transitions = (rs.rand(len(batch)) < transition_rate).tolist()
+    accuracy = rs.uniform(5, 30, (2, len(batch))).tolist()
+    for ind, (o_lon, o_lat, d_lon, d_lat, distance, mode, sensed) in enumerate(zip(*columns)):
+        if raw:
+            flags = [json_bool(mode == code) for code in range(len(MODES))]
+            writer.write(MOTION_ENTRY % (writer.entries, start_ts[ind], start_ts[ind], 'false', flags[0], flags[1], flags[2], start_dt[ind]))
+            writer.write(LOCATION_ENTRY % (writer.entries, start_ts[ind] + 1, start_ts[ind] + 1, o_lon, o_lat, accuracy[0][ind], start_dt[ind]))
+            writer.write(LOCATION_ENTRY % (writer.entries, end_ts[ind] - 1, end_ts[ind] - 1, d_lon, d_lat, accuracy[1][ind], end_dt[ind]))
+            writer.write(MOTION_ENTRY % (writer.entries, end_ts[ind], end_ts[ind], 'true', 'false', 'false', 'false', end_dt[ind]))
+            if transitions[ind]:
+                writer.write(TRANSITION_ENTRY % (writer.entries, end_ts[ind] + 1, end_ts[ind] + 1, 'T_VISIT_STARTED', 'STATE_WAITING_FOR_TRIP_START'))
+        writer.write(SECTION_ENTRY % (writer.entries, end_ts[ind] + 60, start_ts[ind], end_ts[ind], o_lon, o_lat, d_lon, d_lat,
+            start_dt[ind], end_dt[ind], end_ts[ind] - start_ts[ind], distance * 1000.0, sensed))
+
+'''
+    TruthCounts
+    Running counts of the anchor trips, used to rate places and trips
+'''
+class TruthCounts(object):
+
+    def __init__(self, anchors):
+        self.visits = np.zeros(anchors, dtype=np.int64)
+        self.trips = np.zeros((anchors, anchors), dtype=np.int64)
+        self.modes = np.zeros((anchors, anchors, len(MODES)), dtype=np.int64)
+        self.departs = np.zeros((anchors, anchors, TIME_BINS), dtype=np.int64)
+        self.durations = np.zeros((anchors, anchors))
+        self.errands = []
+        self.days = 0
+
+    def add(self, batch, max_errands):
+        anchor_trip = (batch.origin >= 0) & (batch.dest >= 0)
+        origin, dest = batch.origin[anchor_trip], batch.dest[anchor_trip]
+        self.visits += np.bincount(batch.dest[batch.dest >= 0], minlength=len(self.visits))
+        np.add.at(self.trips, (origin, dest), 1)
+        np.add.at(self.modes, (origin, dest, batch.mode[anchor_trip]), 1)
+        np.add.at(self.departs, (origin, dest, time_bins(batch.depart[anchor_trip])), 1)
+        np.add.at(self.durations, (origin, dest), batch.arrive[anchor_trip] - batch.depart[anchor_trip])
+        errand = batch.dest < 0
+        for lon, lat in zip(batch.dest_lon[errand][:max_errands].tolist(), batch.dest_lat[errand][:max_errands].tolist()):
+            if len(self.errands) < max_errands:
+                self.errands.append((lon, lat))
+
+def time_bins(minutes):
+    return (np.mod(minutes, 1440) * TIME_BINS // 1440).astype(np.int64)
+
+'''
+    clock_time
+    Format minutes after midnight like '8:30 AM'
+'''
+def clock_time(minutes):
+    minutes = int(minutes) % 1440
+    hour, minute = minutes // 60, minutes % 60
+    return '%d:%02d %s' % ((hour + 11) % 12 + 1, minute, 'AM' if hour < 12 else 'PM')
+
+def truth_location(lon, lat):
+    return '%0.4f,%0.4f' % (lat, lon)
+
+'''
+    write_places
+    Anchors rated 3 (home, work) or 2 (other anchors visited every other week),
+    rarely visited anchors and errands are rated 1. Each section opens with the
+    header, the way the exported geosheets were concatenated
+'''
+def write_places(path, user, counts):
+    weeks = max(counts.days / 7.0, 1.0)
+    with open(path, 'w+') as wf:
+        wf.write(PLACES_HEADER)
+        wf.write(PLACES_HEADER)
+        for ind, (lon, lat) in enumerate(user.anchors.tolist()):
+            if ind < 2:
+                rating, label = 3, ['Home', 'Work'][ind]
             else:
-                print location2[1] + float(random.randint(-10, 10))
-                f.write('%d\t%0.2f %0.2f\n' % (i, location2[1] + float(random.randint(-10, 10)) + n1, location2[1] + float(random.randint(-10, 10)) + n2))
-        f.close()
-
-'''
-    generate_times
-    generates times for the model
-    simply iterate between Morning, Afternoon, Evening, and Night
-'''
-def generate_times(n):
-    times = ['Morning', 'Afternoon', 'Evening', 'Night']
-    with open('start_time_obs.txt', 'w') as f:
-        for i in range(0, n):
-            f.write('%d\t%s\n' % (i, times[i % 4]))
-    with open('end_time_obs.txt', 'w') as f:
-        for i in range(0, n):
-            f.write('%d\t%s\n' % (i, times[i % 4]))
-
-'''
-    generate_modes
-    randomly choose between Bike, Drive, and Walk for each segment
-'''
-def generate_modes(n):
-    modes = ['Bike', 'Drive', 'Walk']
-    with open('mode_obs.txt', 'w') as f:
-        for i in range(0, n):
-            f.write('%d\t%s\n' % (i, random.choice(modes)))
-
-'''
-    generate_days
-    3 trips per day for now
-'''
-def generate_days(n):
-    month = 4
-    day = 1
-    lim = 30
-    with open('segment_days_obs.txt', 'w') as f:
-        for i in range(1, n+1):
-            f.write('%d\t%d/%d/2017\n' % (i-1, month, day))
-            if i % 3 == 0:
-                day += 1
-            if i == lim:
-                # Switch between 30 and 31 day months
-                lim = 30 if lim == 31 else 31
-                month += 1
-
-generate()
\ No newline at end of file
+                rating, label = (2 if counts.visits[ind] >= weeks / 2 else 1), 'Place %d' % (ind - 1)
+            wf.write('%s\t%d\t\t%d\t%s\n' % (truth_location(lon, lat), int(rating > 1), rating, label))
+        wf.write(PLACES_HEADER)
+        for lon, lat in counts.errands:
+            wf.write('%s\t0\t\t1\tErrand\n' % truth_location(lon, lat))
+
+'''
+    write_trips_truth
+    Anchor to anchor trips taken at least twice a week are rated 3, at least every
+    other week 2, the rest 1, with their usual mode, their busiest departure
+    time and that time plus their mean duration
+'''
+def write_trips_truth(path, user, counts):
+    weeks = max(counts.days / 7.0, 1.0)
+    with open(path, 'w+') as wf:
+        wf.write(TRIPS_HEADER)
+        wf.write(TRIPS_HEADER)
+        for origin, dest in zip(*np.nonzero(counts.trips)):
+            per_week = counts.trips[origin, dest] / weeks
+            rating = 3 if per_week >= 2 else (2 if per_week >= 0.5 else 1)
+            depart = (np.argmax(counts.departs[origin, dest]) + 0.5) * 1440 / TIME_BINS
+            arrive = depart + counts.durations[origin, dest] / counts.trips[origin, dest]
+            location = '%s | %s' % (truth_location(*user.anchors[origin]), truth_location(*user.anchors[dest]))
+            wf.write('%s\tTrip\tblue\t%d\t\t%d\t%s\t%s\t%s\t%d to %d\n' % (location, int(rating > 1), rating,
+                MODES[np.argmax(counts.modes[origin, dest])], clock_time(depart), clock_time(arrive), origin, dest))
+
+'''
+    generate_user
+    Write one user's timeline and truth files into out_directory
+'''
+def generate_user(rs, user, segments, out_directory, start_date, options):
+    timeline_path = os.path.join(out_directory, user.name + '.timeline')
+    writer = TimelineWriter(timeline_path)
+    counts = TruthCounts(len(user.anchors))
+    start_day = (start_date.astype('M8[D]') - EPOCH.astype('M8[D]')).astype(np.int64)
+    written = 0
+    try:
+        while written < segments:
+            # About two trips a day, never sample much more than is still needed
+            days = int(min(options['chunk_days'], max(1, (segments - written) // 2 + 1)))
+            batch = sample_days(rs, user, start_day, counts.days, days, options)
+            counts.days += days
+            if len(batch) > segments - written:
+                batch = batch.head(segments - written)
+            counts.add(batch, options['max_errands'])
+            write_trips(rs, writer, batch, start_date, options['raw'], options['transition_rate'])
+            written += len(batch)
+    finally:
+        writer.close()
+    write_places(os.path.join(out_directory, user.name + '_places.tsv'), user, counts)
+    write_trips_truth(os.path.join(out_directory, user.name + '_trips.tsv'), user, counts)
+    return {'user': user.name, 'timeline': timeline_path, 'segments': written, 'entries': writer.entries, 'days': counts.days}
+
+'''
+    generate
+    Write segments cleaned sections spread over users timelines into out_directory,
+    <user>.timeline with <user>_places.tsv and <user>_trips.tsv next to it
+    anchors: anchors per user, at least 3 (home, work and one other)
+    jitter: GPS noise in meters
+    raw: also write the raw motion activity and location entries
+    Returns a summary dict per user
+'''
+def generate(out_directory, segments=1000, users=1, seed=0, anchors=5, start_date='2017-03-01', mode_mix=(0.6, 0.25, 0.15),
+        jitter=15.0, mode_noise=0.1, unknown_mode=0.05, raw=True, transition_rate=0.2, max_errands=20, chunk_days=1000):
+    if anchors < 3:
+        raise ValueError('Need at least 3 anchors per user, got %d' % anchors)
+    if not os.path.isdir(out_directory):
+        os.makedirs(out_directory)
+    rs = np.random.RandomState(seed)
+    mode_mix = np.asarray(mode_mix, dtype=np.float64)
+    mode_mix = mode_mix / mode_mix.sum()
+    options = {
+        'mode_mix': mode_mix,
+        'jitter': jitter,
+        'mode_noise': mode_noise,
+        'unknown_mode': unknown_mode,
+        'raw': raw,
+        'transition_rate': transition_rate,
+        'max_errands': max_errands,
+        'chunk_days': chunk_days
+    }
+    start = np.datetime64(start_date, 'm')
+    summaries = []
+    for ind in range(users):
+        user = make_user(rs, 'user%02d' % ind, anchors, mode_mix)
+        user_segments = segments // users + (1 if ind < segments % users else 0)
+        summaries.append(generate_user(rs, user, user_segments, out_directory, start, options))
+        print('%s: %d segments over %d days, %d entries' % (user.name, summaries[-1]['segments'], summaries[-1]['days'], summaries[-1]['entries']))
+    return summaries
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate seeded synthetic e-mission timelines and truth files')
+    parser.add_argument('out_directory', help='Directory the timelines and truth files are written to')
+    parser.add_argument('-n', '--segments', type=int, default=1000, help='Cleaned sections to generate over all users')
+    parser.add_argument('-u', '--users', type=int, default=1, help='Number of users')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('-a', '--anchors', type=int, default=5, help='Anchors per user, home and work included')
+    parser.add_argument('-j', '--jitter', type=float, default=15.0, help='GPS jitter in meters')
+    parser.add_argument('-d', '--start-date', default='2017-03-01', help='First day of the timelines')
+    parser.add_argument('--no-raw', action='store_true', help='Only write cleaned sections, no raw location and motion entries')
+    args = parser.parse_args()
+    generate(args.out_directory, args.segments, args.users, args.seed, args.anchors, args.start_date, jitter=args.jitter, raw=not args.no_raw)
@@ -0,0 +1,34 @@
+import numpy as np
+
+import hlmrf
+
+# One atom with a rule and a prior has the closed form W c / (W + w) with squared hinges
+model = hlmrf.HLMRF()
+model.add_rules([('a', 'b')], [3.0], [0.8])
+model.add_priors([('a', 'b')], 13.0)
+truths, iterations = hlmrf.solve(model)
+assert(abs(truths[0] - 3.0 * 0.8 / 16.0) < 1e-3)
+
+# and is 0 or the body truth with linear hinges
+model = hlmrf.HLMRF()
+model.add_rules([('a',), ('b',)], [6.0, 4.0], [0.7, 0.7], squared=False)
+model.add_priors([('a',), ('b',)], 5.0, squared=False)
+truths, iterations = hlmrf.solve(model)
+assert(abs(truths[0] - 0.7) < 1e-3 and abs(truths[1]) < 1e-3)
+
+# Potentials over several variables reach the minimum of a grid search
+model = hlmrf.HLMRF()
+x0, x1, x2 = model.variable('x0'), model.variable('x1'), model.variable('x2')
+model.add_potentials([2.0], [[x0]], [[-1.0]], [0.9])
+model.add_potentials([1.5, 1.0], [[x0, x1], [x1, x2]], [[1.0, -1.0], [1.0, -1.0]], [0.0, 0.0], squared=False)
+model.add_potentials([1.0], [[x0, x1, x2]], [[0.5, 0.5, 1.0]], [-0.6])
+model.add_priors(['x1', 'x2'], 0.3)
+truths, iterations = hlmrf.solve(model)
+grid = np.linspace(0, 1, 51)
+best = min(model.objective(np.array([a, b, c])) for a in grid for b in grid for c in grid)
+assert(model.objective(truths) <= best + 1e-3)
+
+# Threads split the potentials in blocks but solve the same problem
+hlmrf.MIN_BLOCK = 1
+threaded, iterations = hlmrf.solve(model, threads=3)
+assert(np.abs(threaded - truths).max() < 1e-9)
@@ -0,0 +1,73 @@
+'''
+    anchors.py
+    Closed form MAP inference for the anchor model of Bipedal.groovy
+    The model only has StartLocation(S, L) >> Anchor(L) and EndLocation(S, L) >> Anchor(L)
+    against the prior ~Anchor(L), so every Anchor atom is its own problem and only
+    depends on how many segments start and end at its location. With squared hinges
+    (the PSL default) the minimizer of c (1 - A)^2 + w A^2 is A = c / (c + w), c the
+    weighted count and w the prior weight, with linear hinges it is 1 when c > w and 0
+    when c < w. This computes those for every location and writes anchors.txt the way
+    Bipedal.writeOutput does, without a JVM, a database or grounding
+'''
+
+import argparse
+import os
+
+import numpy as np
+
+import inference.atoms as atoms
+import preprocessing.observations as observations
+
+# Rule weights of Bipedal.defineRules
+START_WEIGHT = 1.0
+END_WEIGHT = 1.0
+PRIOR_WEIGHT = 10.0
+
+# Where Bipedal writes its anchors, build.py reads them from here
+DEFAULT_OUTPUT = './output/default/anchors.txt'
+
+'''
+    location_counts
+    Distinct locations of data_directory's start and end location files, sorted, with
+    how many segments start and end at each
+    Returns (locations, start counts, end counts)
+'''
+def location_counts(data_directory):
+    starts = list(observations.read_obs_file(os.path.join(data_directory, observations.OBS_FILES['start_location'])).values())
+    ends = list(observations.read_obs_file(os.path.join(data_directory, observations.OBS_FILES['end_location'])).values())
+    locations, inverse = np.unique(np.array(starts + ends, dtype=object).astype(str), return_inverse=True)
+    start_counts = np.bincount(inverse[:len(starts)], minlength=len(locations))
+    end_counts = np.bincount(inverse[len(starts):], minlength=len(locations))
+    return locations, start_counts, end_counts
+
+'''
+    map_truth
+    MAP truth value of the Anchor atom of every location given its start and end counts.
+    A linear model is flat when the weighted count equals the prior weight, any value is
+    a MAP state then and 0.5 is used
+'''
+def map_truth(start_counts, end_counts, start_weight=START_WEIGHT, end_weight=END_WEIGHT, prior_weight=PRIOR_WEIGHT, squared=True):
+    support = start_weight * np.asarray(start_counts, dtype=np.float64) + end_weight * np.asarray(end_counts, dtype=np.float64)
+    if squared:
+        return support / (support + prior_weight)
+    return np.where(support > prior_weight, 1.0, np.where(support < prior_weight, 0.0, 0.5))
+
+'''
+    run
+    Infer the anchors of data_directory's observations and write them to output_path
+    Returns (locations, truth values)
+'''
+def run(data_directory, output_path=DEFAULT_OUTPUT, squared=True):
+    locations, start_counts, end_counts = location_counts(data_directory)
+    truths = map_truth(start_counts, end_counts, squared=squared)
+    atoms.write_atoms(output_path, 'ANCHOR', [(location,) for location in locations.tolist()], truths.tolist())
+    print('Inferred %d anchors, %d above 0.5' % (len(locations), np.count_nonzero(truths > 0.5)))
+    return locations, truths
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Infer the Bipedal anchor model in closed form')
+    parser.add_argument('data_directory', help='Directory with the observation files')
+    parser.add_argument('-o', '--output', default=DEFAULT_OUTPUT, help='Path of the anchors file')
+    parser.add_argument('-l', '--linear', action='store_true', help='Solve the model with linear instead of squared hinges')
+    args = parser.parse_args()
+    run(args.data_directory, args.output, not args.linear)
@@ -0,0 +1,58 @@
+'''
+    atoms.py
+    Reading observed truth files and writing inferred atoms the way the PSL programs do
+'''
+
+import os
+import re
+
+ATOM_PATTERN = re.compile(r"^(\w+)\((.*)\) Truth=\[(.*)\]")
+
+def format_truth(value):
+    # Two decimals without trailing zeros, like DefaultAtomPrintStream
+    return ('%.2f' % value).rstrip('0').rstrip('.')
+
+'''
+    write_atoms
+    Write PREDICATE('arg', ...) Truth=[value] lines for every key (a tuple of
+    arguments) and truth value, like the writeOutput of the Groovy programs
+'''
+def write_atoms(path, predicate, keys, truths):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w+') as wf:
+        wf.write('--- Atoms: \n')
+        for key, truth in zip(keys, truths):
+            wf.write('%s(%s) Truth=[%s]\n' % (predicate, ', '.join("'%s'" % argument for argument in key), format_truth(truth)))
+
+'''
+    read_atoms
+    Dict from the argument tuple of every atom in a file write_atoms or PSL wrote to its truth value
+'''
+def read_atoms(path):
+    atoms = {}
+    with open(path, 'r') as rf:
+        for line in rf:
+            match = ATOM_PATTERN.match(line.strip())
+            if match is None:
+                continue
+            arguments = tuple(argument.strip().strip("'") for argument in match.group(2).split(','))
+            atoms[arguments] = float(match.group(3))
+    return atoms
+
+'''
+    load_truth_file
+    Dict from the argument tuple of every line of a tab separated truth file (arguments,
+    then the truth value, as loadDelimitedDataTruth reads them) to its value, empty without the file
+'''
+def load_truth_file(path):
+    truths = {}
+    if not os.path.exists(path):
+        return truths
+    with open(path, 'r') as rf:
+        for line in rf:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) >= 2:
+                truths[tuple(fields[:-1])] = float(fields[-1])
+    return truths
@@ -0,0 +1,85 @@
+'''
+    frequent_trips.py
+    InferFrequentTrips in process: ground its FrequentTrip rules from the observation
+    files and solve them with the ADMM reasoner of hlmrf.py
+    Every body atom of the active rules is observed, so each ground rule is a hinge
+    on one FrequentTrip atom. Ground rules with the same head and body truth are
+    merged into one potential with their summed weight
+'''
+
+import argparse
+import os
+from collections import defaultdict
+
+import inference.atoms as atoms
+import inference.hlmrf as hlmrf
+import preprocessing.observations as observations
+import preprocessing.segment_pairs as segment_pairs
+
+# Rule weights of InferFrequentTrips.defineRules
+SEGMENT_WEIGHT = 5.0
+SAME_DAY_WEIGHT = 1.0
+PRIOR_WEIGHT = 5.0
+
+ANCHORS_FILE = 'grounded_anchors.txt'
+OUTPUT_FILE = 'frequents_infer.txt'
+
+'''
+    ground_rules
+    Dict from (L1, L2, body truth) to the summed weight of the ground rules
+        Segment(S) & Anchor(L1) & Anchor(L2) & StartLocation(S, L1) & EndLocation(S, L2)
+            & ~EqualLocations(L1, L2) >> FrequentTrip(L1, L2)
+    and the same day rule over S1 and S2, whose body truth is Anchor(L1) + Anchor(L2) - 1.
+    Rules with a body of 0 are always satisfied and left out
+'''
+def ground_rules(obs, anchors):
+    supports = defaultdict(float)
+
+    def add(start, end, weight):
+        if start is None or end is None or start == end:
+            return
+        body = anchors.get((start,), 0.0) + anchors.get((end,), 0.0) - 1
+        if body > 0:
+            supports[(start, end, body)] += weight
+
+    for segment in obs.segments:
+        add(obs.get('start_location', segment), obs.get('end_location', segment), SEGMENT_WEIGHT)
+    for day, first, second in segment_pairs.same_day_pairs(obs):
+        add(obs.get('start_location', first), obs.get('end_location', second), SAME_DAY_WEIGHT)
+    return supports
+
+'''
+    ground
+    HLMRF of the rules and the ~FrequentTrip prior. FrequentTrip atoms no rule grounds
+    are left out, their MAP value is 0 (so ~FrequentTrip(L, L) never matters either)
+'''
+def ground(obs, anchors, squared=True):
+    supports = ground_rules(obs, anchors)
+    model = hlmrf.HLMRF()
+    keys = [(start, end) for start, end, body in supports]
+    model.add_rules(keys, list(supports.values()), [body for start, end, body in supports], squared)
+    model.add_priors(sorted(set(keys)), PRIOR_WEIGHT, squared)
+    return model
+
+'''
+    run
+    Infer the frequent trips of data_directory and write frequents_infer.txt to output_directory
+    Returns (atom keys, truth values)
+'''
+def run(data_directory, output_directory, squared=True, threads=1):
+    obs = observations.load(data_directory)
+    anchors = atoms.load_truth_file(os.path.join(data_directory, ANCHORS_FILE))
+    model = ground(obs, anchors, squared)
+    truths, iterations = hlmrf.solve(model, threads=threads)
+    atoms.write_atoms(os.path.join(output_directory, OUTPUT_FILE), 'FREQUENTTRIP', model.keys, truths.tolist())
+    print('Inferred %d frequent trips in %d ADMM iterations' % (len(model), iterations))
+    return model.keys, truths
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Infer frequent trips without the JVM')
+    parser.add_argument('data_directory', help='Directory with the observation files and grounded_anchors.txt')
+    parser.add_argument('-o', '--output', default='./output/default', help='Directory frequents_infer.txt is written to')
+    parser.add_argument('-l', '--linear', action='store_true', help='Use linear instead of squared hinges')
+    parser.add_argument('-j', '--threads', type=int, default=1, help='Threads updating the ADMM potentials')
+    args = parser.parse_args()
+    run(args.data_directory, args.output, not args.linear, args.threads)
@@ -0,0 +1,208 @@
+'''
+    hlmrf.py
+    Hinge-loss Markov random fields and consensus ADMM MAP inference
+    A potential is weight * max(0, coefficients . x + constant), squared or not, over
+    variables in [0, 1], the ground rules PSL builds. MAP inference follows PSL's
+    ADMM reasoner: every potential keeps a local copy of its variables, the local
+    problems have closed form solutions and are solved for all potentials at once
+    with numpy, and the consensus step averages the copies back into the variables
+'''
+
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+# PSL's ADMM defaults
+STEP_SIZE = 1.0
+MAX_ITERATIONS = 25000
+EPSILON_ABS = 1e-5
+EPSILON_REL = 1e-3
+
+# Potentials per thread below which a block is not split further
+MIN_BLOCK = 10000
+
+'''
+    HLMRF
+    Variables named by hashable keys and potentials added in blocks of the same arity,
+    compile turns them into the flat term arrays solve works on
+'''
+class HLMRF(object):
+
+    def __init__(self):
+        self.indices = {}
+        self.keys = []
+        self.blocks = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def variable(self, key):
+        index = self.indices.get(key)
+        if index is None:
+            index = len(self.keys)
+            self.indices[key] = index
+            self.keys.append(key)
+        return index
+
+    '''
+        add_potentials
+        Add m potentials of arity k: weights and constants have m rows, variables
+        (indices from variable) and coefficients are (m, k)
+    '''
+    def add_potentials(self, weights, variables, coefficients, constants, squared=True):
+        weights = np.asarray(weights, dtype=np.float64).ravel()
+        if len(weights) == 0:
+            return
+        variables = np.asarray(variables, dtype=np.int64).reshape(len(weights), -1)
+        coefficients = np.asarray(coefficients, dtype=np.float64).reshape(variables.shape)
+        constants = np.asarray(constants, dtype=np.float64).ravel()
+        self.blocks.append((weights, variables, coefficients, constants, np.full(len(weights), bool(squared))))
+
+    '''
+        add_rules
+        weight * hinge(body - x) for ground rules whose body atoms are all observed,
+        body is the Lukasiewicz truth of the body and key names the head
+    '''
+    def add_rules(self, keys, weights, bodies, squared=True):
+        variables = [self.variable(key) for key in keys]
+        self.add_potentials(weights, variables, -np.ones(len(variables)), bodies, squared)
+
+    '''
+        add_priors
+        weight * hinge(x) for every key, the negative prior ~P
+    '''
+    def add_priors(self, keys, weight, squared=True):
+        variables = [self.variable(key) for key in keys]
+        self.add_potentials(np.full(len(variables), weight), variables, np.ones(len(variables)), np.zeros(len(variables)), squared)
+
+    '''
+        compile
+        Flat arrays of every potential (weights, constants, squared) and of their terms
+        (potential, variable, coefficient), terms ordered by potential
+    '''
+    def compile(self):
+        if not self.blocks:
+            empty = np.zeros(0)
+            return Compiled(empty, empty, np.zeros(0, dtype=bool), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), empty, len(self.keys))
+        weights = np.concatenate([block[0] for block in self.blocks])
+        constants = np.concatenate([block[3] for block in self.blocks])
+        squared = np.concatenate([block[4] for block in self.blocks])
+        potentials, variables, coefficients = [], [], []
+        offset = 0
+        for block_weights, block_variables, block_coefficients, block_constants, block_squared in self.blocks:
+            arity = block_variables.shape[1]
+            potentials.append(np.repeat(np.arange(offset, offset + len(block_weights)), arity))
+            variables.append(block_variables.ravel())
+            coefficients.append(block_coefficients.ravel())
+            offset += len(block_weights)
+        return Compiled(weights, constants, squared, np.concatenate(potentials), np.concatenate(variables), np.concatenate(coefficients), len(self.keys))
+
+    '''
+        objective
+        Total weighted hinge loss of the truth values x
+    '''
+    def objective(self, x):
+        compiled = self.compile()
+        values = np.maximum(0.0, compiled.dot(x[compiled.term_variables]))
+        return float(np.sum(compiled.weights * np.where(compiled.squared, values ** 2, values)))
+
+'''
+    Compiled
+    Term arrays of an HLMRF, term_potentials is sorted so a potential's terms are contiguous
+'''
+class Compiled(object):
+
+    def __init__(self, weights, constants, squared, term_potentials, term_variables, term_coefficients, num_variables):
+        self.weights = weights
+        self.constants = constants
+        self.squared = squared
+        self.term_potentials = term_potentials
+        self.term_variables = term_variables
+        self.term_coefficients = term_coefficients
+        self.num_variables = num_variables
+        self.norms = np.bincount(term_potentials, weights=term_coefficients ** 2, minlength=len(weights))
+        self.copies = np.bincount(term_variables, minlength=num_variables)
+
+    def dot(self, values):
+        # coefficients . values + constant of every potential, values has one entry per term
+        return np.bincount(self.term_potentials, weights=self.term_coefficients * values, minlength=len(self.weights)) + self.constants
+
+'''
+    local_steps
+    How far each potential moves its local copy v along its coefficients to minimize
+    weight * hinge(a . z + b) + step_size / 2 * ||z - v||^2, z = v - step * a
+    dots are the a . v + b of the potentials
+'''
+def local_steps(dots, weights, norms, squared, step_size):
+    steps = np.zeros(len(dots))
+    active = dots > 0
+    safe_norms = np.where(norms > 0, norms, 1.0)
+    # Squared hinge, the minimizer is where the gradient of the quadratic vanishes
+    squared_steps = 2 * weights * dots / (step_size + 2 * weights * norms)
+    # Linear hinge, a full gradient step unless it crosses the hinge, then stop on it
+    linear_steps = np.where(dots - weights / step_size * norms >= 0, weights / step_size, dots / safe_norms)
+    steps[active] = np.where(squared, squared_steps, linear_steps)[active]
+    return steps
+
+'''
+    solve
+    MAP truth values of model by consensus ADMM, potentials are split in blocks that
+    threads update in parallel (numpy releases the GIL for the work in each block)
+    Returns (truth values, iterations run)
+'''
+def solve(model, step_size=STEP_SIZE, max_iterations=MAX_ITERATIONS, epsilon_abs=EPSILON_ABS, epsilon_rel=EPSILON_REL, threads=1, initial=None):
+    compiled = model.compile() if isinstance(model, HLMRF) else model
+    num_terms = len(compiled.term_variables)
+    x = np.zeros(compiled.num_variables) if initial is None else np.clip(np.asarray(initial, dtype=np.float64), 0.0, 1.0)
+    if num_terms == 0:
+        return x, 0
+    z = x[compiled.term_variables].copy()
+    u = np.zeros(num_terms)
+    copies = np.maximum(compiled.copies, 1)
+    blocks = potential_blocks(compiled, threads)
+    pool = ThreadPool(len(blocks)) if len(blocks) > 1 else None
+
+    def update_block(block):
+        # Local problems of the potentials of block, writes their terms of z
+        first_potential, last_potential, first_term, last_term = block
+        terms = slice(first_term, last_term)
+        v = x[compiled.term_variables[terms]] - u[terms]
+        potentials = compiled.term_potentials[terms] - first_potential
+        dots = np.bincount(potentials, weights=compiled.term_coefficients[terms] * v, minlength=last_potential - first_potential) + compiled.constants[first_potential:last_potential]
+        steps = local_steps(dots, compiled.weights[first_potential:last_potential], compiled.norms[first_potential:last_potential],
+            compiled.squared[first_potential:last_potential], step_size)
+        z[terms] = v - steps[potentials] * compiled.term_coefficients[terms]
+
+    iteration = 0
+    try:
+        for iteration in range(1, max_iterations + 1):
+            if pool is not None:
+                pool.map(update_block, blocks)
+            else:
+                update_block(blocks[0])
+            previous = x
+            x = np.clip(np.bincount(compiled.term_variables, weights=z + u, minlength=compiled.num_variables) / copies, 0.0, 1.0)
+            consensus = x[compiled.term_variables]
+            u += z - consensus
+            primal = np.sqrt(np.sum((z - consensus) ** 2))
+            dual = step_size * np.sqrt(np.sum(compiled.copies * (x - previous) ** 2))
+            primal_bound = epsilon_abs * np.sqrt(num_terms) + epsilon_rel * max(np.sqrt(np.sum(z ** 2)), np.sqrt(np.sum(consensus ** 2)))
+            dual_bound = epsilon_abs * np.sqrt(num_terms) + epsilon_rel * step_size * np.sqrt(np.sum(u ** 2))
+            if primal <= primal_bound and dual <= dual_bound:
+                break
+    finally:
+        if pool is not None:
+            pool.close()
+    return x, iteration
+
+'''
+    potential_blocks
+    (first potential, last potential, first term, last term) of up to threads blocks
+    of about the same number of potentials
+'''
+def potential_blocks(compiled, threads):
+    num_potentials = len(compiled.weights)
+    num_blocks = max(1, min(threads, num_potentials // MIN_BLOCK))
+    bounds = np.linspace(0, num_potentials, num_blocks + 1).astype(np.int64)
+    term_bounds = np.searchsorted(compiled.term_potentials, bounds)
+    return [(int(bounds[ind]), int(bounds[ind + 1]), int(term_bounds[ind]), int(term_bounds[ind + 1])) for ind in range(num_blocks)]
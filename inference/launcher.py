@@ -0,0 +1,203 @@
+'''
+    launcher.py
+    Start the PSL programs without the run*.sh scripts
+    The scripts run mvn compile and start a JVM with -Xmx57g for every program. This
+    only compiles when a source is newer than target/classes, gives java a heap sized
+    from the grounding estimate of preflight.py, and can keep one InferenceWorker JVM
+    running the stages of a pipeline one after another
+'''
+
+import argparse
+import os
+import subprocess
+import sys
+
+import inference.preflight as preflight
+
+# Main class of every stage, the stage names of preflight.py
+MAIN_CLASSES = {
+    'anchors': 'edu.ucsc.linqs.psl.example.bipedal.Bipedal',
+    'frequents': 'edu.ucsc.linqs.psl.example.infer_frequents.InferFrequentTrips',
+    'info': 'edu.ucsc.linqs.psl.example.infer_time_mode.InferTripInfo',
+    'merge': 'edu.ucsc.linqs.psl.example.infer_merge.InferMerge'
+}
+SCRIPTS = {
+    'anchors': './run.sh',
+    'frequents': './run_infer_frequents.sh',
+    'info': './run_infer_info.sh',
+    'merge': './run_infer_merge.sh'
+}
+WORKER_CLASS = 'edu.ucsc.linqs.psl.example.worker.InferenceWorker'
+WORKER_REPLY = 'INFERENCE_WORKER'
+
+# 'scripts' runs run*.sh, 'java' starts a JVM per stage, 'worker' one JVM for every stage
+MODES = ['scripts', 'java', 'worker']
+
+SOURCE_DIRECTORY = 'src/main'
+CLASSES_DIRECTORY = 'target/classes'
+CLASSPATH_FILE = 'classpath.out'
+POM_FILE = 'pom.xml'
+
+# Heap per estimated grounding byte, for the garbage collector and PSL's reasoner
+HEAP_HEADROOM = 1.5
+MIN_HEAP_MB = 1024
+
+def newest_mtime(directory):
+    newest = 0
+    for root, directories, filenames in os.walk(directory):
+        for filename in filenames:
+            newest = max(newest, os.path.getmtime(os.path.join(root, filename)))
+    return newest
+
+'''
+    needs_compile
+    Whether target/classes is missing or older than a source or pom.xml
+'''
+def needs_compile(project_directory):
+    classes = os.path.join(project_directory, CLASSES_DIRECTORY)
+    if not os.path.isdir(classes):
+        return True
+    sources = newest_mtime(os.path.join(project_directory, SOURCE_DIRECTORY))
+    pom = os.path.join(project_directory, POM_FILE)
+    if os.path.exists(pom):
+        sources = max(sources, os.path.getmtime(pom))
+    return sources > newest_mtime(classes)
+
+'''
+    prepare
+    Compile when needs_compile and build classpath.out once, like the scripts
+    Returns the classpath relative to project_directory
+'''
+def prepare(project_directory):
+    if needs_compile(project_directory):
+        subprocess.check_call(['mvn', 'compile'], cwd=project_directory)
+    classpath_path = os.path.join(project_directory, CLASSPATH_FILE)
+    if not os.path.exists(classpath_path):
+        subprocess.check_call(['mvn', 'dependency:build-classpath', '-Dmdep.outputFile=%s' % CLASSPATH_FILE], cwd=project_directory)
+    with open(classpath_path, 'r') as rf:
+        return os.pathsep.join([CLASSES_DIRECTORY, rf.read().strip()])
+
+'''
+    heap_mb
+    Heap for a grounding estimated at estimated_bytes, with headroom, between
+    MIN_HEAP_MB and max_heap_gb
+'''
+def heap_mb(estimated_bytes, max_heap_gb):
+    return max(MIN_HEAP_MB, min(int(estimated_bytes * HEAP_HEADROOM / 1024 ** 2), int(max_heap_gb * 1024)))
+
+def java_command(classpath, main_class, heap, args):
+    # The scripts' -d64 is gone from Java 10 on, 64 bit is the only JVM there
+    return ['java', '-Xmx%dm' % heap, '-cp', classpath, main_class] + list(args)
+
+'''
+    run
+    Run one stage in its own JVM, args are the program's data and output directory
+'''
+def run(stage, args, heap, project_directory='.'):
+    classpath = prepare(project_directory)
+    subprocess.check_call(java_command(classpath, MAIN_CLASSES[stage], heap, args), cwd=project_directory)
+
+'''
+    Worker
+    An InferenceWorker JVM, run sends it a stage and waits for the reply while
+    passing the programs' own output through
+'''
+class Worker(object):
+
+    def __init__(self, heap, project_directory='.'):
+        classpath = prepare(project_directory)
+        self.heap = heap
+        self.process = subprocess.Popen(java_command(classpath, WORKER_CLASS, heap, []), cwd=project_directory,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    '''
+        run
+        Run stage with args in the worker
+        Returns the seconds it took, raises RuntimeError when it failed or the JVM exited
+    '''
+    def run(self, stage, args):
+        self.process.stdin.write('\t'.join([stage] + list(args)) + '\n')
+        self.process.stdin.flush()
+        for line in iter(self.process.stdout.readline, ''):
+            if not line.startswith(WORKER_REPLY):
+                sys.stdout.write(line)
+                continue
+            fields = line.rstrip('\n').split(' ', 3)
+            if fields[1] == 'DONE':
+                return float(fields[3])
+            raise RuntimeError('%s failed in the inference worker: %s' % (stage, fields[3] if len(fields) > 3 else ''))
+        raise RuntimeError('The inference worker exited with %s while running %s' % (self.process.wait(), stage))
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.write('\n')
+            self.process.stdin.close()
+        self.process.wait()
+
+'''
+    Launcher
+    Runs the stages of a pipeline in one of MODES. The worker starts with the first
+    stage and is restarted with a larger heap when a later stage needs one. A stage
+    failing in the worker is run again in its own JVM, the worker is started fresh
+    for the next stage. Without fallback the failure is raised instead
+'''
+class Launcher(object):
+
+    def __init__(self, mode, max_heap_gb, project_directory='.', fallback=True):
+        if mode not in MODES:
+            raise ValueError('Unknown PSL launcher %s, expected one of %s' % (mode, ', '.join(MODES)))
+        self.mode = mode
+        self.max_heap_gb = max_heap_gb
+        self.project_directory = project_directory
+        self.fallback = fallback
+        self.worker = None
+
+    '''
+        run
+        Run stage on args (data directory, then output directory, both optional) with
+        the heap for a grounding of estimated_bytes
+    '''
+    def run(self, stage, args, estimated_bytes):
+        if self.mode == 'scripts':
+            subprocess.call([SCRIPTS[stage]] + list(args), cwd=self.project_directory)
+            return
+        heap = heap_mb(estimated_bytes, self.max_heap_gb)
+        if self.mode == 'java':
+            run(stage, args, heap, self.project_directory)
+            return
+        if self.worker is not None and self.worker.heap < heap:
+            self.close()
+        if self.worker is None:
+            self.worker = Worker(heap, self.project_directory)
+        try:
+            seconds = self.worker.run(stage, args)
+            print('%s ran in %0.1f seconds in the inference worker' % (stage, seconds))
+        except RuntimeError as error:
+            if not self.fallback:
+                raise
+            print('%s, running it in its own JVM' % error)
+            self.close()
+            run(stage, args, heap, self.project_directory)
+
+    def close(self):
+        if self.worker is not None:
+            self.worker.close()
+            self.worker = None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run PSL programs without recompiling, in one JVM with --worker')
+    parser.add_argument('data_directory', help='Data directory the programs read')
+    parser.add_argument('-s', '--stages', nargs='+', choices=preflight.STAGES, default=['anchors', 'frequents', 'info'], help='Stages to run, in order')
+    parser.add_argument('-o', '--output', default=None, help='Output directory of the programs, their default without it')
+    parser.add_argument('-w', '--worker', action='store_true', help='Run every stage in one InferenceWorker JVM')
+    parser.add_argument('--no-fallback', action='store_true', help='Fail when a stage fails in the worker instead of running it in its own JVM')
+    parser.add_argument('-m', '--max-heap', type=float, default=57, help='Largest heap in GB, stages estimated above it are refused')
+    args = parser.parse_args()
+    launcher = Launcher('worker' if args.worker else 'java', args.max_heap, fallback=not args.no_fallback)
+    program_args = [args.data_directory] + ([args.output] if args.output else [])
+    try:
+        for stage in args.stages:
+            report = preflight.guard(stage, args.data_directory, args.max_heap)
+            launcher.run(stage, program_args, report['bytes'])
+    finally:
+        launcher.close()
@@ -0,0 +1,332 @@
+'''
+    preflight.py
+    Estimate how large the groundings of the PSL programs get before starting a JVM
+    From the files of a data directory this counts, for every Groovy stage, the target
+    atoms its loadData creates (candidate files or the cross products) and, per rule,
+    the rows its grounding query returns and the ground rules left after the function
+    and negation filters, then the heap those take. guard refuses to launch a stage
+    over the budget, or first writes the candidate targets and same day pairs that
+    bring it under
+'''
+
+import argparse
+import os
+from collections import defaultdict
+
+import inference.atoms as atoms
+import inference.trip_info as trip_info
+import preprocessing.candidates as candidates
+import preprocessing.location_relations as location_relations
+import preprocessing.observations as observations
+import preprocessing.segment_pairs as segment_pairs
+
+# Groovy program of every stage, in pipeline order
+STAGES = ['anchors', 'frequents', 'info', 'merge']
+PROGRAMS = {
+    'anchors': 'Bipedal',
+    'frequents': 'InferFrequentTrips',
+    'info': 'InferTripInfo',
+    'merge': 'InferMerge'
+}
+
+# Target predicates of every stage that candidates.py can restrict
+CANDIDATE_PREDICATES = {
+    'anchors': ['AnchorTime', 'AnchorMode'],
+    'frequents': ['FrequentTrip'],
+    'info': ['FrequentTripTime', 'FrequentTripMode'],
+    'merge': []
+}
+
+# Rough PSL 2.0 heap footprints: an atom with its terms, cache entry and H2 row, a
+# ground rule with its hinge and ADMM copies, a row of a grounding query result
+ATOM_BYTES = 400
+GROUND_RULE_BYTES = 250
+QUERY_ROW_BYTES = 100
+
+GROUNDED_ANCHORS_FILE = 'grounded_anchors.txt'
+GROUNDED_FREQUENTS_FILE = 'grounded_frequents.txt'
+GROUNDED_TIMES_FILE = 'grounded_frequent_times.txt'
+GROUNDED_MODES_FILE = 'grounded_frequent_modes.txt'
+
+GIGABYTE = 1024.0 ** 3
+
+def count_lines(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as rf:
+        return sum(1 for line in rf if line.strip())
+
+'''
+    targets
+    (atoms, from candidates) of a target predicate, the lines of its candidate file
+    when loadCandidates finds one, otherwise the cross product the program populates
+'''
+def targets(data_directory, predicate, cross_product):
+    count = count_lines(os.path.join(data_directory, candidates.CANDIDATE_FILES[predicate]))
+    if count is None:
+        return cross_product, False
+    return count, True
+
+def count_loops(path):
+    # Candidate trips starting and ending at the same location, what ~FrequentTrip(L, L) grounds
+    loops = 0
+    with open(path, 'r') as rf:
+        for line in rf:
+            fields = line.rstrip('\n').split('\t')
+            loops += len(fields) >= 2 and fields[0] == fields[1]
+    return loops
+
+def observed_atoms(obs):
+    # Segment and every attribute file, what each program loads first
+    return len(obs.segments) + sum(len(values) for values in obs.attributes.values())
+
+def relation_atoms(data_directory):
+    return sum(count_lines(os.path.join(data_directory, filename)) or 0
+        for filename in [location_relations.EQUAL_FILE, location_relations.NEAR_FILE])
+
+def compatible(start_time, end_time):
+    return observations.before(start_time, end_time) and observations.similar_times(start_time, end_time)
+
+'''
+    anchor_rules
+    Bipedal: one ground rule per StartLocation and EndLocation atom and the ~Anchor prior
+'''
+def anchor_rules(data_directory, obs):
+    locations = obs.locations()
+    times = set(obs.values('start_time')) | set(obs.values('end_time'))
+    starts, ends = len(obs.attributes['start_location']), len(obs.attributes['end_location'])
+    target_atoms = {'Anchor': (len(locations), False),
+        'AnchorTime': targets(data_directory, 'AnchorTime', len(locations) * len(times)),
+        'AnchorMode': targets(data_directory, 'AnchorMode', len(locations) * len(obs.values('mode')))}
+    rules = [('StartLocation(S, L) >> Anchor(L)', starts, starts),
+        ('EndLocation(S, L) >> Anchor(L)', ends, ends),
+        ('~Anchor(L)', len(locations), len(locations))]
+    return target_atoms, rules, observed_atoms(obs) + relation_atoms(data_directory), []
+
+'''
+    day_pair_counts
+    (query rows, ground rules) of the full same day join over one day's segments: every
+    start at an anchor times every end at an anchor, and those with compatible times
+    and different locations, counted per (location, time) instead of per pair
+'''
+def day_pair_counts(obs, segments, anchors):
+    starts, ends = defaultdict(int), defaultdict(int)
+    for segment in segments:
+        start, start_time = obs.get('start_location', segment), obs.get('start_time', segment)
+        end, end_time = obs.get('end_location', segment), obs.get('end_time', segment)
+        if start in anchors and start_time is not None:
+            starts[(start, start_time)] += 1
+        if end in anchors and end_time is not None:
+            ends[(end, end_time)] += 1
+    start_times, end_times = defaultdict(int), defaultdict(int)
+    for (location, time), count in starts.items():
+        start_times[time] += count
+    for (location, time), count in ends.items():
+        end_times[time] += count
+    ground = sum(start_times[start_time] * end_times[end_time]
+        for start_time in start_times for end_time in end_times if compatible(start_time, end_time))
+    ground -= sum(count * ends.get((location, end_time), 0)
+        for (location, start_time), count in starts.items() for end_time in end_times if compatible(start_time, end_time))
+    return sum(starts.values()) * sum(ends.values()), ground
+
+'''
+    frequent_rules
+    InferFrequentTrips, with every location as an anchor until grounded_anchors.txt exists
+'''
+def frequent_rules(data_directory, obs):
+    missing = []
+    anchors = set(key[0] for key in atoms.load_truth_file(os.path.join(data_directory, GROUNDED_ANCHORS_FILE)))
+    if not anchors:
+        missing.append(GROUNDED_ANCHORS_FILE)
+        anchors = set(obs.locations())
+    trips, from_candidates = targets(data_directory, 'FrequentTrip', len(anchors) ** 2)
+    segment_rows = segment_ground = 0
+    for segment in obs.segments:
+        start, end = obs.get('start_location', segment), obs.get('end_location', segment)
+        if start in anchors and end in anchors:
+            segment_rows += 1
+            segment_ground += start != end
+    pairs_path = os.path.join(data_directory, segment_pairs.PAIRS_FILE)
+    if os.path.exists(pairs_path):
+        # The pairs already passed the filters, the join only drops those without anchors
+        pair_rows = 0
+        with open(pairs_path, 'r') as rf:
+            for line in rf:
+                first, second = line.split('\t')
+                pair_rows += obs.get('start_location', int(first)) in anchors and obs.get('end_location', int(second)) in anchors
+        pair_rule, pair_ground = 'SameDayPair(S1, S2) & ... >> FrequentTrip(L1, L2)', pair_rows
+        pair_atoms = count_lines(pairs_path)
+    else:
+        by_day = obs.by_value('day')
+        counts = [day_pair_counts(obs, segments, anchors) for segments in by_day.values()]
+        pair_rows, pair_ground = sum(count[0] for count in counts), sum(count[1] for count in counts)
+        pair_rule, pair_atoms = 'Segment(S1) & Segment(S2) & SegmentDay(S1, D) & SegmentDay(S2, D) & ... >> FrequentTrip(L1, L2)', 0
+    loops = count_loops(os.path.join(data_directory, candidates.CANDIDATE_FILES['FrequentTrip'])) if from_candidates else len(anchors)
+    rules = [('~FrequentTrip(L1, L2)', trips, trips),
+        ('~FrequentTrip(L, L)', loops, loops),
+        ('Segment(S) & ... >> FrequentTrip(L1, L2)', segment_rows, segment_ground),
+        (pair_rule, pair_rows, pair_ground)]
+    observed = observed_atoms(obs) + relation_atoms(data_directory) + len(anchors) + pair_atoms
+    return {'FrequentTrip': (trips, from_candidates)}, rules, observed, missing
+
+'''
+    info_rules
+    InferTripInfo, with the candidate frequent trips until grounded_frequents.txt exists
+'''
+def info_rules(data_directory, obs):
+    missing = []
+    frequents = set(atoms.load_truth_file(os.path.join(data_directory, GROUNDED_FREQUENTS_FILE)))
+    if not frequents:
+        missing.append(GROUNDED_FREQUENTS_FILE)
+        frequents = candidates.frequent_trip_candidates(obs)
+    locations = set(location for trip in frequents for location in trip)
+    start_times, end_times, modes = obs.values('start_time'), obs.values('end_time'), obs.values('mode')
+    target_atoms = {
+        'FrequentTripTime': targets(data_directory, 'FrequentTripTime', len(locations) ** 2 * len(start_times) * len(end_times)),
+        'FrequentTripMode': targets(data_directory, 'FrequentTripMode', len(locations) ** 2 * len(modes))}
+    time_rows = mode_rows = 0
+    for segment in obs.segments:
+        if (obs.get('start_location', segment), obs.get('end_location', segment)) in frequents:
+            time_rows += obs.get('start_time', segment) is not None and obs.get('end_time', segment) is not None
+            mode_rows += obs.get('mode', segment) is not None
+    start_time_counts = trip_info.count_at(obs, 'start_location', 'start_time')
+    end_time_counts = trip_info.count_at(obs, 'end_location', 'end_time')
+    start_mode_counts = trip_info.count_at(obs, 'start_location', 'mode')
+    end_mode_counts = trip_info.count_at(obs, 'end_location', 'mode')
+    starts_at, ends_at = defaultdict(int), defaultdict(int)
+    for (location, time), count in start_time_counts.items():
+        starts_at[location] += count
+    for (location, time), count in end_time_counts.items():
+        ends_at[location] += count
+    start_values, end_values = trip_info.values_by_location(start_time_counts), trip_info.values_by_location(end_time_counts)
+    mode_values = trip_info.values_by_location(start_mode_counts)
+    cross_time_rows = cross_time_ground = cross_mode_rows = 0
+    for start, end in frequents:
+        cross_time_rows += starts_at[start] * ends_at[end]
+        cross_time_ground += sum(start_time_counts[(start, start_time)] * end_time_counts[(end, end_time)]
+            for start_time in start_values.get(start, ()) for end_time in end_values.get(end, ()) if compatible(start_time, end_time))
+        cross_mode_rows += sum(start_mode_counts[(start, mode)] * end_mode_counts.get((end, mode), 0) for mode in mode_values.get(start, ()))
+    times, trip_modes = target_atoms['FrequentTripTime'][0], target_atoms['FrequentTripMode'][0]
+    rules = [('~FrequentTripMode(L1, L2, M)', trip_modes, trip_modes),
+        ('~FrequentTripTime(L1, L2, T1, T2)', times, times),
+        ('FrequentTrip(L1, L2) & StartLocation(S, L1) & ... >> FrequentTripTime(L1, L2, T1, T2)', time_rows, time_rows),
+        ('FrequentTrip(L1, L2) & StartLocation(S, L1) & ... >> FrequentTripMode(L1, L2, M)', mode_rows, mode_rows),
+        ('FrequentTrip(L1, L2) & StartLocation(S1, L1) & EndLocation(S2, L2) & ... >> FrequentTripTime(L1, L2, T1, T2)', cross_time_rows, cross_time_ground),
+        ('FrequentTrip(L1, L2) & StartLocation(S1, L1) & EndLocation(S2, L2) & ... >> FrequentTripMode(L1, L2, M)', cross_mode_rows, cross_mode_rows)]
+    return target_atoms, rules, observed_atoms(obs) + len(frequents), missing
+
+'''
+    merge_rules
+    InferMerge over the grounded frequent trip times and modes. Its function filters
+    are not replayed, so every query row counts as a ground rule
+'''
+def merge_rules(data_directory, obs):
+    missing = [filename for filename in [GROUNDED_TIMES_FILE, GROUNDED_MODES_FILE]
+        if not os.path.exists(os.path.join(data_directory, filename))]
+    trip_times = atoms.load_truth_file(os.path.join(data_directory, GROUNDED_TIMES_FILE))
+    trip_modes = atoms.load_truth_file(os.path.join(data_directory, GROUNDED_MODES_FILE))
+    times_of, modes_of = defaultdict(list), defaultdict(set)
+    for start, end, start_time, end_time in trip_times:
+        times_of[(start, end)].append((start_time, end_time))
+    for start, end, mode in trip_modes:
+        modes_of[(start, end)].add(mode)
+    target_count = (len(set(key[0] for key in trip_modes)) * len(set(key[1] for key in trip_modes) | set(key[1] for key in trip_times))
+        * len(set(key[2] for key in trip_modes)) * len(set(key[2] for key in trip_times)) * len(set(key[3] for key in trip_times)))
+    joined = sum(len(times_of[trip]) * len(modes) for trip, modes in modes_of.items())
+    # Chains L1 -> L2 -> L3 sharing a mode, joined on the start time or on the middle time
+    trips_from = defaultdict(list)
+    for start, end in modes_of:
+        trips_from[start].append(end)
+    same_start = same_middle = 0
+    for (start, middle), modes in modes_of.items():
+        for end in trips_from[middle]:
+            shared = len(modes & modes_of[(middle, end)])
+            if shared:
+                first, second = times_of[(start, middle)], times_of[(middle, end)]
+                same_start += shared * sum(1 for times1 in first for times2 in second if times1[0] == times2[0])
+                same_middle += shared * sum(1 for times1 in first for times2 in second if times1[1] == times2[0])
+    time_pairs = sum(len(times_of[trip]) ** 2 * len(modes) for trip, modes in modes_of.items())
+    mode_pairs = sum(len(times_of[trip]) * len(modes) ** 2 for trip, modes in modes_of.items())
+    rules = [('~FrequentTripModeTime(L1, L2, T1, T2, M)', target_count, target_count),
+        ('FrequentTripTime(L1, L2, T1, T2) & FrequentTripMode(L1, L2, M) >> FrequentTripModeTime(L1, L2, M, T1, T2)', joined, joined),
+        ('FrequentTripMode(L1, L2, M) & FrequentTripMode(L2, L3, M) & ... & Before(T2, T3) >> FrequentTripModeTime(L1, L3, M, T1, T3)', same_start, same_start),
+        ('FrequentTripMode(L1, L2, M) & FrequentTripMode(L2, L3, M) & ... >> FrequentTripModeTime(L1, L3, M, T1, T3)', same_middle, same_middle),
+        ('FrequentTripTime(L1, L2, T1, T2) & FrequentTripTime(L1, L2, T3, T4) & ... >> ~FrequentTripModeTime(L1, L2, M, T2, T4)', time_pairs, time_pairs),
+        ('FrequentTripMode(L1, L2, M1) & FrequentTripMode(L1, L2, M2) & ... >> ~FrequentTripModeTime(L1, L2, M1, T1, T2)', mode_pairs, mode_pairs)]
+    observed = observed_atoms(obs) + len(trip_times) + len(trip_modes) + (count_lines(os.path.join(data_directory, GROUNDED_FREQUENTS_FILE)) or 0)
+    return {'FrequentTripModeTime': (target_count, False)}, rules, observed, missing
+
+STAGE_RULES = {
+    'anchors': anchor_rules,
+    'frequents': frequent_rules,
+    'info': info_rules,
+    'merge': merge_rules
+}
+
+'''
+    estimate
+    Target atoms, rules and heap bytes of one stage on data_directory
+    Query results are freed after each rule, so only the largest one counts
+'''
+def estimate(stage, data_directory, obs=None):
+    if obs is None:
+        obs = observations.load(data_directory)
+    target_atoms, rules, observed, missing = STAGE_RULES[stage](data_directory, obs)
+    num_targets = sum(count for count, from_candidates in target_atoms.values())
+    ground_rules = sum(ground for name, rows, ground in rules)
+    largest_query = max(rows for name, rows, ground in rules)
+    return {
+        'stage': stage,
+        'program': PROGRAMS[stage],
+        'targets': dict((predicate, {'atoms': count, 'candidates': from_candidates})
+            for predicate, (count, from_candidates) in target_atoms.items()),
+        'observed_atoms': observed,
+        'rules': [{'rule': name, 'query_rows': rows, 'ground_rules': ground} for name, rows, ground in rules],
+        'bytes': ATOM_BYTES * (num_targets + observed) + GROUND_RULE_BYTES * ground_rules + QUERY_ROW_BYTES * largest_query,
+        'missing': missing
+    }
+
+def print_estimate(report):
+    print('%s (%s): about %0.2f GB' % (report['stage'], report['program'], report['bytes'] / GIGABYTE))
+    for predicate in sorted(report['targets']):
+        target = report['targets'][predicate]
+        print('    %s\t%d target atoms%s' % (predicate, target['atoms'], ' (candidates)' if target['candidates'] else ''))
+    for rule in report['rules']:
+        print('    %d query rows\t%d ground rules\t%s' % (rule['query_rows'], rule['ground_rules'], rule['rule']))
+    if report['missing']:
+        print('    %s not written yet' % ', '.join(report['missing']))
+
+'''
+    guard
+    Estimate stage and raise ValueError when it needs more than budget_gb. With
+    fallback, a stage over budget without candidate targets first gets them written
+    (and InferFrequentTrips its same day pairs) and is estimated again
+    Returns the estimate the stage will run with
+'''
+def guard(stage, data_directory, budget_gb, fallback=True, radius=None):
+    obs = observations.load(data_directory)
+    report = estimate(stage, data_directory, obs)
+    print_estimate(report)
+    if report['bytes'] <= budget_gb * GIGABYTE:
+        return report
+    restricted = all(report['targets'][predicate]['candidates'] for predicate in CANDIDATE_PREDICATES[stage])
+    has_pairs = stage != 'frequents' or os.path.exists(os.path.join(data_directory, segment_pairs.PAIRS_FILE))
+    if fallback and not (restricted and has_pairs):
+        print('%s is over the %0.2f GB budget, restricting it to candidate targets' % (report['program'], budget_gb))
+        candidates.run(data_directory, radius)
+        if not has_pairs:
+            segment_pairs.run(data_directory)
+        report = estimate(stage, data_directory, obs)
+        print_estimate(report)
+        if report['bytes'] <= budget_gb * GIGABYTE:
+            return report
+    raise ValueError('%s needs about %0.2f GB to ground, over the %0.2f GB budget' % (report['program'], report['bytes'] / GIGABYTE, budget_gb))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Estimate the target atoms, ground rules and memory of the PSL programs')
+    parser.add_argument('data_directory', help='Directory with the observation files')
+    parser.add_argument('-s', '--stages', nargs='+', choices=STAGES, default=STAGES, help='Stages to estimate')
+    args = parser.parse_args()
+    obs = observations.load(args.data_directory)
+    for stage in args.stages:
+        print_estimate(estimate(stage, args.data_directory, obs))
@@ -0,0 +1,136 @@
+'''
+    trip_info.py
+    InferTripInfo in process: ground its FrequentTripTime and FrequentTripMode rules
+    from the observation files and the grounded frequent trips and solve them with
+    the ADMM reasoner of hlmrf.py
+    FrequentTrip is observed here, so as in frequent_trips.py every ground rule is a
+    hinge on one atom and rules with the same head and body are merged
+'''
+
+import argparse
+import os
+from collections import defaultdict
+
+import inference.atoms as atoms
+import inference.hlmrf as hlmrf
+import preprocessing.observations as observations
+
+# Rule weights of InferTripInfo.defineRules
+SEGMENT_WEIGHT = 3.0
+CROSS_WEIGHT = 0.01
+TIME_PRIOR_WEIGHT = 13.0
+MODE_PRIOR_WEIGHT = 15.0
+
+FREQUENTS_FILE = 'grounded_frequents.txt'
+TIMES_OUTPUT_FILE = 'frequent_times_infer.txt'
+MODES_OUTPUT_FILE = 'frequent_modes_infer.txt'
+
+def count_at(obs, location_name, value_name):
+    # Dict from (location, value) to how many segments start (or end) there with that value
+    counts = defaultdict(int)
+    for segment in obs.segments:
+        location, value = obs.get(location_name, segment), obs.get(value_name, segment)
+        if location is not None and value is not None:
+            counts[(location, value)] += 1
+    return counts
+
+def values_by_location(counts):
+    values = defaultdict(list)
+    for location, value in counts:
+        values[location].append(value)
+    return values
+
+'''
+    ground_time_rules
+    Dict from (L1, L2, T1, T2, body) to the summed weight of the ground rules
+        FrequentTrip(L1, L2) & StartLocation(S, L1) & EndLocation(S, L2) & StartTime(S, T1)
+            & EndTime(S, T2) >> FrequentTripTime(L1, L2, T1, T2)
+        FrequentTrip(L1, L2) & StartLocation(S1, L1) & EndLocation(S2, L2) & StartTime(S1, T1)
+            & EndTime(S2, T2) & Before(T1, T2) & SimilarTimes(T1, T2) >> FrequentTripTime(L1, L2, T1, T2)
+    The second rule grounds once per (S1, S2), so its weight is multiplied by the
+    segments starting at L1 at T1 times the segments ending at L2 at T2
+'''
+def ground_time_rules(obs, frequents):
+    supports = defaultdict(float)
+    for segment in obs.segments:
+        trip = (obs.get('start_location', segment), obs.get('end_location', segment))
+        times = (obs.get('start_time', segment), obs.get('end_time', segment))
+        if frequents.get(trip, 0.0) > 0 and None not in times:
+            supports[trip + times + (frequents[trip],)] += SEGMENT_WEIGHT
+    start_counts = count_at(obs, 'start_location', 'start_time')
+    end_counts = count_at(obs, 'end_location', 'end_time')
+    start_times, end_times = values_by_location(start_counts), values_by_location(end_counts)
+    for (start, end), body in frequents.items():
+        if body <= 0:
+            continue
+        for start_time in start_times.get(start, ()):
+            for end_time in end_times.get(end, ()):
+                if observations.before(start_time, end_time) and observations.similar_times(start_time, end_time):
+                    count = start_counts[(start, start_time)] * end_counts[(end, end_time)]
+                    supports[(start, end, start_time, end_time, body)] += CROSS_WEIGHT * count
+    return supports
+
+'''
+    ground_mode_rules
+    Same as ground_time_rules for
+        FrequentTrip(L1, L2) & StartLocation(S, L1) & EndLocation(S, L2) & Mode(S, M) >> FrequentTripMode(L1, L2, M)
+        FrequentTrip(L1, L2) & StartLocation(S1, L1) & EndLocation(S2, L2) & Mode(S1, M) & Mode(S2, M) >> FrequentTripMode(L1, L2, M)
+'''
+def ground_mode_rules(obs, frequents):
+    supports = defaultdict(float)
+    for segment in obs.segments:
+        trip = (obs.get('start_location', segment), obs.get('end_location', segment))
+        mode = obs.get('mode', segment)
+        if frequents.get(trip, 0.0) > 0 and mode is not None:
+            supports[trip + (mode, frequents[trip])] += SEGMENT_WEIGHT
+    start_counts = count_at(obs, 'start_location', 'mode')
+    end_counts = count_at(obs, 'end_location', 'mode')
+    start_modes = values_by_location(start_counts)
+    for (start, end), body in frequents.items():
+        if body <= 0:
+            continue
+        for mode in start_modes.get(start, ()):
+            count = start_counts[(start, mode)] * end_counts.get((end, mode), 0)
+            if count:
+                supports[(start, end, mode, body)] += CROSS_WEIGHT * count
+    return supports
+
+'''
+    ground
+    HLMRF of one predicate's rule supports (head arguments, then body) and its prior
+'''
+def ground(supports, prior_weight, squared=True):
+    model = hlmrf.HLMRF()
+    keys = [support[:-1] for support in supports]
+    model.add_rules(keys, list(supports.values()), [support[-1] for support in supports], squared)
+    model.add_priors(sorted(set(keys)), prior_weight, squared)
+    return model
+
+'''
+    run
+    Infer the frequent trip times and modes of data_directory and write
+    frequent_times_infer.txt and frequent_modes_infer.txt to output_directory
+    Returns the (keys, truth values) of the times and of the modes
+'''
+def run(data_directory, output_directory, squared=True, threads=1):
+    obs = observations.load(data_directory)
+    frequents = atoms.load_truth_file(os.path.join(data_directory, FREQUENTS_FILE))
+    results = []
+    for supports, prior_weight, predicate, filename in [
+            (ground_time_rules(obs, frequents), TIME_PRIOR_WEIGHT, 'FREQUENTTRIPTIME', TIMES_OUTPUT_FILE),
+            (ground_mode_rules(obs, frequents), MODE_PRIOR_WEIGHT, 'FREQUENTTRIPMODE', MODES_OUTPUT_FILE)]:
+        model = ground(supports, prior_weight, squared)
+        truths, iterations = hlmrf.solve(model, threads=threads)
+        atoms.write_atoms(os.path.join(output_directory, filename), predicate, model.keys, truths.tolist())
+        print('Inferred %d %s atoms in %d ADMM iterations' % (len(model), predicate, iterations))
+        results.append((model.keys, truths))
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Infer frequent trip times and modes without the JVM')
+    parser.add_argument('data_directory', help='Directory with the observation files and grounded_frequents.txt')
+    parser.add_argument('-o', '--output', default='./output/default', help='Directory the inferred atoms are written to')
+    parser.add_argument('-l', '--linear', action='store_true', help='Use linear instead of squared hinges')
+    parser.add_argument('-j', '--threads', type=int, default=1, help='Threads updating the ADMM potentials')
+    args = parser.parse_args()
+    run(args.data_directory, args.output, not args.linear, args.threads)
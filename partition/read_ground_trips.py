@@ -155,3 +155,16 @@ def write_dataset(read_files, out_dataset):
             concat += '\n'
             out_f.write(concat)
 
+
+'''
+    write_dataset_store
+    Same as write_dataset, but take the columns from the columnar observation store
+    columns are store column names, start_location and end_location for the locations
+'''
+def write_dataset_store(store_path, columns, out_dataset):
+    import preprocessing.store as store
+    stored, meta = store.load(store_path)
+    values = [store.column_strings(stored, meta, name) for name in columns]
+    with open(out_dataset, 'w+') as out_f:
+        for row in zip(*values):
+            out_f.write('\t'.join([val for val in row if val is not None]) + '\n')
@@ -0,0 +1,28 @@
+# Run from the repository root: python -m preprocessing.TestPreprocessing
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+import preprocessing.preprocessing as preprocessing
+
+def read_rows(path):
+    with open(path, 'r') as rf:
+        return [line.rstrip('\n') for line in rf]
+
+directory = tempfile.mkdtemp()
+start_file, end_file = os.path.join(directory, 'start.txt'), os.path.join(directory, 'end.txt')
+try:
+    # Indices below half are start locations, the rest the end locations of segment index - half.
+    # Segment 2 has no end and the repeat of index 4 is ignored
+    locations_list = [((1.0, 2.0), 0), ((5.0, 6.0), 4), ((3.0, 4.0), 1), ((7.0, 8.0), 3), ((9.0, 9.0), 2), ((0.0, 0.0), 4)]
+    preprocessing.write_locations(locations_list, 6, start_file, end_file)
+    assert(read_rows(start_file) == ['1\t3.000000 4.000000', '0\t1.000000 2.000000'])
+    assert(read_rows(end_file) == ['1\t5.000000 6.000000', '0\t7.000000 8.000000'])
+
+    preprocessing.write_all_locations([(1.0, 2.0)], [(3.0, 4.0)], start_file, end_file)
+    assert(read_rows(start_file) == ['0\t1.000000 2.000000'])
+    assert(read_rows(end_file) == ['0\t3.000000 4.000000'])
+finally:
+    shutil.rmtree(directory)
@@ -0,0 +1,42 @@
+# Run from the repository root: python -m preprocessing.TestSharding
+from __future__ import absolute_import
+
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, 'data_generator')
+import generator
+import cluster.ClusterGPS as ClusterGPS
+import preprocessing.parser.parse as ps
+import preprocessing.sharding as sharding
+
+def generated_trips(users, segments):
+    directory = tempfile.mkdtemp()
+    try:
+        generator.generate(directory, segments, users, seed=0, raw=False)
+        observations = []
+        for user in range(users):
+            observations.extend(ps.iter_cleaned_segments('%s/user%02d.timeline' % (directory, user)))
+    finally:
+        shutil.rmtree(directory)
+    start = [tuple(round(value, 4) for value in obs.start_location) for obs in observations]
+    end = [tuple(round(value, 4) for value in obs.end_location) for obs in observations]
+    centers, num_clusters = ClusterGPS.cluster_locations(0.1, dict((location, 0) for location in start + end))
+    return np.array([centers[location] for location in start]), np.array([centers[location] for location in end])
+
+# One user's trips all hang off home and work, the shards still cut fewer trips
+# than putting every location in a random shard would (1 - 1 / shards)
+start, end = generated_trips(1, 2000)
+for num_shards in [2, 4, 8]:
+    shards, cut = sharding.shard_trips(start, end, num_shards)
+    assert(cut.mean() < 1 - 1.0 / num_shards)
+    assert(len(np.unique(shards)) > 1)
+
+# Users share no locations, so their trips are never cut and the shards are even
+start, end = generated_trips(4, 4000)
+shards, cut = sharding.shard_trips(start, end, 4)
+assert(not cut.any())
+assert(np.bincount(shards).tolist() == [1000, 1000, 1000, 1000])
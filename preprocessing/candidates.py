@@ -0,0 +1,231 @@
+'''
+    candidates.py
+    Candidate target atoms for the PSL programs
+    The Groovy programs fill their targets with the cross product of every location
+    (and mode and time), but only atoms some rule can ground with an observed segment
+    ever move away from their negative prior. This writes just those atoms, optionally
+    with the locations within a radius of each trip end swapped in, as target files the
+    programs load instead of the cross product, and reports how much smaller they are
+'''
+
+# Python 2 would otherwise resolve the preprocessing package to preprocessing.py
+from __future__ import absolute_import
+
+import argparse
+import json
+import os
+from collections import defaultdict
+
+import cluster.ClusterGPS as ClusterGPS
+import preprocessing.observations as observations
+
+# Target file of each predicate, see loadCandidates in the Groovy programs
+CANDIDATE_FILES = {
+    'FrequentTrip': 'candidate_frequent_trips.txt',
+    'FrequentTripTime': 'candidate_frequent_trip_times.txt',
+    'FrequentTripMode': 'candidate_frequent_trip_modes.txt',
+    'AnchorTime': 'candidate_anchor_times.txt',
+    'AnchorMode': 'candidate_anchor_modes.txt'
+}
+REPORT_FILE = 'candidates.json'
+
+# Grounded frequent trips InferTripInfo closes FrequentTrip with
+GROUNDED_FREQUENTS_FILE = 'grounded_frequents.txt'
+
+'''
+    neighbors
+    Dict from every location string to the other locations within radius km of it
+'''
+def neighbors(locations, radius):
+    points = [ClusterGPS.get_lat_long(location) for location in locations]
+    grid = ClusterGPS.GridIndex(points, radius)
+    near = {}
+    for location, point in zip(locations, points):
+        near[location] = [locations[ind] for ind in grid.candidates(point)
+            if locations[ind] != location and ClusterGPS.compute_haversine_distance(point, points[ind]) <= radius]
+    return near
+
+'''
+    widen
+    Add the trips with either end swapped for a location near it
+'''
+def widen(trips, near):
+    widened = set(trips)
+    for start, end in trips:
+        for location in near.get(start, ()):
+            if location != end:
+                widened.add((location, end))
+        for location in near.get(end, ()):
+            if location != start:
+                widened.add((start, location))
+    return widened
+
+'''
+    frequent_trip_candidates
+    (start, end) pairs of a segment, or of the start of one segment and the end of
+    any segment the same day, the bodies of InferFrequentTrips' rules
+    PSL fetches the head of every row the body query returns before it evaluates
+    Before, SimilarTimes and ~EqualLocations, and a target atom missing from the
+    candidates fails grounding, so the time filters are not applied and trips
+    starting and ending at the same location are kept
+'''
+def frequent_trip_candidates(obs):
+    trips = set()
+    for segment in obs.segments:
+        start, end = obs.get('start_location', segment), obs.get('end_location', segment)
+        if start is not None and end is not None:
+            trips.add((start, end))
+    for segments in obs.by_value('day').values():
+        starts = set(obs.get('start_location', segment) for segment in segments if obs.get('start_time', segment) is not None)
+        ends = set(obs.get('end_location', segment) for segment in segments if obs.get('end_time', segment) is not None)
+        starts.discard(None)
+        ends.discard(None)
+        for start in starts:
+            for end in ends:
+                trips.add((start, end))
+    return trips
+
+def values_at(obs, location_name, value_name):
+    # Dict from location to the values of the segments starting (or ending) there
+    values = defaultdict(set)
+    for segment in obs.segments:
+        location, value = obs.get(location_name, segment), obs.get(value_name, segment)
+        if location is not None and value is not None:
+            values[location].add(value)
+    return values
+
+'''
+    trip_time_candidates
+    (start, end, start time, end time) for trips, the times of a segment making the
+    trip or any start time at its start with any end time at its end (InferTripInfo),
+    Before and SimilarTimes only filter after the head is fetched
+'''
+def trip_time_candidates(obs, trips):
+    candidates = set()
+    for segment in obs.segments:
+        trip = (obs.get('start_location', segment), obs.get('end_location', segment))
+        times = (obs.get('start_time', segment), obs.get('end_time', segment))
+        if trip in trips and None not in times:
+            candidates.add(trip + times)
+    start_times = values_at(obs, 'start_location', 'start_time')
+    end_times = values_at(obs, 'end_location', 'end_time')
+    for start, end in trips:
+        for start_time in start_times.get(start, ()):
+            for end_time in end_times.get(end, ()):
+                candidates.add((start, end, start_time, end_time))
+    return candidates
+
+'''
+    trip_mode_candidates
+    (start, end, mode) for trips, the mode of a segment making the trip or a mode
+    seen both leaving its start and arriving at its end (InferTripInfo)
+'''
+def trip_mode_candidates(obs, trips):
+    candidates = set()
+    for segment in obs.segments:
+        trip = (obs.get('start_location', segment), obs.get('end_location', segment))
+        mode = obs.get('mode', segment)
+        if trip in trips and mode is not None:
+            candidates.add(trip + (mode,))
+    start_modes = values_at(obs, 'start_location', 'mode')
+    end_modes = values_at(obs, 'end_location', 'mode')
+    for start, end in trips:
+        for mode in start_modes.get(start, set()) & end_modes.get(end, set()):
+            candidates.add((start, end, mode))
+    return candidates
+
+'''
+    anchor_candidates
+    (location, value) for every location a segment starts or ends at with its value of
+    value_name, start and end times go with their own end of the segment (Bipedal)
+'''
+def anchor_candidates(obs, value_names):
+    candidates = set()
+    for location_name, value_name in zip(['start_location', 'end_location'], value_names):
+        for location, values in values_at(obs, location_name, value_name).items():
+            for value in values:
+                candidates.add((location, value))
+    return candidates
+
+'''
+    load_grounded_frequents
+    Every trip of grounded_frequents.txt, None without the file. InferTripInfo loads
+    them all as observed FrequentTrip atoms, so a trip at 0 still grounds the rules
+'''
+def load_grounded_frequents(path):
+    if not os.path.exists(path):
+        return None
+    trips = set()
+    with open(path, 'r') as rf:
+        for line in rf:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) >= 2:
+                trips.add((fields[0], fields[1]))
+    return trips
+
+def write_atoms(path, atoms):
+    with open(path, 'w+') as wf:
+        for atom in sorted(atoms):
+            wf.write('\t'.join(atom) + '\n')
+
+'''
+    run
+    Write the candidate target files of data_directory's observations there, widened
+    by the locations within radius km when radius is given. Trip times and modes are
+    only generated for the frequent trips of grounded_frequents.txt once it exists
+    Returns the report of candidate counts against the cross products
+'''
+def run(data_directory, radius=None):
+    obs = observations.load(data_directory)
+    locations = obs.locations()
+    times = sorted(set(obs.values('start_time')) | set(obs.values('end_time')))
+    modes = obs.values('mode')
+    trips = frequent_trip_candidates(obs)
+    if radius:
+        trips = widen(trips, neighbors(locations, radius))
+    grounded = load_grounded_frequents(os.path.join(data_directory, GROUNDED_FREQUENTS_FILE))
+    trip_info = grounded if grounded is not None else trips
+    candidates = {
+        'FrequentTrip': trips,
+        'FrequentTripTime': trip_time_candidates(obs, trip_info),
+        'FrequentTripMode': trip_mode_candidates(obs, trip_info),
+        'AnchorTime': anchor_candidates(obs, ['start_time', 'end_time']),
+        'AnchorMode': anchor_candidates(obs, ['mode', 'mode'])
+    }
+    cross_products = {
+        'FrequentTrip': len(locations) ** 2,
+        'FrequentTripTime': len(locations) ** 2 * len(times) ** 2,
+        'FrequentTripMode': len(locations) ** 2 * len(modes),
+        'AnchorTime': len(locations) * len(times),
+        'AnchorMode': len(locations) * len(modes)
+    }
+    report = {'radius': radius, 'locations': len(locations), 'times': len(times), 'modes': len(modes), 'predicates': {}}
+    for predicate, atoms in candidates.items():
+        write_atoms(os.path.join(data_directory, CANDIDATE_FILES[predicate]), atoms)
+        report['predicates'][predicate] = {
+            'candidates': len(atoms),
+            'cross_product': cross_products[predicate],
+            'reduction': cross_products[predicate] / float(len(atoms)) if atoms else None
+        }
+        print('%s\t%d candidates of %d (%s)' % (predicate, len(atoms), cross_products[predicate],
+            '%0.1fx fewer' % report['predicates'][predicate]['reduction'] if atoms else 'none'))
+    with open(os.path.join(data_directory, REPORT_FILE), 'w+') as wf:
+        json.dump(report, wf, indent=2, sort_keys=True)
+    return report
+
+'''
+    remove
+    Delete the candidate files of data_directory so the programs fall back to the cross products
+'''
+def remove(data_directory):
+    for filename in list(CANDIDATE_FILES.values()) + [REPORT_FILE]:
+        path = os.path.join(data_directory, filename)
+        if os.path.exists(path):
+            os.remove(path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write candidate target atoms backed by observed segments')
+    parser.add_argument('data_directory', help='Directory with the observation files, the candidates are written there')
+    parser.add_argument('-r', '--radius', type=float, default=None, help='Also pair trip ends with the locations within this many km')
+    args = parser.parse_args()
+    run(args.data_directory, args.radius)
@@ -0,0 +1,127 @@
+'''
+    location_relations.py
+    Precomputed EqualLocations and Near relations between locations
+    The LocationComparison and ManhattanNear external functions parse both location
+    strings on every call the grounder makes. This parses the distinct locations
+    once and writes the pairs the functions would give a value to as observed
+    predicate files, the Groovy programs load them as closed predicates in place
+    of the functions. Near keeps only the pairs at or above a cutoff, everything
+    else is 0 under the closed world
+'''
+
+# Python 2 would otherwise resolve the preprocessing package to preprocessing.py
+from __future__ import absolute_import
+
+import argparse
+import os
+
+import numpy as np
+
+import preprocessing.observations as observations
+
+# Location, tab, location for every pair with the same coordinates
+EQUAL_FILE = 'equal_obs.txt'
+
+# Location, tab, location, tab, ManhattanNear value for every pair at or above the cutoff
+NEAR_FILE = 'near_obs.txt'
+
+# Rows compared against the rest at once when looking for near pairs
+NEAR_BLOCK = 1024
+
+'''
+    parse_locations
+    (n, 2) array of the "lon lat" strings in locations
+'''
+def parse_locations(locations):
+    if not locations:
+        return np.zeros((0, 2))
+    return np.fromstring(' '.join(locations), sep=' ').reshape(-1, 2)
+
+'''
+    equal_pairs
+    Ordered (i, j) index pairs of points with the same coordinates, including (i, i),
+    the pairs LocationComparison returns 1 for
+'''
+def equal_pairs(points):
+    if len(points) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    unique_points, inverse = np.unique(points, axis=0, return_inverse=True)
+    order = np.argsort(inverse, kind='mergesort')
+    bounds = np.flatnonzero(np.diff(inverse[order])) + 1
+    pairs = []
+    for group in np.split(order, bounds):
+        pairs.append(np.array(np.meshgrid(group, group, indexing='ij')).reshape(2, -1).T)
+    return np.vstack(pairs)
+
+'''
+    near_values
+    ManhattanNear of every row of points against every row of others: the inverse
+    Manhattan distance in degrees, capped at 1
+'''
+def near_values(points, others):
+    distances = np.abs(points[:, None, 0] - others[None, :, 0]) + np.abs(points[:, None, 1] - others[None, :, 1])
+    with np.errstate(divide='ignore'):
+        return np.minimum(1.0, 1.0 / distances)
+
+'''
+    near_pairs
+    Ordered (i, j) index pairs and values of points whose ManhattanNear value is at
+    least cutoff, that is within 1 / cutoff degrees. Points are sorted by longitude
+    so each block is only compared to the points in its longitude band
+    Returns (pairs, values)
+'''
+def near_pairs(points, cutoff, block=NEAR_BLOCK):
+    if not 0 < cutoff <= 1:
+        raise ValueError('ManhattanNear values are between 0 and 1, got a cutoff of %f' % cutoff)
+    # Padded so pairs exactly 1 / cutoff apart in longitude are not lost to rounding
+    reach = 1.0 / cutoff + 1e-9
+    order = np.argsort(points[:, 0], kind='mergesort')
+    lons = points[order, 0]
+    pairs, values = [], []
+    for start in range(0, len(order), block):
+        rows = order[start:start + block]
+        low = np.searchsorted(lons, lons[start] - reach, side='left')
+        high = np.searchsorted(lons, lons[min(start + block, len(order)) - 1] + reach, side='right')
+        columns = order[low:high]
+        block_values = near_values(points[rows], points[columns])
+        row_inds, column_inds = np.nonzero(block_values >= cutoff)
+        pairs.append(np.column_stack([rows[row_inds], columns[column_inds]]))
+        values.append(block_values[row_inds, column_inds])
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64), np.zeros(0)
+    return np.vstack(pairs), np.concatenate(values)
+
+'''
+    run
+    Write the equal pairs of data_directory's locations there, and the near pairs
+    when near_cutoff is given (ManhattanNear is 1 within a degree, so a city's
+    locations are mostly all near each other)
+    Returns (equal pairs, near pairs), near pairs is None without a cutoff
+'''
+def run(data_directory, near_cutoff=None):
+    locations = observations.load(data_directory).locations()
+    points = parse_locations(locations)
+    equal = equal_pairs(points)
+    with open(os.path.join(data_directory, EQUAL_FILE), 'w+') as wf:
+        for first, second in equal.tolist():
+            wf.write('%s\t%s\n' % (locations[first], locations[second]))
+    near_path = os.path.join(data_directory, NEAR_FILE)
+    num_near = None
+    if near_cutoff is not None:
+        near, values = near_pairs(points, near_cutoff)
+        with open(near_path, 'w+') as wf:
+            for (first, second), value in zip(near.tolist(), values.tolist()):
+                wf.write('%s\t%s\t%f\n' % (locations[first], locations[second], value))
+        num_near = len(near)
+    elif os.path.exists(near_path):
+        # A stale file would replace the Near function with an old cutoff
+        os.remove(near_path)
+    print('%d locations, %d equal pairs, %s near pairs' % (len(locations), len(equal), 'no' if num_near is None else num_near))
+    return len(equal), num_near
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write the EqualLocations and Near pairs of the observed locations')
+    parser.add_argument('data_directory', help='Directory with the observation files, the pairs are written there')
+    parser.add_argument('-c', '--near-cutoff', type=float, default=None, help='Also write the pairs with a ManhattanNear value of at least this')
+    args = parser.parse_args()
+    run(args.data_directory, args.near_cutoff)
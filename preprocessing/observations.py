@@ -0,0 +1,96 @@
+'''
+    observations.py
+    Read the observation files of a data directory the way the PSL programs load them
+    Every file is segment #, tab, value, a segment may be missing from some files
+    (mode_obs.txt only has segments with a known mode)
+'''
+
+import os
+from collections import defaultdict
+
+# Observation file of each segment attribute, the names the Groovy programs read
+OBS_FILES = {
+    'start_location': 'start_location_obs.txt',
+    'end_location': 'end_location_obs.txt',
+    'start_time': 'start_time_obs.txt',
+    'end_time': 'end_time_obs.txt',
+    'mode': 'mode_obs.txt',
+    'day': 'segment_days_obs.txt'
+}
+SEGMENT_FILE = 'segment_obs.txt'
+
+# The order BeforeCompare and SimilarTimes compare times in, unknown times come first
+TIME_ORDER = ['Morning', 'Afternoon', 'Evening', 'Night']
+
+def time_index(time):
+    return TIME_ORDER.index(time) if time in TIME_ORDER else -1
+
+def before(time1, time2):
+    return time_index(time1) <= time_index(time2)
+
+def similar_times(time1, time2):
+    return time_index(time1) - time_index(time2) <= 1
+
+def read_obs_file(path):
+    values = {}
+    if not os.path.exists(path):
+        return values
+    with open(path, 'r') as rf:
+        for line in rf:
+            fields = line.rstrip('\n').split('\t', 1)
+            if len(fields) == 2:
+                values[int(fields[0])] = fields[1]
+    return values
+
+'''
+    Observations
+    Segment numbers with a dict from segment # to value for every attribute in OBS_FILES
+'''
+class Observations(object):
+
+    def __init__(self, segments, attributes):
+        self.segments = segments
+        self.attributes = attributes
+
+    def __len__(self):
+        return len(self.segments)
+
+    def get(self, name, segment):
+        return self.attributes[name].get(segment)
+
+    '''
+        locations
+        Every distinct start and end location string, sorted
+    '''
+    def locations(self):
+        return sorted(set(self.attributes['start_location'].values()) | set(self.attributes['end_location'].values()))
+
+    def values(self, name):
+        return sorted(set(self.attributes[name].values()))
+
+    '''
+        by_value
+        Dict from each value of attribute name to the segments that have it, in segment order
+    '''
+    def by_value(self, name):
+        grouped = defaultdict(list)
+        for segment in self.segments:
+            value = self.attributes[name].get(segment)
+            if value is not None:
+                grouped[value].append(segment)
+        return grouped
+
+'''
+    load
+    Observations of data_directory, segments come from segment_obs.txt or, without
+    it, from the start locations
+'''
+def load(data_directory):
+    attributes = dict((name, read_obs_file(os.path.join(data_directory, filename))) for name, filename in OBS_FILES.items())
+    segment_path = os.path.join(data_directory, SEGMENT_FILE)
+    if os.path.exists(segment_path):
+        with open(segment_path, 'r') as rf:
+            segments = [int(line.split('\t', 1)[0]) for line in rf if line.strip()]
+    else:
+        segments = sorted(attributes['start_location'])
+    return Observations(segments, attributes)
@@ -0,0 +1,157 @@
+'''
+    demux.py
+    Single pass timeline demultiplexer
+    Splits a timeline into one file per metadata.key, JSON Lines by default, so
+    exploratory tools and the parsers can read the key they need without rescanning
+    the whole timeline. Entries are written one at a time through buffered files
+'''
+
+import argparse
+import decimal
+import json
+import os
+
+import preprocessing.parser.ingest as ingest
+
+JSON_LINES = 'jsonl'
+JSON_ARRAY = 'json'
+FORMATS = [JSON_LINES, JSON_ARRAY]
+
+INDEX_FILE = 'index.json'
+
+WRITE_BUFFER = 1024 * 1024
+
+def json_default(val):
+    # ijson returns non integer numbers as Decimal
+    if isinstance(val, decimal.Decimal):
+        return float(val)
+    raise TypeError('%r is not JSON serializable' % val)
+
+'''
+    key_filename
+    File name the entries of key are written to, background/location becomes
+    background_location.jsonl
+'''
+def key_filename(key, fmt=JSON_LINES):
+    return '%s.%s' % (key.replace('/', '_'), fmt)
+
+def key_path(directory, key, fmt=JSON_LINES):
+    return os.path.join(directory, key_filename(key, fmt))
+
+'''
+    KeyWriter
+    Buffered writer of the entries of a single key, as JSON Lines or as a JSON
+    array whose separators are written before each entry so nothing is patched up after
+'''
+class KeyWriter(object):
+
+    def __init__(self, path, fmt=JSON_LINES):
+        self.path = path
+        self.fmt = fmt
+        self.count = 0
+        self.handle = open(path, 'w', WRITE_BUFFER)
+        if fmt == JSON_ARRAY:
+            self.handle.write('[')
+
+    def write(self, item):
+        line = json.dumps(item, default=json_default)
+        if self.fmt == JSON_ARRAY:
+            self.handle.write(',\n' if self.count else '\n')
+        else:
+            line += '\n'
+        self.handle.write(line)
+        self.count += 1
+
+    def close(self):
+        if self.fmt == JSON_ARRAY:
+            self.handle.write('\n]\n')
+        self.handle.close()
+
+'''
+    demultiplex
+    Split timeline into out_directory in one pass, keys limits the split to those
+    keys (None keeps every key) and paths maps a key to its own output path.
+    With store_path the cleaned sections are also written to the columnar
+    observation store. An index of the files and entry counts is written to
+    out_directory/index.json, the index is returned
+'''
+def demultiplex(timeline, out_directory, keys=None, fmt=JSON_LINES, paths=None, store_path=None):
+    if fmt not in FORMATS:
+        raise ValueError('Unknown format %s, expected one of %s' % (fmt, ', '.join(FORMATS)))
+    if not os.path.isdir(out_directory):
+        os.makedirs(out_directory)
+    paths = paths or {}
+    # Keys given their own path get their file even if the timeline has none of them
+    writers = dict((key, KeyWriter(path, fmt)) for key, path in paths.items())
+    stats = ingest.IngestStats(ingest.get_backend())
+    store_writer, observation, sections = None, None, 0
+    if store_path is not None:
+        # parse reads demultiplexed directories, so it can only be imported here
+        import preprocessing.parser.parse as ps
+        import preprocessing.store as store
+        store_writer = store.ObsStoreWriter(store_path, ps.VOCABULARIES)
+        observation = ps.get_location_obs_from_csegment
+    try:
+        with open(timeline, 'rb') as rawfile:
+            for item in ingest.iter_items_by_key(rawfile, keys, stats=stats):
+                key = item['metadata']['key']
+                writer = writers.get(key)
+                if writer is None:
+                    writer = KeyWriter(key_path(out_directory, key, fmt), fmt)
+                    writers[key] = writer
+                writer.write(item)
+                if store_writer is not None and key == ingest.CLEANED_SECTION_KEY:
+                    store_writer.append(sections, observation(item))
+                    sections += 1
+    finally:
+        for writer in writers.values():
+            writer.close()
+    if store_writer is not None:
+        store_writer.close()
+    index = {
+        'timeline': os.path.abspath(timeline),
+        'format': fmt,
+        'entries': stats.entries,
+        # Paths are relative to the index so the directory can be moved
+        'keys': dict((key, {'path': os.path.relpath(writer.path, out_directory), 'count': writer.count}) for key, writer in writers.items())
+    }
+    with open(os.path.join(out_directory, INDEX_FILE), 'w+') as wf:
+        json.dump(index, wf, indent=2, sort_keys=True)
+    return index
+
+def is_demultiplexed(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, INDEX_FILE))
+
+def load_index(directory):
+    with open(os.path.join(directory, INDEX_FILE), 'r') as rf:
+        return json.load(rf)
+
+'''
+    iter_key_items
+    Yield the entries of key from a demultiplexed directory, nothing if the
+    timeline had none
+'''
+def iter_key_items(directory, key):
+    index = load_index(directory)
+    entry = index['keys'].get(key)
+    if entry is None:
+        return
+    with open(os.path.join(directory, entry['path']), 'rb') as rf:
+        if index['format'] == JSON_ARRAY:
+            for item in ingest.get_backend().items(rf, 'item'):
+                yield item
+            return
+        for line in rf:
+            yield json.loads(line.decode('utf-8'))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Split a timeline into one file per metadata.key')
+    parser.add_argument('timeline', help='Timeline to split')
+    parser.add_argument('out_directory', help='Directory the per key files are written to')
+    parser.add_argument('-k', '--keys', nargs='+', default=None, help='Only write these keys (default: every key)')
+    parser.add_argument('-f', '--format', choices=FORMATS, default=JSON_LINES, help='Output format of the per key files')
+    parser.add_argument('-s', '--store', default=None, help='Also write the cleaned sections to this columnar observation store')
+    args = parser.parse_args()
+    index = demultiplex(args.timeline, args.out_directory, args.keys, args.format, store_path=args.store)
+    for key in sorted(index['keys']):
+        print('%s\t%d' % (key, index['keys'][key]['count']))
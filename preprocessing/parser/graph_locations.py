@@ -4,11 +4,14 @@
 '''
 
 import ijson
-import json
 import numpy as np
-import os
 import matplotlib.pyplot as plt
 
+import preprocessing.parser.demux as demux
+
+FILTERED_LOCATION_KEY = 'background/filtered_location'
+MOTION_ACTIVITY_KEY = 'background/motion_activity'
+
 def parse_locations(filename):
     with open(filename, 'rb') as f, open('coordinates.txt', 'w') as c:
         coordinates = []
@@ -31,27 +34,17 @@ def parse_locations(filename):
         plt.ylabel('Latitude')
         plt.show()
 
+'''
+    filter_info
+    Split the filtered locations and motion activity out of a timeline into
+    JSON arrays in one pass, see demux.py
+'''
 def filter_info(filename):
-    with open(filename, 'rb') as f, open('filtered_locations.txt', 'w') as fl, open('motion_activity.txt', 'w') as ma:
-        final_items = []
-        for handle in [fl, ma]:
-            handle.write('[\n')
-        for item in ijson.items(f,'item'):
-            if item['metadata']['key'] == 'background/filtered_location':
-                fl.write(json.dumps(item, default=recursive_default))
-                fl.write(',\n')
-            elif item['metadata']['key'] == 'background/motion_activity':
-                ma.write(json.dumps(item, default=recursive_default))
-                ma.write(',\n')
-        for handle in [fl, ma]:
-            handle.seek(-2, os.SEEK_END)
-            handle.truncate()
-            handle.write(']\n')
-        
-def recursive_default(val):
-    if isinstance(val, dict):
-        return val.__dict__
-    return '%f' % val
+    demux.demultiplex(filename, '.', keys=[FILTERED_LOCATION_KEY, MOTION_ACTIVITY_KEY], fmt=demux.JSON_ARRAY, paths={
+        FILTERED_LOCATION_KEY: 'filtered_locations.txt',
+        MOTION_ACTIVITY_KEY: 'motion_activity.txt'
+    })
 
-# filter_info('/Users/ankur/Coding/PSL-Bipedal/preprocessing/parser/jay_march_2016_2_march_2017.timeline')
-parse_locations('/Users/ankur/Coding/PSL-Bipedal/preprocessing/parser/filtered_locations.txt')
+if __name__ == '__main__':
+    # filter_info('/Users/ankur/Coding/PSL-Bipedal/preprocessing/parser/jay_march_2016_2_march_2017.timeline')
+    parse_locations('/Users/ankur/Coding/PSL-Bipedal/preprocessing/parser/filtered_locations.txt')
@@ -0,0 +1,172 @@
+'''
+    incremental.py
+    Append-only ingestion of a growing timeline
+    A manifest records the byte offset where the last entry of the timeline ended
+    on the last run, the next run only parses the entries written after it and appends
+    their observations with continuing segment ids
+'''
+
+import hashlib
+import json
+import os
+
+import preprocessing.parser.ingest as ingest
+import preprocessing.parser.parse as ps
+
+WHITESPACE = b' \t\r\n'
+
+# Bytes before the recorded offset that must be unchanged to resume
+DIGEST_WINDOW = 4096
+
+READ_SIZE = 64 * 1024
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r') as rf:
+        return json.load(rf)
+
+def write_manifest(manifest_path, manifest):
+    with open(manifest_path, 'w+') as wf:
+        json.dump(manifest, wf, indent=2)
+
+'''
+    content_end
+    Offset just past the last non whitespace byte before position
+'''
+def content_end(rawfile, position):
+    while position > 0:
+        size = min(READ_SIZE, position)
+        position -= size
+        rawfile.seek(position)
+        chunk = rawfile.read(size).rstrip(WHITESPACE)
+        if chunk:
+            return position + len(chunk)
+    return 0
+
+'''
+    array_end
+    Byte offset of the closing bracket of the timeline's top level array
+'''
+def array_end(rawfile):
+    rawfile.seek(0, os.SEEK_END)
+    end = content_end(rawfile, rawfile.tell()) - 1
+    if end < 0:
+        raise ValueError('Timeline is empty')
+    rawfile.seek(end)
+    if rawfile.read(1) != b']':
+        raise ValueError('Timeline does not end with a JSON array')
+    return end
+
+def tail_digest(rawfile, offset):
+    start = max(0, offset - DIGEST_WINDOW)
+    rawfile.seek(start)
+    return hashlib.sha1(rawfile.read(offset - start)).hexdigest()
+
+'''
+    TimelineSlice
+    File-like view of the timeline bytes between start and end (the closing bracket)
+    that ijson parses as a complete array. A slice starting after the last entry of
+    a previous run gets its separating comma replaced by an opening bracket
+'''
+class TimelineSlice(object):
+
+    def __init__(self, rawfile, start, end):
+        self.rawfile = rawfile
+        self.remaining = end - start
+        self.pending = b''
+        rawfile.seek(start)
+        if start > 0:
+            head = self.read_raw(READ_SIZE).lstrip(WHITESPACE)
+            if head.startswith(b','):
+                head = head[1:]
+            self.pending = b'[' + head
+        self.closed = False
+
+    def read_raw(self, size):
+        size = min(size, self.remaining)
+        data = self.rawfile.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def read(self, size=READ_SIZE):
+        if size == 0:
+            return b''
+        if self.pending:
+            data, self.pending = self.pending[:size], self.pending[size:]
+            return data
+        data = self.read_raw(size)
+        if not data and not self.closed:
+            self.closed = True
+            return b']'
+        return data
+
+class SectionState(object):
+
+    def __init__(self, last_write_ts):
+        self.last_write_ts = last_write_ts
+        self.older = 0
+
+'''
+    iter_new_sections
+    Yield a LocationObs for every cleaned section of stream, state.last_write_ts
+    follows the newest section seen. The offset and digest already decide what is
+    new, sections written before the newest one of the last run (a late upload) are
+    kept and only counted in state.older
+'''
+def iter_new_sections(stream, state, stats=None):
+    previous_ts = state.last_write_ts
+    for item in ingest.iter_items_by_key(stream, [ingest.CLEANED_SECTION_KEY], stats=stats):
+        write_ts = item['metadata'].get('write_ts')
+        if write_ts is not None:
+            write_ts = float(write_ts)
+            if previous_ts is not None and write_ts <= previous_ts:
+                state.older += 1
+            if state.last_write_ts is None or write_ts > state.last_write_ts:
+                state.last_write_ts = write_ts
+        yield ps.get_location_obs_from_csegment(item)
+
+def can_resume(manifest, timeline, rawfile, end):
+    if manifest is None or manifest['timeline'] != os.path.abspath(timeline):
+        return False
+    if manifest['offset'] > end:
+        return False
+    return tail_digest(rawfile, manifest['offset']) == manifest['digest']
+
+'''
+    ingest_timeline
+    Parse the part of timeline written since the last run and append its observations
+    to obs_paths (the nine write_obs paths) and the store. Falls back to a full parse
+    when there is no manifest or the timeline was rewritten before the recorded offset
+    Returns the number of segments written
+'''
+def ingest_timeline(timeline, obs_paths, store_path, manifest_path):
+    manifest = load_manifest(manifest_path)
+    with open(timeline, 'rb') as rawfile:
+        end = array_end(rawfile)
+        last_entry_end = content_end(rawfile, end)
+        resume = can_resume(manifest, timeline, rawfile, last_entry_end)
+        if resume:
+            start, segments, state = manifest['offset'], manifest['segments'], SectionState(manifest['last_write_ts'])
+        else:
+            start, segments, state = 0, 0, SectionState(None)
+        stream = TimelineSlice(rawfile, start, end)
+        observations = iter_new_sections(stream, state)
+        written = ps.write_obs(observations, *obs_paths, store_path=store_path, start=segments, append=resume)
+        digest = tail_digest(rawfile, last_entry_end)
+    write_manifest(manifest_path, {
+        'timeline': os.path.abspath(timeline),
+        'offset': last_entry_end,
+        'digest': digest,
+        'last_write_ts': state.last_write_ts,
+        'segments': segments + written
+    })
+    if resume and written == 0:
+        print('No new segments after byte %d' % start)
+    elif resume:
+        print('Appended %d new segments after byte %d, segment ids %d to %d' % (written, start, segments, segments + written - 1))
+    else:
+        print('Parsed %d segments from the whole timeline' % written)
+    if state.older:
+        print('%d appended sections were written before the newest section of the last run' % state.older)
+    return written
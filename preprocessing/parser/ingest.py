@@ -0,0 +1,126 @@
+'''
+    ingest.py
+    Key-prefiltered ingestion of e-mission timelines
+    Only timeline entries whose metadata.key is requested are built into dicts,
+    everything else is skipped at the parser event level
+'''
+
+import importlib
+import time
+
+from ijson.common import ObjectBuilder
+
+# Fastest first, yajl2_c ships with newer ijson releases
+BACKENDS = ['yajl2_c', 'yajl2_cffi', 'yajl2', 'python']
+
+# Backends that build objects natively
+C_BUILDERS = ['yajl2_c']
+
+CLEANED_SECTION_KEY = 'analysis/cleaned_section'
+SEGMENT_KEYS = ['background/location', 'background/filtered_location', 'background/motion_activity']
+
+'''
+    get_backend
+    Import the first ijson backend from names that is available on this machine
+'''
+def get_backend(names=BACKENDS):
+    for name in names:
+        try:
+            return importlib.import_module('ijson.backends.' + name)
+        except ImportError:
+            continue
+    raise ImportError('No ijson backend available, tried %s' % ', '.join(names))
+
+def backend_name(backend):
+    return backend.__name__.split('.')[-1]
+
+class IngestStats(object):
+
+    def __init__(self, backend):
+        self.backend = backend_name(backend)
+        self.entries = 0
+        self.kept = 0
+        self.start = time.time()
+        self.elapsed = 0.0
+
+    def finish(self):
+        self.elapsed = time.time() - self.start
+
+    def rate(self):
+        if self.elapsed <= 0:
+            return 0.0
+        return self.entries / self.elapsed
+
+    def report(self):
+        print('Ingested %d entries (%d kept) in %0.2fs, %0.0f entries/sec using ijson %s' % (self.entries, self.kept, self.elapsed, self.rate(), self.backend))
+
+'''
+    iter_items_by_key
+    Yield the timeline entries whose metadata.key is in keys, every entry when keys is None.
+    Parser events of an entry are buffered only until its metadata.key shows up,
+    wanted entries are then built with an ObjectBuilder and the rest are skipped
+    without creating any objects.
+    With stub_skipped, skipped entries are yielded as {'metadata': {'key': key}}
+    so state machines that react to every entry keep their behaviour.
+    The yajl2_c backend builds whole entries in C faster than the python event
+    loop can skip them, so with it entries are built first and filtered after
+'''
+def iter_items_by_key(rawfile, keys, backend=None, stub_skipped=False, stats=None, report=True):
+    if backend is None:
+        backend = get_backend()
+    if stats is None:
+        stats = IngestStats(backend)
+    wanted = frozenset(keys) if keys is not None else None
+    if wanted is None or backend_name(backend) in C_BUILDERS:
+        for item in iter_built_items(rawfile, wanted, backend, stub_skipped, stats):
+            yield item
+    else:
+        for item in iter_prefiltered_items(rawfile, wanted, backend, stub_skipped, stats):
+            yield item
+    stats.finish()
+    if report:
+        stats.report()
+
+def iter_built_items(rawfile, wanted, backend, stub_skipped, stats):
+    for item in backend.items(rawfile, 'item'):
+        stats.entries += 1
+        key = item['metadata']['key']
+        if wanted is None or key in wanted:
+            stats.kept += 1
+            yield item
+        elif stub_skipped:
+            yield {'metadata': {'key': key}}
+
+def iter_prefiltered_items(rawfile, wanted, backend, stub_skipped, stats):
+    events = backend.parse(rawfile)
+    for prefix, event, value in events:
+        if prefix != 'item' or event != 'start_map':
+            continue
+        stats.entries += 1
+        pending = [(event, value)]
+        builder = None
+        key = None
+        depth = 1
+        for prefix, event, value in events:
+            if event == 'start_map' or event == 'start_array':
+                depth += 1
+            elif event == 'end_map' or event == 'end_array':
+                depth -= 1
+            if builder is not None:
+                builder.event(event, value)
+            elif pending is not None:
+                pending.append((event, value))
+                if prefix == 'item.metadata.key':
+                    key = value
+                    if key in wanted:
+                        builder = ObjectBuilder()
+                        for pending_event, pending_value in pending:
+                            builder.event(pending_event, pending_value)
+                    pending = None
+            if depth == 0:
+                break
+        if builder is not None:
+            stats.kept += 1
+            yield builder.value
+        elif stub_skipped:
+            yield {'metadata': {'key': key}}
@@ -3,7 +3,9 @@
     Ankur Goswami, agoswam3@ucsc.edu
 '''
 
-import ijson
+import preprocessing.parser.demux as demux
+import preprocessing.parser.ingest as ingest
+import preprocessing.store as store
 
 seg_path = '/Users/ankur/Coding/PSL-Bipedal/data/segment_obs.txt'
 mode_path = '/Users/ankur/Coding/PSL-Bipedal/data/mode_obs.txt'
@@ -13,15 +15,101 @@ start_time_path = '/Users/ankur/Coding/PSL-Bipedal/data/start_time_obs.txt'
 end_time_path = '/Users/ankur/Coding/PSL-Bipedal/data/end_time_obs.txt'
 data_path = '/Users/ankur/Coding/PSL-Bipedal/preprocessing/parser/jay_march_2016_2_march_2017.timeline'
 
+'''
+    DayVocabulary
+    Interns segment days, each distinct day is formatted once and referred to by its code
+'''
+class DayVocabulary(store.Vocabulary):
+
+    def __init__(self, values=None):
+        super(DayVocabulary, self).__init__(values)
+        self.dates = {}
+
+    def code_date(self, month, day, year):
+        date = (month, day, year)
+        code = self.dates.get(date)
+        if code is None:
+            code = self.code('%d/%d/%d' % date)
+            self.dates[date] = code
+        return code
+
+# Vocabularies shared by every observation, categories are stored as their codes
+MODE_VOCABULARY = store.Vocabulary(store.MODES)
+TIME_VOCABULARY = store.Vocabulary(store.TIMES)
+DAY_VOCABULARY = DayVocabulary()
+VOCABULARIES = {'modes': MODE_VOCABULARY, 'times': TIME_VOCABULARY, 'days': DAY_VOCABULARY}
+
+'''
+    LocationObs
+    One segment, coordinates are plain floats and mode, times and day are small
+    integer codes into the shared vocabularies (-1 when missing). The string
+    attributes are kept as properties so writers see the same values as before
+'''
 class LocationObs(object):
 
+    __slots__ = ['start_lon', 'start_lat', 'end_lon', 'end_lat', 'start_time_code', 'end_time_code', 'mode_code', 'day_code']
+
     def __init__(self):
-        self.start_location = None
-        self.start_time = None
-        self.end_location = None
-        self.end_time = None
-        self.segment_day = None
-        self.mode = None
+        self.start_lon = None
+        self.start_lat = None
+        self.end_lon = None
+        self.end_lat = None
+        self.start_time_code = -1
+        self.end_time_code = -1
+        self.mode_code = -1
+        self.day_code = -1
+
+    @property
+    def start_location(self):
+        if self.start_lon is None:
+            return None
+        return (self.start_lon, self.start_lat)
+
+    @start_location.setter
+    def start_location(self, location):
+        self.start_lon, self.start_lat = float(location[0]), float(location[1])
+
+    @property
+    def end_location(self):
+        if self.end_lon is None:
+            return None
+        return (self.end_lon, self.end_lat)
+
+    @end_location.setter
+    def end_location(self, location):
+        self.end_lon, self.end_lat = float(location[0]), float(location[1])
+
+    @property
+    def start_time(self):
+        return TIME_VOCABULARY.value(self.start_time_code)
+
+    @start_time.setter
+    def start_time(self, time):
+        self.start_time_code = TIME_VOCABULARY.code(time)
+
+    @property
+    def end_time(self):
+        return TIME_VOCABULARY.value(self.end_time_code)
+
+    @end_time.setter
+    def end_time(self, time):
+        self.end_time_code = TIME_VOCABULARY.code(time)
+
+    @property
+    def mode(self):
+        return MODE_VOCABULARY.value(self.mode_code)
+
+    @mode.setter
+    def mode(self, mode):
+        self.mode_code = MODE_VOCABULARY.code(mode)
+
+    @property
+    def segment_day(self):
+        return DAY_VOCABULARY.value(self.day_code)
+
+    @segment_day.setter
+    def segment_day(self, day):
+        self.day_code = DAY_VOCABULARY.code(day)
 
 def get_key(item):
     return item['metadata']['key']
@@ -66,7 +154,8 @@ def get_location_obs_from_csegment(item):
     location.start_time = get_time_string(start_hour)
     location.end_time = get_time_string(end_hour)
     location.mode = get_cleaned_mode(item)
-    location.segment_day = get_day(item)
+    date_obj = item['data']['start_local_dt']
+    location.day_code = DAY_VOCABULARY.code_date(date_obj['month'], date_obj['day'], date_obj['year'])
     return location
 
 '''
@@ -116,11 +205,19 @@ def get_time(item):
     return get_time_string(time)
 
 def parse_segments(filename):
+    return list(iter_segments(filename))
+
+'''
+    iter_segments
+    Generator version of parse_segments, yields each observation as soon as its
+    end segment is found instead of collecting the whole timeline in a list
+'''
+def iter_segments(filename):
     with open(filename, 'rb') as rawfile:
         buffer = None
         current_location = None
-        final_obs = []
-        for item in ijson.items(rawfile, 'item'):
+        # Entries with other keys only reset the state machine, so they come back as key-only stubs
+        for item in ingest.iter_items_by_key(rawfile, ingest.SEGMENT_KEYS, stub_skipped=True):
             if is_start_segment(item) and current_location is None:
                 current_location = LocationObs()
                 current_location.start_time = get_time(item)
@@ -135,11 +232,10 @@ def parse_segments(filename):
                 elif is_end_segment(item):
                     current_location.end_location = (buffer['data']['longitude'], buffer['data']['latitude'])
                     current_location.end_time = get_time(item)
-                    final_obs.append(current_location)
+                    yield current_location
                     current_location = None
                 if is_location(item):
                     buffer = item
-        return final_obs
 
 '''
     TODO: Delete this
@@ -157,20 +253,44 @@ def write_cleaned_obs(observations, segment_path, start_loc_path, end_loc_path,
             day_f.write('%d\t\%s\n' % (ind, obs.segment_day))
 
 def parse_cleaned_segments(filename):
+    return list(iter_cleaned_segments(filename))
+
+'''
+    iter_cleaned_segments
+    Lazily yield a LocationObs for each cleaned section in the timeline.
+    Pass the generator straight to write_obs to stream observations to disk
+    without holding the whole timeline in memory
+    filename can also be a directory written by demux.demultiplex, then only
+    the cleaned sections file is read
+'''
+def iter_cleaned_segments(filename, stats=None):
+    if demux.is_demultiplexed(filename):
+        for item in demux.iter_key_items(filename, ingest.CLEANED_SECTION_KEY):
+            yield get_location_obs_from_csegment(item)
+        return
     with open(filename, 'rb') as rawfile:
-        obs = []
-        for item in ijson.items(rawfile, 'item'):
+        for item in ingest.iter_items_by_key(rawfile, [ingest.CLEANED_SECTION_KEY], stats=stats):
             if is_cleaned_segment(item):
-                obs.append(get_location_obs_from_csegment(item))
-        return obs
+                yield get_location_obs_from_csegment(item)
 
-
-def write_obs(observations, segment_path, start_loc_path, end_loc_path, start_time_path, end_time_path, mode_path, segment_day_path, dataset_path, anchor_dataset_path):
-    with open(segment_path, 'w+') as sf, open(mode_path, 'w+') as mode_f, open(start_loc_path, 'w+') as start_lf, open(end_loc_path,'w+') as end_lf, open(start_time_path, 'w+') as start_tf, open(end_time_path, 'w+') as end_tf, open(segment_day_path, 'w+') as day_f, open(dataset_path, 'w+') as ds_f, open(anchor_dataset_path, 'w+') as ads_f:
+'''
+    write_obs
+    Write each observation to the observation files as it arrives, observations
+    can be any iterable (list or generator). Returns the number of segments written
+    If store_path is given the observations are also written to the columnar store
+    With append, segment ids continue from start and the files are appended to
+'''
+def write_obs(observations, segment_path, start_loc_path, end_loc_path, start_time_path, end_time_path, mode_path, segment_day_path, dataset_path, anchor_dataset_path, store_path=None, start=0, append=False):
+    store_writer = store.ObsStoreWriter(store_path, VOCABULARIES, append) if store_path is not None else None
+    file_mode = 'a' if append else 'w+'
+    with open(segment_path, file_mode) as sf, open(mode_path, file_mode) as mode_f, open(start_loc_path, file_mode) as start_lf, open(end_loc_path, file_mode) as end_lf, open(start_time_path, file_mode) as start_tf, open(end_time_path, file_mode) as end_tf, open(segment_day_path, file_mode) as day_f, open(dataset_path, file_mode) as ds_f, open(anchor_dataset_path, file_mode) as ads_f:
         #ads_f.write('Location\n')
         #ds_f.write('Mode\tDay\tStart Location\tEnd Location\tStart Time\tEnd Time\n')
-        for ind, obs in enumerate(observations):
+        count = 0
+        for ind, obs in enumerate(observations, start):
             sf.write('%d\n' % ind)
+            if store_writer is not None:
+                store_writer.append(ind, obs)
             if obs.mode is not None:
                 mode_f.write('%d\t%s\n' % (ind, obs.mode))
                 #ds_f.write('%s\t' % obs.mode)
@@ -191,6 +311,10 @@ def write_obs(observations, segment_path, start_loc_path, end_loc_path, start_ti
             #ds_f.write('%s\t' % obs.start_time)
             end_tf.write('%d\t%s\n' % (ind, obs.end_time))
             #ds_f.write('%s\n' % obs.end_time)
+            count += 1
+        if store_writer is not None:
+            store_writer.close()
+        return count
 
 
 # obs = parse_segments(data_path)
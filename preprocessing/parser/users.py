@@ -0,0 +1,111 @@
+'''
+    users.py
+    Parse many users' timelines in parallel on a process pool
+    Each user's observations go to their own data directory
+'''
+
+import glob
+import multiprocessing
+import os
+import time
+
+import preprocessing.parser.ingest as ingest
+import preprocessing.parser.parse as ps
+
+SUMMARY_HEADER = 'User\tTimeline\tSegments\tEntries\tSeconds\tEntries/sec\n'
+
+'''
+    expand_timelines
+    Expand a list of timeline paths and glob patterns, keeping order and dropping
+    duplicates, also the same file reached by two paths
+'''
+def expand_timelines(patterns):
+    timelines, seen = [], set()
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for match in matches:
+            if os.path.abspath(match) not in seen:
+                seen.add(os.path.abspath(match))
+                timelines.append(match)
+    return timelines
+
+'''
+    user_name
+    Name of the user a timeline belongs to, the file name without its extension
+'''
+def user_name(timeline):
+    return os.path.splitext(os.path.basename(timeline))[0]
+
+'''
+    check_user_names
+    Raise ValueError when two timelines would write to the same user directory,
+    timelines with the same file name in different directories do
+'''
+def check_user_names(timelines):
+    users = {}
+    for timeline in timelines:
+        users.setdefault(user_name(timeline), []).append(timeline)
+    duplicates = ['%s (%s)' % (user, ', '.join(paths)) for user, paths in sorted(users.items()) if len(paths) > 1]
+    if duplicates:
+        raise ValueError('Timelines share a user name, rename them so each user gets its own directory: %s' % '; '.join(duplicates))
+
+'''
+    user_paths
+    Map each observation path to the same file name inside directory
+'''
+def user_paths(directory, paths):
+    return [os.path.join(directory, os.path.basename(path)) for path in paths]
+
+'''
+    ingest_user
+    Pool worker, parse one timeline and write its observations
+    job is (timeline, directory, observation paths, store path)
+'''
+def ingest_user(job):
+    timeline, directory, obs_paths, store_path = job
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    stats = ingest.IngestStats(ingest.get_backend())
+    start = time.time()
+    user_store = user_paths(directory, [store_path])[0] if store_path is not None else None
+    observations = ps.iter_cleaned_segments(timeline, stats=stats)
+    segments = ps.write_obs(observations, *user_paths(directory, obs_paths), store_path=user_store)
+    return {
+        'user': user_name(timeline),
+        'timeline': timeline,
+        'segments': segments,
+        'entries': stats.entries,
+        'seconds': time.time() - start
+    }
+
+'''
+    ingest_users
+    Parse every timeline on a pool of processes (None uses every core)
+    obs_paths are the nine write_obs paths, each user writes them to data_directory/<user>
+    Writes a combined summary to summary_path and returns the per user summaries
+'''
+def ingest_users(timelines, data_directory, obs_paths, store_path=None, summary_path=None, processes=None):
+    check_user_names(timelines)
+    jobs = [(timeline, os.path.join(data_directory, user_name(timeline)), obs_paths, store_path) for timeline in timelines]
+    start = time.time()
+    pool = multiprocessing.Pool(processes)
+    try:
+        summaries = list(pool.imap_unordered(ingest_user, jobs, 1))
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+    summaries.sort(key=lambda summary: summary['user'])
+    if summary_path is not None:
+        write_summary(summaries, summary_path)
+    total_segments = sum(summary['segments'] for summary in summaries)
+    total_entries = sum(summary['entries'] for summary in summaries)
+    print('Ingested %d users, %d segments from %d entries in %0.2fs (%0.0f entries/sec)' % (len(summaries), total_segments, total_entries, elapsed, total_entries / max(elapsed, 1e-9)))
+    return summaries
+
+def write_summary(summaries, summary_path):
+    with open(summary_path, 'w+') as wf:
+        wf.write(SUMMARY_HEADER)
+        for summary in summaries:
+            rate = summary['entries'] / max(summary['seconds'], 1e-9)
+            wf.write('%s\t%s\t%d\t%d\t%0.2f\t%0.0f\n' % (summary['user'], summary['timeline'], summary['segments'], summary['entries'], summary['seconds'], rate))
@@ -4,20 +4,40 @@
     Ankur Goswami, agoswam3@ucsc.edu
 '''
 
+# Python 2 would otherwise resolve the preprocessing package to this module
+from __future__ import absolute_import
+
 from sklearn.cluster import KMeans
 from sklearn import mixture
 import numpy as n
 import itertools
+import io
 from os import remove
 import numpy as np
 from scipy import linalg
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 import random
+import multiprocessing
+import preprocessing.store as store
+import preprocessing.sharding as sharding
+
+try:
+    from joblib import Parallel, delayed
+except ImportError:
+    # scikit-learn bundled joblib before it became a separate dependency
+    from sklearn.externals.joblib import Parallel, delayed
 
 color_iter = itertools.cycle(['navy', 'c', 'cornflowerblue', 'gold',
                               'darkorange'])
 
+# Stop adding components once this many counts in a row did not lower the BIC
+MIXTURE_PATIENCE = 2
+# Mixtures of larger clusters are fit on a sample of this many locations
+MAX_FIT_LOCATIONS = 10000
+# Mixtures are only fit with at least this many (sampled) locations per component
+MIN_LOCATIONS_PER_COMPONENT = 10
+
 '''
     truncate_locations
     read the start and end locations files, truncate past the first tab
@@ -30,6 +50,24 @@ def truncate_locations(start, end):
         for line in end_file:
             fout.write(line.split('\t', 1)[-1])
 
+'''
+    load_location_file
+    Load the lon/lat of every line of a start or end locations file (segment #, tab, lon lat)
+    into an (n, 2) array, parsed in one go instead of line by line
+'''
+def load_location_file(filename):
+    with io.open(filename, 'rb') as rf:
+        text = rf.read().replace(b'\t', b' ').decode('ascii')
+    return np.fromstring(text, dtype=np.float64, sep=' ').reshape(-1, 3)[:, 1:]
+
+'''
+    load_locations
+    Start locations followed by end locations, the matrix load_data returns for
+    the file truncate_locations writes, without writing it
+'''
+def load_locations(start, end):
+    return np.vstack((load_location_file(start), load_location_file(end)))
+
 '''
     load_data
     Load data from the filename passed in and return that matrix
@@ -40,6 +78,15 @@ def load_data(filename):
         locations = np.loadtxt(file, delimiter=' ')
         return locations
 
+'''
+    load_store
+    Load the start locations followed by the end locations from the columnar observation store,
+    same matrix load_data returns for the truncated locations file
+'''
+def load_store(store_path):
+    columns, meta = store.load(store_path)
+    return store.all_locations(columns)
+
 '''
 Graph function taken from
 http://scikit-learn.org/stable/auto_examples/mixture/plot_gmm.html#sphx-glr-auto-examples-mixture-plot-gmm-py
@@ -73,22 +120,90 @@ def plot_results(X, Y_, means, covariances, index, title):
     plt.xticks(())
     plt.yticks(())
 
+'''
+    fit_mixture
+    Fit a mixture of n gaussians and compute its BIC once, means_init warm starts
+    the fit from an earlier model (None lets sklearn initialize it)
+    Returns (n, model, bic)
+'''
+def fit_mixture(locations, n, means_init=None, seed=0):
+    gmm = mixture.GaussianMixture(n_components=n, means_init=means_init, random_state=seed).fit(locations)
+    return n, gmm, gmm.bic(locations)
+
+'''
+    warm_means
+    Means to start a mixture of n gaussians from, the means of model plus
+    locations drawn k-means++ style (likelier the farther they are from every mean)
+'''
+def warm_means(model, locations, n, seed=0):
+    if model is None or model.n_components >= n:
+        return None
+    rs = np.random.RandomState(seed + n)
+    means = [mean for mean in model.means_]
+    distances = np.full(len(locations), np.inf)
+    for mean in model.means_:
+        distances = np.minimum(distances, ((locations - mean) ** 2).sum(axis=1))
+    while len(means) < n:
+        total = distances.sum()
+        pick = rs.choice(len(locations), p=distances / total) if total > 0 else rs.randint(len(locations))
+        means.append(locations[pick])
+        distances = np.minimum(distances, ((locations - locations[pick]) ** 2).sum(axis=1))
+    return np.array(means)
+
+'''
+    resolve_jobs
+    Number of parallel fits for n_jobs, counting back from the CPU count for 0 and
+    below as joblib does (-1 is every CPU)
+'''
+def resolve_jobs(n_jobs):
+    if n_jobs > 0:
+        return n_jobs
+    cpus = multiprocessing.cpu_count()
+    return max(1, min(cpus, cpus + 1 + n_jobs))
+
+'''
+    select_mixture
+    Fit mixtures of min_gaussians up to (not including) max_gaussians components
+    and return the one with the lowest BIC.
+    Counts are fit n_jobs at a time in parallel, each batch warm started from the
+    best model so far, and the search stops once MIXTURE_PATIENCE counts in a row
+    did not lower the BIC. With subsample the models are fit on at most that
+    many random locations (predict on the full set afterwards), counts leaving
+    fewer than MIN_LOCATIONS_PER_COMPONENT locations per component are not tried
+'''
+def select_mixture(locations, min_gaussians, max_gaussians, n_jobs=1, subsample=None, seed=0):
+    locations = np.asarray(locations, dtype=np.float64)
+    if subsample is not None and len(locations) > subsample:
+        picks = np.random.RandomState(seed).choice(len(locations), subsample, replace=False)
+        locations = locations[picks]
+    n_jobs = resolve_jobs(n_jobs)
+    max_components = max(1, len(locations) // MIN_LOCATIONS_PER_COMPONENT)
+    counts = list(range(min_gaussians, min(max_gaussians, max_components + 1)))
+    if not counts:
+        counts = [min(min_gaussians, max_components)]
+    best, best_bic, worse = None, None, 0
+    for first in range(0, len(counts), n_jobs):
+        batch = counts[first:first + n_jobs]
+        fits = Parallel(n_jobs=min(n_jobs, len(batch)))(delayed(fit_mixture)(locations, n, warm_means(best, locations, n, seed), seed) for n in batch)
+        for n, gmm, bic in fits:
+            if best is None or bic < best_bic:
+                best, best_bic, worse = gmm, bic, 0
+            else:
+                worse += 1
+        if worse >= MIXTURE_PATIENCE:
+            break
+    return best
+
 '''
     run_gaussian_mixture
     Pass in location data, minimum number of gaussians, and maximum number of gaussians
     Find the Gaussian Mixture model for each # gaussians, then pick the model which minimizes the
-    bayesian information criteria
+    bayesian information criteria (see select_mixture)
 
     Finally, create a dictionary where each cluster key maps to the locations in that cluster
-
-    TODO: Make sure min gaussians and max gaussians are valid parameters
 '''
-def run_gaussian_mixture(locations, min_gaussians, max_gaussians):
-    mixtures = []
-    for n in range(min_gaussians, max_gaussians):
-        gmm = mixture.GaussianMixture(n_components=n).fit(locations)
-        mixtures.append(gmm)
-    min_gmm = min(mixtures, key=lambda m: m.bic(locations))
+def run_gaussian_mixture(locations, min_gaussians, max_gaussians, n_jobs=1, subsample=None):
+    min_gmm = select_mixture(locations, min_gaussians, max_gaussians, n_jobs, subsample)
     predictions = min_gmm.predict(locations)
     predictions_list = list(predictions)
     # initialize cluster dict
@@ -104,14 +219,9 @@ def run_gaussian_mixture(locations, min_gaussians, max_gaussians):
 '''
     plot_gaussian_mixture
     same as first part of run, but plot the optimal model
-    TODO: Refactor first part
-'''
-def plot_gaussian_mixture(locations, min_gaussians, max_gaussians):
-    mixtures = []
-    for n in range(min_gaussians, max_gaussians):
-        gmm = mixture.GaussianMixture(n_components=n).fit(locations)
-        mixtures.append(gmm)
-    min_gmm = min(mixtures, key=lambda m: m.bic(locations))
+'''
+def plot_gaussian_mixture(locations, min_gaussians, max_gaussians, n_jobs=1, subsample=None):
+    min_gmm = select_mixture(locations, min_gaussians, max_gaussians, n_jobs, subsample)
     predictions = min_gmm.predict(locations)
     plot_results(locations, predictions, min_gmm.means_, min_gmm.covariances_, 0, 'Results')
     plt.show()
@@ -121,54 +231,52 @@ def plot_gaussian_mixture(locations, min_gaussians, max_gaussians):
     Similar to run_gaussian_mixture, except instead of categorizing locations according to
     the cluster their in, reassign locations to the cluster mean and return that new list
 '''
-def predict_mixture(locations_with_index, min_gaussians, max_gaussians):
-    mixtures = []
-    locations = np.matrix([[lwi[0][0], lwi[0][1]] for lwi in locations_with_index])
-    for n in range(min_gaussians, max_gaussians):
-        gmm = mixture.GaussianMixture(n_components=n).fit(locations)
-        mixtures.append(gmm)
-    min_gmm = min(mixtures, key=lambda m: m.bic(locations))
+def predict_mixture(locations_with_index, min_gaussians, max_gaussians, n_jobs=1, subsample=None):
+    locations = np.array([[lwi[0][0], lwi[0][1]] for lwi in locations_with_index])
+    min_gmm = select_mixture(locations, min_gaussians, max_gaussians, n_jobs, subsample)
     means = min_gmm.means_
     predictions = min_gmm.predict(locations)
     locations = [tuple(mean) for mean in means]
     predictions_list = list(predictions)
     return [(locations[p], locations_with_index[ind][1]) for ind, p in enumerate(predictions_list)]
     
+'''
+    write_location_rows
+    Write segment # and location rows to filename with a single formatting pass
+'''
+def write_location_rows(filename, segments, locations):
+    rows = np.column_stack((np.asarray(segments, dtype=np.float64), np.asarray(locations, dtype=np.float64).reshape(-1, 2)))
+    with open(filename, 'w+') as wf:
+        if len(rows):
+            wf.write(('%d\t%f %f\n' * len(rows)) % tuple(rows.ravel().tolist()))
+
 '''
     write_locations
     Given a list of locations associated with a cluster (So not the entire list) and the length of the entire list
     (Where the first half of the entire list is the start locations and the second half the end locations),
     map and write each corresponding start and end locations
+    A segment is written once both its start and end are in the list, in the order the later one appears
 '''
 def write_locations(locations_list, total_length, start_file, end_file):
-    with open(start_file, 'w') as sf, open(end_file, 'w') as ef:
-        table = dict()
-        for location in locations_list:
-            key = location[1] - total_length/2
-            if location[1] < total_length/2:
-                key = location[1] + total_length/2
-            if location[1] in table:
-                continue
-            if key in table:
-                corresponding_location = table[key]
-                segment = key if key < total_length/2 else location[1]
-                start, end = None, None
-                if key == segment:
-                    start = location[0]
-                    end = corresponding_location
-                else:
-                    start = corresponding_location
-                    end = location[0]
-                sf.write('%d\t%f %f\n' % (segment, start[0], start[1]))
-                ef.write('%d\t%f %f\n' % (segment, end[0], end[1]))
-            table[location[1]] = location[0]
+    half = total_length // 2
+    indices = np.array([location[1] for location in locations_list], dtype=np.int64)
+    locations = np.array([location[0] for location in locations_list], dtype=np.float64).reshape(-1, 2)
+    # Later repeats of an index are ignored
+    indices, first = np.unique(indices, return_index=True)
+    locations = locations[first]
+    segments = indices % half if half else indices
+    starts = indices < half
+    paired = np.intersect1d(segments[starts], segments[~starts])
+    start_rows = np.flatnonzero(starts)[np.searchsorted(segments[starts], paired)]
+    end_rows = np.flatnonzero(~starts)[np.searchsorted(segments[~starts], paired)]
+    order = np.argsort(np.maximum(first[start_rows], first[end_rows]), kind='mergesort')
+    write_location_rows(start_file, paired[order], locations[start_rows[order]])
+    write_location_rows(end_file, paired[order], locations[end_rows[order]])
 
 def write_all_locations(start_locations, end_locations, start_file, end_file):
-    with open(start_file, 'w+') as sf, open(end_file, 'w+') as ef:
-        for ind, start in enumerate(start_locations):
-            end = end_locations[ind]
-            sf.write('%d\t%f %f\n' % (ind, start[0], start[1]))
-            ef.write('%d\t%f %f\n' % (ind, end[0], end[1]))
+    segments = np.arange(len(start_locations))
+    write_location_rows(start_file, segments, start_locations)
+    write_location_rows(end_file, segments, end_locations)
 
 '''
     Cleanup any intermediate files
@@ -187,66 +295,51 @@ def sample_n_values(n, array):
     second_half = [val for ind, val in enumerate(array) if ind >= len(array)/2]
     return half[:n/2] + second_half[:n/2]
 
+'''
+    partition_data
+    Count how often every (start, end) pair occurs, compared the way '%f' prints them, and
+    write the pairs that occur at least minimum_occurences times to write_file, in the order
+    each pair first occurs, with their partition. Partitions are at most num_partitions
+    shards of the location graph cutting few trips, see sharding.py
+'''
 def partition_data(locations, num_partitions, minimum_occurences, write_file):
-    counter = dict()
-    locations_per_partition = len(locations) / num_partitions
-    start_locations = locations[:len(locations)/2]
-    end_locations = locations[len(locations)/2:]
-    print len(start_locations)
-    print len(end_locations)
-    for i in range(0, len(start_locations)):
-        segment_string = '%f %f %f %f' % (start_locations[i][0], start_locations[i][1], end_locations[i][0], end_locations[i][1])
-        if segment_string in counter:
-            counter[segment_string] += 1
-        else:
-            counter[segment_string] = 1
+    locations = np.asarray(locations, dtype=np.float64)
+    start_locations = locations[:len(locations)//2]
+    end_locations = locations[len(locations)//2:]
+    # '%f' keeps 6 decimals, rounding first makes pairs that print the same count together
+    pairs = np.ascontiguousarray(np.round(np.hstack((start_locations, end_locations)), 6) + 0.0)
+    rows = pairs.view(np.dtype((np.void, pairs.dtype.itemsize * 4))).ravel()
+    unique_rows, first, counts = np.unique(rows, return_index=True, return_counts=True)
     # Given our segments, only partition trips which occur more than minimum_occurences
-    start_tuples = []
-    end_tuples = []
-    for location in counter:
-        if counter[location] < minimum_occurences:
-            continue
-        reparsed = location.split(' ')
-        reparsed_floats = [float(i) for i in reparsed]
-        start = (reparsed_floats[0], reparsed_floats[1])
-        end = (reparsed_floats[2], reparsed_floats[3])
-        print start, end
-        start_tuples.append(start)
-        end_tuples.append(end)
-    count = 0
-    part_num = 0
-    i = 0
+    kept = first[counts >= minimum_occurences]
+    kept_counts = counts[counts >= minimum_occurences]
+    kept_order = np.argsort(kept)
+    kept, kept_counts = kept[kept_order], kept_counts[kept_order]
+    part_nums, cut = sharding.shard_trips(pairs[kept, :2], pairs[kept, 2:], num_partitions, kept_counts)
+    rows = np.column_stack((part_nums, pairs[kept]))
     with open(write_file, 'w+') as wf:
-        for ind, start in enumerate(start_tuples):
-            end = end_tuples[ind]
-            wf.write('%d\t%f %f\t%f %f\n' % (part_num, start[0], start[1], end[0], end[1]))
-            count += 1
-            if count == locations_per_partition:
-                part_num += 1
-                count = 0
+        if len(rows):
+            wf.write(('%d\t%f %f\t%f %f\n' * len(rows)) % tuple(rows.ravel().tolist()))
     # I'm return start_locations and end_locations for now
     return start_locations, end_locations
 
 
 def run(start_file, end_file, clusters_file):
-    truncate_locations(start_file, end_file)
-    locations = load_data('truncated_locations.txt')
+    locations = load_locations(start_file, end_file)
     start_end_locs = partition_data(locations, 10, 2, clusters_file)
     write_all_locations(start_end_locs[0], start_end_locs[1], start_file, end_file)
     # new_locations = run_gaussian_mixture(locations, 2, 3)
     # max_cluster = max(new_locations.itervalues(), key=lambda v: len(v))
     # max_cluster = sample_n_values(int(0.8 * len(max_cluster)), max_cluster)
     # write_locations(max_cluster, len(locations), start_file, end_file)
-    cleanup(['truncated_locations.txt'])
 
-def run_with_assignment(start_file, end_file, noise_est=0.8):
-    truncate_locations(start_file, end_file)
-    locations = load_data('truncated_locations.txt')
-    new_locations = run_gaussian_mixture(locations, 2, 5)
+def run_with_assignment(start_file, end_file, noise_est=0.8, n_jobs=1):
+    locations = load_locations(start_file, end_file)
+    new_locations = run_gaussian_mixture(locations, 2, 5, n_jobs, MAX_FIT_LOCATIONS)
     max_cluster = max(new_locations.itervalues(), key=lambda v: len(v))
+    # select_mixture fits fewer, at most one component per MIN_LOCATIONS_PER_COMPONENT sampled locations
     gaussians = int(noise_est * len(max_cluster))
-    max_cluster = predict_mixture(max_cluster, gaussians, gaussians+1)
+    max_cluster = predict_mixture(max_cluster, gaussians, gaussians+1, n_jobs, MAX_FIT_LOCATIONS)
     write_locations(max_cluster, len(locations), start_file, end_file)
-    cleanup(['truncated_locations.txt'])
 
 
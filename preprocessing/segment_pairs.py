@@ -0,0 +1,77 @@
+'''
+    segment_pairs.py
+    Same day segment pairs for the second FrequentTrip rule of InferFrequentTrips
+    The rule joins every two segments of a day and only then filters them with
+    Before and SimilarTimes. This groups the segments by day and writes just the
+    ordered, time compatible (S1, S2) pairs as the observed SameDayPair predicate,
+    so grounding the rule is bounded by the pairs that can actually fire, along
+    with how many pairs every day has
+'''
+
+# Python 2 would otherwise resolve the preprocessing package to preprocessing.py
+from __future__ import absolute_import
+
+import argparse
+import os
+
+import preprocessing.observations as observations
+
+# Observed SameDayPair atoms, see InferFrequentTrips.loadData
+PAIRS_FILE = 'same_day_pairs_obs.txt'
+
+# Day, tab, segments that day, tab, pairs that day
+COUNTS_FILE = 'same_day_pair_counts.txt'
+
+'''
+    day_pairs
+    Ordered (S1, S2) pairs of segments of one day where S1 starts no later than
+    S2 ends and their times are similar. S1 may be S2, as in the rule, pairs
+    starting and ending at the same location are left out since ~EqualLocations
+    keeps them from grounding anything
+'''
+def day_pairs(obs, segments):
+    starts = [(segment, obs.get('start_location', segment), obs.get('start_time', segment)) for segment in segments]
+    ends = [(segment, obs.get('end_location', segment), obs.get('end_time', segment)) for segment in segments]
+    starts = [start for start in starts if start[1] is not None and start[2] is not None]
+    ends = [end for end in ends if end[1] is not None and end[2] is not None]
+    for first, start, start_time in starts:
+        for second, end, end_time in ends:
+            if start != end and observations.before(start_time, end_time) and observations.similar_times(start_time, end_time):
+                yield first, second
+
+'''
+    same_day_pairs
+    (day, S1, S2) for every pair of day_pairs, days in sorted order
+'''
+def same_day_pairs(obs):
+    by_day = obs.by_value('day')
+    for day in sorted(by_day):
+        for first, second in day_pairs(obs, by_day[day]):
+            yield day, first, second
+
+'''
+    run
+    Write the same day pairs of data_directory's observations and the pair counts of every day there
+    Returns the number of pairs
+'''
+def run(data_directory):
+    obs = observations.load(data_directory)
+    by_day = obs.by_value('day')
+    total = 0
+    with open(os.path.join(data_directory, PAIRS_FILE), 'w+') as pairs_file, \
+            open(os.path.join(data_directory, COUNTS_FILE), 'w+') as counts_file:
+        for day in sorted(by_day):
+            count = 0
+            for first, second in day_pairs(obs, by_day[day]):
+                pairs_file.write('%d\t%d\n' % (first, second))
+                count += 1
+            counts_file.write('%s\t%d\t%d\n' % (day, len(by_day[day]), count))
+            total += count
+    print('%d same day pairs over %d days, %d segments' % (total, len(by_day), len(obs)))
+    return total
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write the time compatible same day segment pairs')
+    parser.add_argument('data_directory', help='Directory with the observation files, the pairs are written there')
+    args = parser.parse_args()
+    run(args.data_directory)
@@ -0,0 +1,348 @@
+'''
+    sharding.py
+    Locality aware sharding of trips for independent PSL inference runs
+    Trips are weighted edges between their start and end locations. The part of
+    the locations with the most trips is split in two until there are enough
+    shards, at the split crossing the fewest trips relative to how even it leaves
+    the halves (the ratio cut, trips cut / (trips of one half x trips of the
+    other)), leaving both at least SMALLEST_SHARD of an even shard and cutting at
+    most MOST_CUT of the part's trips. Parts no split is good enough for stay
+    whole, so there can be fewer shards than asked for. Parts with
+    several components split between components, crossing no trip, connected
+    parts along their Fiedler vector. A trip belongs to the shard of its start and
+    the trips whose end lands in another shard are reported as cut edges. One
+    user's trips mostly run between home and work, which are never worth
+    separating, so the shards are only as even as cutting few trips allows
+'''
+
+# Python 2 would otherwise resolve the preprocessing package to preprocessing.py
+from __future__ import absolute_import
+
+import argparse
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+from scipy.sparse import coo_matrix, csgraph
+from scipy.sparse.linalg import eigsh
+
+import preprocessing.store as store
+
+# Observation files with the segment # in the first column
+SEGMENT_FILES = ['segment_obs.txt', 'start_location_obs.txt', 'end_location_obs.txt', 'start_time_obs.txt',
+'end_time_obs.txt', 'mode_obs.txt', 'segment_days_obs.txt']
+# Files keyed by locations, a line goes to every shard that has all of its locations
+LOCATION_FILES = ['anchor_truth.txt', 'trip_truth.txt', 'times_truth.txt', 'mode_truth.txt']
+# Written by the inference steps after preprocessing, split into the shards as they are written
+GROUNDED_FILES = ['grounded_anchors.txt', 'grounded_frequents.txt', 'grounded_frequent_times.txt', 'grounded_frequent_modes.txt']
+
+REPORT_FILE = 'shards.json'
+SHARD_DIRECTORY = re.compile(r'^shard_\d+$')
+
+# Bits per coordinate of the Z-order codes
+MORTON_BITS = 16
+# Fraction of an even shard's trips a split has to leave on both sides, smaller
+# splits would only peel single rarely visited locations off a home and work hub
+SMALLEST_SHARD = 0.25
+# Fraction of a part's trips a split may cut, halving it at random cuts half
+MOST_CUT = 0.5
+# Connected parts up to this many locations get their Fiedler vector from a dense solver
+DENSE_LOCATIONS = 2000
+
+def shard_name(shard):
+    return 'shard_%02d' % shard
+
+def spread_bits(values):
+    # Put a zero bit between every bit of a 16 bit value
+    values = values.astype(np.uint64)
+    values = (values | (values << np.uint64(8))) & np.uint64(0x00FF00FF)
+    values = (values | (values << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+    values = (values | (values << np.uint64(2))) & np.uint64(0x33333333)
+    values = (values | (values << np.uint64(1))) & np.uint64(0x55555555)
+    return values
+
+'''
+    morton_codes
+    Z-order code of every (lon, lat) row of points inside their bounding box,
+    nearby points mostly get nearby codes
+'''
+def morton_codes(points, bits=MORTON_BITS):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    low = points.min(axis=0)
+    span = np.maximum(points.max(axis=0) - low, 1e-12)
+    cells = np.floor((points - low) / span * ((1 << bits) - 1)).astype(np.uint64)
+    return spread_bits(cells[:, 0]) | (spread_bits(cells[:, 1]) << np.uint64(1))
+
+'''
+    fiedler_order
+    Order of the locations of a connected graph along the eigenvector of the second
+    smallest eigenvalue of its Laplacian, locations linked by many trips end up close
+'''
+def fiedler_order(graph, codes):
+    laplacian = csgraph.laplacian(graph.astype(np.float64))
+    if graph.shape[0] <= DENSE_LOCATIONS:
+        values, vectors = np.linalg.eigh(laplacian.toarray())
+    else:
+        # Shift and invert around a point just below 0 finds the smallest eigenvalues quickly
+        values, vectors = eigsh(laplacian.tocsc(), k=2, sigma=-1e-3, which='LM')
+    fiedler = vectors[:, np.argsort(values)[1]]
+    return np.lexsort((codes, np.round(fiedler, 12)))
+
+'''
+    best_split
+    Best ratio cut of the locations of a part among the prefixes of an order of
+    them, graph holds the trips between them and weights their trips
+    Returns (ratio cut, evenness, locations of the first half), None when no split
+    leaves at least smallest trips on both sides and cuts at most MOST_CUT of them
+'''
+def best_split(graph, weights, codes, smallest):
+    num_components, components = csgraph.connected_components(graph, directed=False)
+    if num_components > 1:
+        # Whole components along the curve through their centroids, a split between them cuts nothing
+        centroid_codes = np.bincount(components, weights=codes.astype(np.float64), minlength=num_components)
+        centroid_codes /= np.bincount(components, minlength=num_components)
+        order = np.lexsort((codes, components, centroid_codes[components]))
+    else:
+        order = fiedler_order(graph, codes)
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order))
+    edges = coo_matrix(graph)
+    first = np.minimum(ranks[edges.row], ranks[edges.col])
+    last = np.maximum(ranks[edges.row], ranks[edges.col])
+    # A trip is cut by every prefix that holds one of its ends, the graph has both directions
+    changes = np.bincount(first, weights=edges.data, minlength=len(order) + 1) - np.bincount(last, weights=edges.data, minlength=len(order) + 1)
+    cut = np.cumsum(changes)[:-2] / 2.0
+    left = np.cumsum(weights[order])[:-1]
+    right = weights.sum() - left
+    evenness = left * right
+    valid = np.flatnonzero((np.minimum(left, right) >= smallest) & (left > 0) & (right > 0) & (cut <= MOST_CUT * weights.sum()))
+    if len(valid) == 0:
+        return None
+    ratios = cut[valid] / evenness[valid]
+    best = valid[np.lexsort((-evenness[valid], ratios))[0]]
+    return cut[best] / evenness[best], evenness[best], order[:best + 1]
+
+'''
+    shard_locations
+    Shard trips between numbered locations, start_ids and end_ids are the
+    locations of every trip and points their (lon, lat) rows. Each trip is
+    weighed by weights (1 by default) and belongs to the shard of its start
+    Returns (shard of each trip, whether each trip is a cut edge, shard of each location)
+'''
+def shard_locations(start_ids, end_ids, points, num_shards, weights=None):
+    start_ids = np.asarray(start_ids, dtype=np.int64)
+    end_ids = np.asarray(end_ids, dtype=np.int64)
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if weights is None:
+        weights = np.ones(len(start_ids))
+    weights = np.asarray(weights, dtype=np.float64)
+    num_locations = len(points)
+    codes = morton_codes(points)
+    location_weights = np.bincount(start_ids, weights=weights, minlength=num_locations)
+    moves = start_ids != end_ids
+    rows = np.concatenate((start_ids[moves], end_ids[moves]))
+    cols = np.concatenate((end_ids[moves], start_ids[moves]))
+    graph = coo_matrix((np.concatenate((weights[moves], weights[moves])), (rows, cols)), shape=(num_locations, num_locations)).tocsr()
+    smallest = SMALLEST_SHARD * location_weights.sum() / num_shards
+    parts = [np.arange(num_locations)]
+    splits = {}
+    while len(parts) < num_shards:
+        for ind, part in enumerate(parts):
+            if ind not in splits:
+                splits[ind] = best_split(graph[part][:, part], location_weights[part], codes[part], smallest) if len(part) > 1 else None
+        candidates = [(-location_weights[parts[ind]].sum(), ind) for ind, split in splits.items() if split is not None]
+        if not candidates:
+            break
+        weight, ind = min(candidates)
+        part, chosen = parts[ind], splits[ind][2]
+        inside = np.zeros(len(part), dtype=bool)
+        inside[chosen] = True
+        parts[ind] = part[inside]
+        parts.append(part[~inside])
+        del splits[ind]
+    # Shards are numbered along the curve through the parts
+    parts.sort(key=lambda part: codes[part].min())
+    location_shards = np.zeros(num_locations, dtype=np.int64)
+    for shard, part in enumerate(parts):
+        location_shards[part] = shard
+    trip_shards = location_shards[start_ids]
+    return trip_shards, trip_shards != location_shards[end_ids], location_shards
+
+def number_rows(points):
+    # Number the distinct (lon, lat) rows, returns (ids, distinct rows)
+    points = np.ascontiguousarray(np.asarray(points, dtype=np.float64).reshape(-1, 2) + 0.0)
+    rows = points.view(np.dtype((np.void, points.dtype.itemsize * 2))).ravel()
+    unique_rows, first, ids = np.unique(rows, return_index=True, return_inverse=True)
+    return ids, points[first]
+
+'''
+    shard_trips
+    shard_locations for trips given as (n, 2) arrays of start and end locations
+    Returns (shard of each trip, whether each trip is a cut edge)
+'''
+def shard_trips(start, end, num_shards, weights=None):
+    ids, points = number_rows(np.vstack((np.asarray(start).reshape(-1, 2), np.asarray(end).reshape(-1, 2))))
+    trip_shards, cut, location_shards = shard_locations(ids[:len(ids) // 2], ids[len(ids) // 2:], points, num_shards, weights)
+    return trip_shards, cut
+
+'''
+    shard_store
+    Shard the segments of the columnar observation store, locations are
+    compared as the observation files print them
+    Returns (segment numbers, shards of their starts, shards of their ends, start strings, end strings)
+'''
+def shard_store(store_path, num_shards):
+    columns, meta = store.load(store_path)
+    start_strings = store.location_strings(columns, meta, 'start')
+    end_strings = store.location_strings(columns, meta, 'end')
+    strings, first, ids = np.unique(np.array(start_strings + end_strings), return_index=True, return_inverse=True)
+    points = store.all_clustered_locations(columns, meta)[first]
+    count = meta['count']
+    trip_shards, cut, location_shards = shard_locations(ids[:count], ids[count:], points, num_shards)
+    return columns['segment'].tolist(), trip_shards, location_shards[ids[count:]], start_strings, end_strings
+
+def is_location(field):
+    values = field.split(' ')
+    if len(values) != 2:
+        return False
+    try:
+        float(values[0])
+        float(values[1])
+    except ValueError:
+        return False
+    return True
+
+'''
+    write_location_lines
+    Copy the lines of path whose locations all belong to a shard to that shard,
+    targets are (path to write, locations of the shard)
+'''
+def write_location_lines(path, targets):
+    handles = [open(target_path, 'w+') for target_path, locations in targets]
+    try:
+        with open(path, 'r') as rf:
+            for line in rf:
+                locations = [field for field in line.rstrip('\n').split('\t') if is_location(field)]
+                for handle, (target_path, shard_locations) in zip(handles, targets):
+                    if all(location in shard_locations for location in locations):
+                        handle.write(line)
+    finally:
+        for handle in handles:
+            handle.close()
+
+def shard_directories(shards_directory):
+    with open(os.path.join(shards_directory, REPORT_FILE), 'r') as rf:
+        return [os.path.join(shards_directory, directory) for directory in json.load(rf)['directories']]
+
+'''
+    read_shard_locations
+    Locations of the segments of a shard directory, as its location files print them
+'''
+def read_shard_locations(directory):
+    locations = set()
+    for name in ['start_location_obs.txt', 'end_location_obs.txt']:
+        with open(os.path.join(directory, name), 'r') as rf:
+            for line in rf:
+                locations.add(line.rstrip('\n').split('\t')[1])
+    return locations
+
+'''
+    split_location_files
+    Split the files names of data_directory into the shards written by write_shards,
+    the inference steps call this for the grounded files as they write them. A
+    shard's copy is removed when data_directory has no such file
+'''
+def split_location_files(data_directory, shards_directory, names):
+    directories = shard_directories(shards_directory)
+    shard_locations = [read_shard_locations(directory) for directory in directories]
+    for name in names:
+        path = os.path.join(data_directory, name)
+        targets = [(os.path.join(directory, name), locations) for directory, locations in zip(directories, shard_locations)]
+        if os.path.exists(path):
+            write_location_lines(path, targets)
+            continue
+        for target_path, locations in targets:
+            if os.path.exists(target_path):
+                os.remove(target_path)
+
+'''
+    write_shards
+    Write one observation directory per shard under shards_directory, with the
+    lines of the segment files in data_directory for its segments and the lines
+    of the location files whose locations all occur in its segments, plus a
+    report of the shard sizes and the cut edges (segment, start shard, end shard)
+    The shard directories of an earlier run are removed first, along with the
+    grounded files split into them
+    Returns the report
+'''
+def write_shards(data_directory, shards_directory, segments, shards, end_shards, start_strings, end_strings, num_shards):
+    segment_shards = dict(zip(segments, shards.tolist()))
+    shard_locations = [set() for shard in range(num_shards)]
+    for shard, start, end in zip(shards.tolist(), start_strings, end_strings):
+        shard_locations[shard].add(start)
+        shard_locations[shard].add(end)
+    if os.path.isdir(shards_directory):
+        for name in os.listdir(shards_directory):
+            if SHARD_DIRECTORY.match(name):
+                shutil.rmtree(os.path.join(shards_directory, name))
+    directories = [os.path.join(shards_directory, shard_name(shard)) for shard in range(num_shards)]
+    for directory in directories:
+        os.makedirs(directory)
+    for name in SEGMENT_FILES:
+        path = os.path.join(data_directory, name)
+        if not os.path.exists(path):
+            continue
+        handles = [open(os.path.join(directory, name), 'w+') for directory in directories]
+        try:
+            with open(path, 'r') as rf:
+                for line in rf:
+                    shard = segment_shards.get(int(line.split('\t', 1)[0]))
+                    if shard is not None:
+                        handles[shard].write(line)
+        finally:
+            for handle in handles:
+                handle.close()
+    for name in LOCATION_FILES:
+        path = os.path.join(data_directory, name)
+        if os.path.exists(path):
+            write_location_lines(path, [(os.path.join(directory, name), locations) for directory, locations in zip(directories, shard_locations)])
+    cut_edges = [[segment, start, end] for segment, start, end in zip(segments, shards.tolist(), end_shards.tolist()) if start != end]
+    report = {
+        'num_shards': num_shards,
+        'directories': [shard_name(shard) for shard in range(num_shards)],
+        'segments': np.bincount(shards, minlength=num_shards).tolist(),
+        'locations': [len(locations) for locations in shard_locations],
+        'cut_fraction': len(cut_edges) / float(max(len(segments), 1)),
+        'cut_edges': cut_edges
+    }
+    with open(os.path.join(shards_directory, REPORT_FILE), 'w+') as wf:
+        json.dump(report, wf, indent=2)
+    return report
+
+'''
+    run
+    Shard the observations of data_directory (store at store_path) into at most
+    num_shards shards under shards_directory
+'''
+def run(data_directory, store_path, shards_directory, num_shards):
+    segments, shards, end_shards, start_strings, end_strings = shard_store(store_path, num_shards)
+    # Parts no split was good enough for stay whole, shards are only written for the parts
+    written = int(shards.max()) + 1 if len(shards) else 1
+    report = write_shards(data_directory, shards_directory, segments, shards, end_shards, start_strings, end_strings, written)
+    print('Sharded %d segments into %d of %d shards, of %s segments, %d cut edges (%0.1f%%)' % (len(segments), written, num_shards,
+        '/'.join(str(size) for size in report['segments']), len(report['cut_edges']), 100 * report['cut_fraction']))
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Split observations into spatially coherent shards for independent inference runs')
+    parser.add_argument('data_directory', help='Directory with the observation files')
+    parser.add_argument('shards_directory', help='Directory the shard directories are written to')
+    parser.add_argument('-n', '--shards', type=int, default=4, help='Number of shards')
+    parser.add_argument('-s', '--store', default=None, help='Columnar observation store (default: data_directory/obs_store)')
+    args = parser.parse_args()
+    report = run(args.data_directory, args.store or os.path.join(args.data_directory, 'obs_store'), args.shards_directory, args.shards)
+    split_location_files(args.data_directory, args.shards_directory, GROUNDED_FILES)
@@ -0,0 +1,349 @@
+'''
+    store.py
+    Columnar binary store of the parsed observations
+    Written once alongside the PSL observation files, every column is a .npy file
+    that later stages memory map instead of re-parsing the tab separated text
+    The parsed locations are never overwritten, clustering writes the center of the
+    clustered rows to their own columns
+'''
+
+import array
+import io
+import json
+import os
+
+import numpy as np
+
+# Initial vocabularies, values not listed here are appended when first seen
+MODES = ['automotive', 'cycling', 'walking', 'running']
+TIMES = ['Morning', 'Afternoon', 'Evening', 'Night']
+
+LOCATION_COLUMNS = ['start_lon', 'start_lat', 'end_lon', 'end_lat']
+CODE_COLUMNS = ['mode', 'start_time', 'end_time', 'day']
+COLUMNS = ['segment'] + LOCATION_COLUMNS + CODE_COLUMNS
+
+# Cluster centers of the first clustered_rows rows, written by apply_clusters
+CENTER_COLUMNS = ['start_center_lon', 'start_center_lat', 'end_center_lon', 'end_center_lat']
+
+# Rows the writer buffers before appending them to the column files
+FLUSH_ROWS = 1 << 16
+
+# Array typecodes the writer buffers each column with
+TYPECODES = {
+    'segment': 'l',
+    'start_lon': 'd',
+    'start_lat': 'd',
+    'end_lon': 'd',
+    'end_lat': 'd',
+    'mode': 'b',
+    'start_time': 'b',
+    'end_time': 'b',
+    'day': 'i'
+}
+
+DTYPES = {
+    'segment': np.int64,
+    'start_lon': np.float64,
+    'start_lat': np.float64,
+    'end_lon': np.float64,
+    'end_lat': np.float64,
+    'mode': np.int8,
+    'start_time': np.int8,
+    'end_time': np.int8,
+    'day': np.int32
+}
+
+# Vocabulary each categorical column is coded against
+VOCABULARIES = {
+    'mode': 'modes',
+    'start_time': 'times',
+    'end_time': 'times',
+    'day': 'days'
+}
+
+# Locations are stored exactly as write_obs prints them
+RAW_LOCATION_FORMAT = '%0.4f %0.4f'
+# ClusterGPS prints cluster centers with %f
+CLUSTERED_LOCATION_FORMAT = '%f %f'
+
+META_FILE = 'meta.json'
+
+class Vocabulary(object):
+
+    def __init__(self, values=None):
+        self.values = list(values) if values is not None else []
+        self.codes = dict((value, code) for code, value in enumerate(self.values))
+
+    '''
+        code
+        Return the integer code of value, None is coded as -1
+    '''
+    def code(self, value):
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def value(self, code):
+        if code < 0:
+            return None
+        return self.values[code]
+
+def column_path(store_path, name):
+    return os.path.join(store_path, name + '.npy')
+
+'''
+    ObsStoreWriter
+    Buffers observations column by column in typed arrays, appends every
+    FLUSH_ROWS rows to the .npy files and writes the vocabularies on close
+    The observations carry codes of the shared vocabularies (name to Vocabulary,
+    see parse.py), each shared code is mapped to the store's code once
+    With append the new rows are added to the end of an existing store
+'''
+class ObsStoreWriter(object):
+
+    def __init__(self, store_path, shared, append=False):
+        self.store_path = store_path
+        self.append_rows = append and exists(store_path)
+        self.columns = dict((name, array.array(TYPECODES[name])) for name in COLUMNS)
+        self.written = 0
+        if self.append_rows:
+            meta = load_meta(store_path)
+            self.count = meta['count']
+            self.clustered_rows = clustered_rows(meta)
+            self.vocabularies = dict((name, Vocabulary(meta[name])) for name in ['modes', 'times', 'days'])
+        else:
+            self.count = 0
+            self.clustered_rows = 0
+            self.vocabularies = {
+                'modes': Vocabulary(MODES),
+                'times': Vocabulary(TIMES),
+                'days': Vocabulary()
+            }
+        self.shared = shared
+        self.recodes = dict((name, []) for name in self.vocabularies)
+
+    '''
+        recode
+        Store code of the shared vocabulary's code for name, -1 stays missing
+    '''
+    def recode(self, name, code):
+        if code < 0:
+            return -1
+        recodes = self.recodes[name]
+        if len(recodes) <= code:
+            recodes.extend([None] * (code + 1 - len(recodes)))
+        if recodes[code] is None:
+            recodes[code] = self.vocabularies[name].code(self.shared[name].value(code))
+        return recodes[code]
+
+    def append(self, ind, obs):
+        columns = self.columns
+        columns['segment'].append(ind)
+        columns['start_lon'].append(float('%0.4f' % obs.start_lon))
+        columns['start_lat'].append(float('%0.4f' % obs.start_lat))
+        columns['end_lon'].append(float('%0.4f' % obs.end_lon))
+        columns['end_lat'].append(float('%0.4f' % obs.end_lat))
+        columns['mode'].append(self.recode('modes', obs.mode_code))
+        columns['start_time'].append(self.recode('times', obs.start_time_code))
+        columns['end_time'].append(self.recode('times', obs.end_time_code))
+        columns['day'].append(self.recode('days', obs.day_code))
+        if len(columns['segment']) >= FLUSH_ROWS:
+            self.flush()
+
+    '''
+        flush
+        Append the buffered rows to the column files, the first flush of a new
+        store writes the files
+    '''
+    def flush(self):
+        create = not self.append_rows and self.written == 0
+        if create and not os.path.isdir(self.store_path):
+            os.makedirs(self.store_path)
+        for name in COLUMNS:
+            if len(self.columns[name]) == 0:
+                values = np.zeros(0, dtype=DTYPES[name])
+            else:
+                values = np.frombuffer(self.columns[name], dtype=self.columns[name].typecode).astype(DTYPES[name])
+            if create:
+                np.save(column_path(self.store_path, name), values)
+            else:
+                append_column(column_path(self.store_path, name), values)
+            self.columns[name] = array.array(TYPECODES[name])
+        if create:
+            # Centers of an earlier clustering belong to rows that were just rewritten
+            for name in CENTER_COLUMNS:
+                if os.path.exists(column_path(self.store_path, name)):
+                    os.remove(column_path(self.store_path, name))
+        self.written += len(values)
+
+    def close(self):
+        if len(self.columns['segment']) or (not self.append_rows and self.written == 0):
+            self.flush()
+        meta = dict((name, vocabulary.values) for name, vocabulary in self.vocabularies.items())
+        meta['count'] = self.count + self.written
+        # Appended rows are raw locations until the store is clustered again
+        meta['location_format'] = RAW_LOCATION_FORMAT
+        meta['clustered_rows'] = self.clustered_rows
+        write_meta(self.store_path, meta)
+
+'''
+    append_column
+    Append values to a 1-d .npy file in place, only the header is rewritten
+    unless the new shape no longer fits in the old header's padding
+'''
+def append_column(path, values):
+    with open(path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            header = io.BytesIO()
+            np.lib.format.write_array_header_1_0(header, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': fortran_order, 'shape': (shape[0] + len(values),)})
+            # The header is written with its magic string, it has to end where the data starts
+            if len(header.getvalue()) == f.tell():
+                f.seek(0)
+                f.write(header.getvalue())
+                f.seek(0, io.SEEK_END)
+                f.write(values.astype(dtype).tobytes())
+                return
+    np.save(path, np.concatenate((np.load(path), values)))
+
+def write_meta(store_path, meta):
+    with open(os.path.join(store_path, META_FILE), 'w+') as wf:
+        json.dump(meta, wf)
+
+def load_meta(store_path):
+    with open(os.path.join(store_path, META_FILE), 'r') as rf:
+        return json.load(rf)
+
+'''
+    load
+    Load the store, by default every column is memory mapped read only
+    Stores clustered before the center columns existed hold the centers in the
+    location columns, those are returned as the center columns too
+    returns (columns dict, meta dict)
+'''
+def load(store_path, mmap_mode='r'):
+    columns = dict((name, np.load(column_path(store_path, name), mmap_mode=mmap_mode)) for name in COLUMNS)
+    for name, location_name in zip(CENTER_COLUMNS, LOCATION_COLUMNS):
+        path = column_path(store_path, name)
+        columns[name] = np.load(path, mmap_mode=mmap_mode) if os.path.exists(path) else columns[location_name]
+    return columns, load_meta(store_path)
+
+def exists(store_path):
+    return os.path.exists(os.path.join(store_path, META_FILE))
+
+'''
+    locations
+    Return an (n, 2) lon/lat array of the parsed locations for prefix 'start' or 'end'
+'''
+def locations(columns, prefix):
+    return np.column_stack((columns[prefix + '_lon'], columns[prefix + '_lat']))
+
+'''
+    all_locations
+    Start locations followed by end locations, the same ordering
+    preprocessing.truncate_locations produces
+'''
+def all_locations(columns):
+    return np.vstack((locations(columns, 'start'), locations(columns, 'end')))
+
+'''
+    clustered_locations
+    locations as the observation files hold them, cluster centers for the clustered
+    rows and parsed locations for the rows appended after them
+'''
+def clustered_locations(columns, meta, prefix):
+    split = clustered_rows(meta)
+    centers = np.column_stack((columns[prefix + '_center_lon'][:split], columns[prefix + '_center_lat'][:split]))
+    return np.vstack((centers, locations(columns, prefix)[split:]))
+
+def all_clustered_locations(columns, meta):
+    return np.vstack((clustered_locations(columns, meta, 'start'), clustered_locations(columns, meta, 'end')))
+
+'''
+    decode
+    Turn a column of codes back into its strings, None where missing
+'''
+def decode(columns, meta, name):
+    values = meta[VOCABULARIES[name]]
+    return [values[code] if code >= 0 else None for code in columns[name].tolist()]
+
+'''
+    clustered_rows
+    Number of leading rows whose locations are cluster centers
+'''
+def clustered_rows(meta):
+    return meta.get('clustered_rows', meta['count'] if meta['location_format'] == CLUSTERED_LOCATION_FORMAT else 0)
+
+'''
+    has_parsed_locations
+    Whether the location columns still hold the parsed coordinates, stores clustered
+    before the center columns existed only have the centers left
+'''
+def has_parsed_locations(store_path):
+    meta = load_meta(store_path)
+    return clustered_rows(meta) == 0 or all(os.path.exists(column_path(store_path, name)) for name in CENTER_COLUMNS)
+
+'''
+    location_strings
+    Format the start or end locations the way the PSL observation files hold them,
+    cluster centers first, rows appended after the last clustering as raw locations
+'''
+def location_strings(columns, meta, prefix):
+    split = clustered_rows(meta)
+    formats = [CLUSTERED_LOCATION_FORMAT] * split + [RAW_LOCATION_FORMAT] * (meta['count'] - split)
+    return [location_format % tuple(location) for location_format, location in zip(formats, clustered_locations(columns, meta, prefix).tolist())]
+
+'''
+    column_strings
+    String values of a dataset column, location columns are named start_location
+    and end_location, the rest are the categorical columns
+'''
+def column_strings(columns, meta, name):
+    if name == 'start_location':
+        return location_strings(columns, meta, 'start')
+    if name == 'end_location':
+        return location_strings(columns, meta, 'end')
+    return decode(columns, meta, name)
+
+'''
+    apply_clusters
+    Write the cluster center of every row to the center columns, clustered maps
+    each (lon, lat) tuple to its center the way ClusterGPS.cluster returns it
+'''
+def apply_clusters(store_path, clustered):
+    columns, meta = load(store_path, mmap_mode=None)
+    for prefix in ['start', 'end']:
+        points = np.ascontiguousarray(locations(columns, prefix))
+        unique, inverse = np.unique(points.view([('lon', np.float64), ('lat', np.float64)]).ravel(), return_inverse=True)
+        centers = np.array([clustered[(lon, lat)] for lon, lat in unique.tolist()], dtype=np.float64).reshape(-1, 2)
+        np.save(column_path(store_path, prefix + '_center_lon'), centers[inverse, 0])
+        np.save(column_path(store_path, prefix + '_center_lat'), centers[inverse, 1])
+    meta['location_format'] = CLUSTERED_LOCATION_FORMAT
+    meta['clustered_rows'] = meta['count']
+    write_meta(store_path, meta)
+
+'''
+    apply_tail_clusters
+    Add the centers of the rows from clustered_rows(meta) on to the center columns,
+    a (rows, 2) array per prefix, the centers of earlier rows are left untouched
+'''
+def apply_tail_clusters(store_path, start_centers, end_centers):
+    columns, meta = load(store_path, mmap_mode=None)
+    first = clustered_rows(meta)
+    for prefix, centers in [('start', start_centers), ('end', end_centers)]:
+        for ind, suffix in enumerate(['_center_lon', '_center_lat']):
+            path = column_path(store_path, prefix + suffix)
+            if os.path.exists(path) and len(columns[prefix + suffix]) == first:
+                append_column(path, np.asarray(centers[:, ind], dtype=np.float64))
+            else:
+                np.save(path, np.concatenate((columns[prefix + suffix][:first], centers[:, ind])))
+    del columns
+    meta['location_format'] = CLUSTERED_LOCATION_FORMAT
+    meta['clustered_rows'] = meta['count']
+    write_meta(store_path, meta)
@@ -48,7 +48,7 @@ function buildClasspath() {
 }
 
 function run() {
-   java -Xmx57g -d64 -cp ./target/classes:$(cat ${CLASSPATH_FILE}) ${TARGET_CLASS}
+   java -Xmx57g -d64 -cp ./target/classes:$(cat ${CLASSPATH_FILE}) ${TARGET_CLASS} "$@"
    if [[ "$?" -ne 0 ]]; then
       err 'Failed to run'
       exit 60
@@ -59,7 +59,7 @@ function main() {
    check_requirements
    compile
    buildClasspath
-   run
+   run "$@"
 }
 
 main "$@"
@@ -35,12 +35,15 @@ import org.linqs.psl.utils.evaluation.statistics.ContinuousPredictionComparator;
 import org.linqs.psl.utils.evaluation.statistics.DiscretePredictionComparator;
 import org.linqs.psl.utils.evaluation.statistics.DiscretePredictionStatistics;
 import java.util.HashSet;
+import java.util.concurrent.ConcurrentHashMap;
 import java.lang.Double;
 
 import org.slf4j.Logger;
 import org.slf4j.LoggerFactory;
 
 import groovy.time.TimeCategory;
+import java.nio.file.Files
+import java.nio.file.Path
 import java.nio.file.Paths
 
 public class Bipedal{
@@ -52,6 +55,13 @@ public class Bipedal{
     private DataStore ds;
     private PSLConfig config;
     private PSLModel model;
+
+    // Location strings parsed once, the location functions run for every grounding
+    private Map<String, double[]> parsedLocations = new ConcurrentHashMap<String, double[]>();
+
+    // EqualLocations and Near when they are loaded as predicates, see loadRelations
+    private Set<StandardPredicate> closedRelations = new HashSet<StandardPredicate>();
+
     public int cluster_count = 10;
 
     // Config
@@ -99,8 +109,17 @@ public class Bipedal{
 
     // Functions
     private void defineFunctions(){
-        model.add function: "EqualLocations", implementation: new LocationComparison();
-        model.add function: "Near", implementation: new ManhattanNear();
+        // Precomputed by preprocessing/location_relations.py, loaded as closed predicates
+        if (Files.exists(relationPath("equal_obs.txt"))) {
+            model.add predicate: "EqualLocations", types: [ConstantType.String, ConstantType.String];
+        } else {
+            model.add function: "EqualLocations", implementation: new LocationComparison();
+        }
+        if (Files.exists(relationPath("near_obs.txt"))) {
+            model.add predicate: "Near", types: [ConstantType.String, ConstantType.String];
+        } else {
+            model.add function: "Near", implementation: new ManhattanNear();
+        }
         model.add function: "LeftOf", implementation: new LeftSort();
     }
 
@@ -122,14 +141,24 @@ public class Bipedal{
         //model.add rule: ~AnchorTime(L, T), weight: 1;
     }
 
+    /*
+     * parseLocation
+     * Longitude and latitude of a "lon lat" location string, cached in parsedLocations
+     */
+    private double[] parseLocation(String s){
+        double[] parsed = parsedLocations.get(s);
+        if (parsed == null) {
+            String[] split = s.split(" ");
+            parsed = [Double.parseDouble(split[0]), Double.parseDouble(split[1])] as double[];
+            parsedLocations.put(s, parsed);
+        }
+        return parsed;
+    }
+
     public double[] deserializeLocations(String s1, String s2){
-        String[] split1 = s1.split(" ")
-        String[] split2 = s2.split(" ");
-        double x1 = Double.parseDouble(split1[0]);
-        double y1 = Double.parseDouble(split1[1]);
-        double x2 = Double.parseDouble(split2[0]);
-        double y2 = Double.parseDouble(split2[1]);
-        return [x1, y1, x2, y2];
+        double[] location1 = parseLocation(s1);
+        double[] location2 = parseLocation(s2);
+        return [location1[0], location1[1], location2[0], location2[1]];
     }
 
     class ManhattanNear implements ExternalFunction {
@@ -379,8 +408,52 @@ public class Bipedal{
         log.info("Finished loading LocationTime into target partition");
     }
 
+    /*
+     * loadCandidates
+     * Load the target atoms preprocessing/candidates.py wrote for predicate into the
+     * target partition, returns false when there is no candidate file to load
+     */
+    private boolean loadCandidates(StandardPredicate predicate, Partition targetPartition, String filename){
+        def path = Paths.get(config.dataPath, filename);
+        if (!Files.exists(path)) {
+            return false;
+        }
+        log.info("Loading " + predicate.getName() + " candidates from " + filename);
+        Inserter inserter = ds.getInserter(predicate, targetPartition);
+        InserterUtils.loadDelimitedData(inserter, path.toString());
+        return true;
+    }
+
+    /*
+     * relationPath
+     * Path of a location relation file, with it the relation is a closed predicate instead of a function
+     */
+    private Path relationPath(String filename){
+        return Paths.get(config.dataPath, filename);
+    }
+
+    /*
+     * loadRelations
+     * Load the precomputed EqualLocations and Near pairs and return the ones to close
+     */
+    private Set<StandardPredicate> loadRelations(Partition obsPartition){
+        Set<StandardPredicate> relations = new HashSet<StandardPredicate>();
+        if (Files.exists(relationPath("equal_obs.txt"))) {
+            Inserter inserter = ds.getInserter(EqualLocations, obsPartition);
+            InserterUtils.loadDelimitedData(inserter, relationPath("equal_obs.txt").toString());
+            relations.add(EqualLocations);
+        }
+        if (Files.exists(relationPath("near_obs.txt"))) {
+            Inserter inserter = ds.getInserter(Near, obsPartition);
+            InserterUtils.loadDelimitedDataTruth(inserter, relationPath("near_obs.txt").toString());
+            relations.add(Near);
+        }
+        return relations;
+    }
+
     private void loadData(Partition obsPartition, Partition targetsPartition, Partition truthPartition) {
         log.info("Loading data into database");
+        closedRelations = loadRelations(obsPartition);
 
         // Fill all of the obs partition from files
         Inserter inserter = ds.getInserter(Segment, obsPartition);
@@ -405,8 +478,12 @@ public class Bipedal{
         InserterUtils.loadDelimitedDataTruth(inserter, Paths.get(config.dataPath, "anchor_truth.txt").toString());
 
         // Run the cross functions to fill the targets partition
-        crossLocationTime(obsPartition, targetsPartition);
-        crossLocationMode(obsPartition, targetsPartition);
+        if (!loadCandidates(AnchorTime, targetsPartition, "candidate_anchor_times.txt")) {
+            crossLocationTime(obsPartition, targetsPartition);
+        }
+        if (!loadCandidates(AnchorMode, targetsPartition, "candidate_anchor_modes.txt")) {
+            crossLocationMode(obsPartition, targetsPartition);
+        }
         crossAnchor(obsPartition, targetsPartition);
     }
 
@@ -417,6 +494,7 @@ public class Bipedal{
 
         Date infStart = new Date();
         HashSet closed = new HashSet<StandardPredicate>([StartLocation,EndLocation,StartTime,EndTime,Segment,Mode]);
+        closed.addAll(closedRelations);
         Database inferDB = ds.getDatabase(targetsPartition, closed, obsPartition);
         MPEInference mpe = new MPEInference(model, inferDB, config.cb);
         mpe.mpeInference();
@@ -504,6 +582,11 @@ public class Bipedal{
         if (args.length > 0) {
             cb.setProperty('experiment.data.path', args[0]);
         }
+        if (args.length > 1) {
+            // Shards inferred side by side each need their own output directory and database
+            cb.setProperty('experiment.output.outputdir', args[1]);
+            cb.setProperty('experiment.dbpath', args[1]);
+        }
         return cb;
     }
 
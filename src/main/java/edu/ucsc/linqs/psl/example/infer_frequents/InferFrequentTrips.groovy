@@ -63,6 +63,7 @@ import org.linqs.psl.utils.evaluation.statistics.DiscretePredictionComparator;
 import org.linqs.psl.utils.evaluation.statistics.DiscretePredictionStatistics;
 
 import java.util.HashSet;
+import java.util.concurrent.ConcurrentHashMap;
 //import edu.umd.cs.psl.model.argument.Variable;
 import java.lang.Double;
 
@@ -70,6 +71,8 @@ import org.slf4j.Logger;
 import org.slf4j.LoggerFactory;
 
 import groovy.time.TimeCategory;
+import java.nio.file.Files
+import java.nio.file.Path
 import java.nio.file.Paths
 
 public class InferFrequentTrips{
@@ -81,6 +84,13 @@ public class InferFrequentTrips{
     private DataStore ds;
     private PSLConfig config;
     private PSLModel model;
+
+    // Location strings parsed once, the location functions run for every grounding
+    private Map<String, double[]> parsedLocations = new ConcurrentHashMap<String, double[]>();
+
+    // EqualLocations and Near when they are loaded as predicates, see loadRelations
+    private Set<StandardPredicate> closedRelations = new HashSet<StandardPredicate>();
+
     public int cluster_count = 10;
 
     // Config
@@ -129,12 +139,23 @@ public class InferFrequentTrips{
         model.add predicate: "FrequentTripTime", types: [ConstantType.String, ConstantType.String, ConstantType.String, ConstantType.String]
         model.add predicate: "FrequentTripMode", types: [ConstantType.String, ConstantType.String, ConstantType.String]
         model.add predicate: "SegmentDay", types: [ConstantType.UniqueID, ConstantType.String]
+        // Same day, time compatible segment pairs, see preprocessing/segment_pairs.py
+        model.add predicate: "SameDayPair", types: [ConstantType.UniqueID, ConstantType.UniqueID]
     }
 
     // Functions
     private void defineFunctions(){
-        model.add function: "EqualLocations", implementation: new LocationComparison();
-        model.add function: "Near", implementation: new ManhattanNear();
+        // Precomputed by preprocessing/location_relations.py, loaded as closed predicates
+        if (Files.exists(relationPath("equal_obs.txt"))) {
+            model.add predicate: "EqualLocations", types: [ConstantType.String, ConstantType.String];
+        } else {
+            model.add function: "EqualLocations", implementation: new LocationComparison();
+        }
+        if (Files.exists(relationPath("near_obs.txt"))) {
+            model.add predicate: "Near", types: [ConstantType.String, ConstantType.String];
+        } else {
+            model.add function: "Near", implementation: new ManhattanNear();
+        }
         model.add function: "LeftOf", implementation: new LeftSort();
 	model.add function: "Before", implementation: new BeforeCompare();
 	model.add function: "SimilarTimes", implementation: new SimilarTimes();
@@ -149,10 +170,16 @@ public class InferFrequentTrips{
         model.add rule: (Segment(S) & Anchor(L1) & Anchor(L2)
                                 & StartLocation(S, L1) & EndLocation(S, L2) & ~EqualLocations(L1, L2) ) >> FrequentTrip(L1, L2), weight: 5;
 
-        model.add rule: (Segment(S1) & Segment(S2) & Anchor(L1) & Anchor(L2)
+        if (Files.exists(sameDayPairsPath())) {
+            // The pairs already share a day and have compatible times, so there is no self join to filter
+            model.add rule: (SameDayPair(S1, S2) & Anchor(L1) & Anchor(L2)
+                                    & StartLocation(S1, L1) & EndLocation(S2, L2) & ~EqualLocations(L1, L2)) >> FrequentTrip(L1, L2), weight: 1;
+        } else {
+            model.add rule: (Segment(S1) & Segment(S2) & Anchor(L1) & Anchor(L2)
                                     & StartLocation(S1, L1) & EndLocation(S2, L2)
                                     & SegmentDay(S1, D) & SegmentDay(S2, D) 
                                     & StartTime(S1, T1) & EndTime(S2, T2) & Before(T1, T2) & SimilarTimes(T1, T2) & ~EqualLocations(L1, L2)) >> FrequentTrip(L1, L2), weight: 1;
+        }
         
         // model.add rule: (FrequentTrip(L1, L2) & FrequentTrip(L2, L3) & FrequentTrip(L3, L1) & Near(L1, L2) & Near(L2, L3) & ~Near(L1, L3) & LeftOf(L1, L3)) >> FrequentTrip(L1, L3), weight: 1.0
         // model.add rule: (FrequentTrip(L1, L2) & FrequentTrip(L2, L3) & FrequentTrip(L3, L1) & Near(L1, L2) & Near(L2, L3) & ~Near(L1, L3)) >> ~FrequentTrip(L2, L3), weight: 20.0
@@ -165,14 +192,24 @@ public class InferFrequentTrips{
         // }
     }
 
+    /*
+     * parseLocation
+     * Longitude and latitude of a "lon lat" location string, cached in parsedLocations
+     */
+    private double[] parseLocation(String s){
+        double[] parsed = parsedLocations.get(s);
+        if (parsed == null) {
+            String[] split = s.split(" ");
+            parsed = [Double.parseDouble(split[0]), Double.parseDouble(split[1])] as double[];
+            parsedLocations.put(s, parsed);
+        }
+        return parsed;
+    }
+
     public double[] deserializeLocations(String s1, String s2){
-        String[] split1 = s1.split(" ");
-        String[] split2 = s2.split(" ");
-        double x1 = Double.parseDouble(split1[0]);
-        double y1 = Double.parseDouble(split1[1]);
-        double x2 = Double.parseDouble(split2[0]);
-        double y2 = Double.parseDouble(split2[1]);
-        return [x1, y1, x2, y2];
+        double[] location1 = parseLocation(s1);
+        double[] location2 = parseLocation(s2);
+        return [location1[0], location1[1], location2[0], location2[1]];
     }
 
 		public double[] deserializeTimes(String s1, String s2){
@@ -463,8 +500,60 @@ public class InferFrequentTrips{
     }
 
     
+    /*
+     * sameDayPairsPath
+     * With this file the second FrequentTrip rule joins the precomputed pairs instead of every two segments of a day
+     */
+    private Path sameDayPairsPath(){
+        return Paths.get(config.dataPath, "same_day_pairs_obs.txt");
+    }
+
+    /*
+     * loadCandidates
+     * Load the target atoms preprocessing/candidates.py wrote for predicate into the
+     * target partition, returns false when there is no candidate file to load
+     */
+    private boolean loadCandidates(StandardPredicate predicate, Partition targetPartition, String filename){
+        def path = Paths.get(config.dataPath, filename);
+        if (!Files.exists(path)) {
+            return false;
+        }
+        log.info("Loading " + predicate.getName() + " candidates from " + filename);
+        Inserter inserter = ds.getInserter(predicate, targetPartition);
+        InserterUtils.loadDelimitedData(inserter, path.toString());
+        return true;
+    }
+
+    /*
+     * relationPath
+     * Path of a location relation file, with it the relation is a closed predicate instead of a function
+     */
+    private Path relationPath(String filename){
+        return Paths.get(config.dataPath, filename);
+    }
+
+    /*
+     * loadRelations
+     * Load the precomputed EqualLocations and Near pairs and return the ones to close
+     */
+    private Set<StandardPredicate> loadRelations(Partition obsPartition){
+        Set<StandardPredicate> relations = new HashSet<StandardPredicate>();
+        if (Files.exists(relationPath("equal_obs.txt"))) {
+            Inserter inserter = ds.getInserter(EqualLocations, obsPartition);
+            InserterUtils.loadDelimitedData(inserter, relationPath("equal_obs.txt").toString());
+            relations.add(EqualLocations);
+        }
+        if (Files.exists(relationPath("near_obs.txt"))) {
+            Inserter inserter = ds.getInserter(Near, obsPartition);
+            InserterUtils.loadDelimitedDataTruth(inserter, relationPath("near_obs.txt").toString());
+            relations.add(Near);
+        }
+        return relations;
+    }
+
     private void loadData(Partition obsPartition, Partition targetsPartition, Partition truthPartition) {
         log.info("Loading data into database");
+        closedRelations = loadRelations(obsPartition);
 
 
         // Fill all of the obs partition from files
@@ -489,6 +578,11 @@ public class InferFrequentTrips{
         inserter = ds.getInserter(SegmentDay, obsPartition);
         InserterUtils.loadDelimitedData(inserter, Paths.get(config.dataPath, "segment_days_obs.txt").toString());
 
+        if (Files.exists(sameDayPairsPath())) {
+            inserter = ds.getInserter(SameDayPair, obsPartition);
+            InserterUtils.loadDelimitedData(inserter, sameDayPairsPath().toString());
+        }
+
         inserter = ds.getInserter(Anchor, obsPartition);
         InserterUtils.loadDelimitedDataTruth(inserter, Paths.get(config.dataPath, "grounded_anchors.txt").toString());
 
@@ -497,7 +591,9 @@ public class InferFrequentTrips{
 
         // Run the cross functions to fill the targets partition
         //crossFrequentTripTimes(obsPartition, targetsPartition);
-        crossFrequentTrips(obsPartition, targetsPartition);
+        if (!loadCandidates(FrequentTrip, targetsPartition, "candidate_frequent_trips.txt")) {
+            crossFrequentTrips(obsPartition, targetsPartition);
+        }
         //crossFrequentTripModes(obsPartition, targetsPartition);
     }
 
@@ -506,7 +602,8 @@ public class InferFrequentTrips{
         log.info("Starting inference");
 
         Date infStart = new Date();
-        HashSet closed = new HashSet<StandardPredicate>([Anchor,StartLocation,EndLocation,StartTime,EndTime,Segment,Mode,SegmentDay]);
+        HashSet closed = new HashSet<StandardPredicate>([Anchor,StartLocation,EndLocation,StartTime,EndTime,Segment,Mode,SegmentDay,SameDayPair]);
+        closed.addAll(closedRelations);
         Database inferDB = ds.getDatabase(targetsPartition, closed, obsPartition);
         MPEInference mpe = new MPEInference(model, inferDB, config.cb);
         mpe.mpeInference();
@@ -594,6 +691,11 @@ public class InferFrequentTrips{
         if (args.length > 0) {
             cb.setProperty('experiment.data.path', args[0]);
         }
+        if (args.length > 1) {
+            // Shards inferred side by side each need their own output directory and database
+            cb.setProperty('experiment.output.outputdir', args[1]);
+            cb.setProperty('experiment.dbpath', args[1]);
+        }
         return cb;
     }
 
@@ -60,6 +60,7 @@ import org.linqs.psl.utils.evaluation.printing.AtomPrintStream;
 import org.linqs.psl.utils.evaluation.printing.DefaultAtomPrintStream;
 
 import java.util.HashSet;
+import java.util.concurrent.ConcurrentHashMap;
 //import edu.umd.cs.psl.model.argument.Variable;
 import java.lang.Double;
 import java.lang.Math;
@@ -79,6 +80,10 @@ public class InferMerge{
     private DataStore ds;
     private PSLConfig config;
     private PSLModel model;
+
+    // Location strings parsed once, the location functions run for every grounding
+    private Map<String, double[]> parsedLocations = new ConcurrentHashMap<String, double[]>();
+
     public int cluster_count = 10;
 
     // Config
@@ -157,17 +162,27 @@ public class InferMerge{
         model.add rule: (FrequentTripMode(L1, L2, M1) & FrequentTripMode(L1, L2, M2) & SlowerTransport(M1, M2) & FrequentTripTime(L1, L2, T1, T2)) >> ~FrequentTripModeTime(L1, L2, M1, T1, T2), weight: 1000; 
    }
 
+    /*
+     * parseLocation
+     * Longitude and latitude of a "lon lat" location string, cached in parsedLocations
+     */
+    private double[] parseLocation(String s){
+        double[] parsed = parsedLocations.get(s);
+        if (parsed == null) {
+            String[] split = s.split(" ");
+            parsed = [Double.parseDouble(split[0]), Double.parseDouble(split[1])] as double[];
+            parsedLocations.put(s, parsed);
+        }
+        return parsed;
+    }
+
     /*
         TODO: Why arbitrary two locations deserializations...
     */
     public double[] deserializeLocations(String s1, String s2){
-        String[] split1 = s1.split(" ");
-        String[] split2 = s2.split(" ");
-        double x1 = Double.parseDouble(split1[0]);
-        double y1 = Double.parseDouble(split1[1]);
-        double x2 = Double.parseDouble(split2[0]);
-        double y2 = Double.parseDouble(split2[1]);
-        return [x1, y1, x2, y2];
+        double[] location1 = parseLocation(s1);
+        double[] location2 = parseLocation(s2);
+        return [location1[0], location1[1], location2[0], location2[1]];
     }
 
     public double[] deserializeTimes(String s1, String s2){
@@ -605,6 +620,11 @@ public class InferMerge{
         if (args.length > 0) {
             cb.setProperty('experiment.data.path', args[0]);
         }
+        if (args.length > 1) {
+            // Shards inferred side by side each need their own output directory and database
+            cb.setProperty('experiment.output.outputdir', args[1]);
+            cb.setProperty('experiment.dbpath', args[1]);
+        }
         return cb;
     }
 
@@ -63,6 +63,7 @@ import org.linqs.psl.utils.evaluation.statistics.DiscretePredictionComparator;
 import org.linqs.psl.utils.evaluation.statistics.DiscretePredictionStatistics;
 
 import java.util.HashSet;
+import java.util.concurrent.ConcurrentHashMap;
 //import edu.umd.cs.psl.model.argument.Variable;
 import java.lang.Double;
 import java.lang.Math;
@@ -71,6 +72,7 @@ import org.slf4j.Logger;
 import org.slf4j.LoggerFactory;
 
 import groovy.time.TimeCategory;
+import java.nio.file.Files
 import java.nio.file.Paths
 
 public class InferTripInfo{
@@ -82,6 +84,10 @@ public class InferTripInfo{
     private DataStore ds;
     private PSLConfig config;
     private PSLModel model;
+
+    // Location strings parsed once, the location functions run for every grounding
+    private Map<String, double[]> parsedLocations = new ConcurrentHashMap<String, double[]>();
+
     public int cluster_count = 10;
 
     // Config
@@ -170,17 +176,27 @@ public class InferTripInfo{
 
     }
 
+    /*
+     * parseLocation
+     * Longitude and latitude of a "lon lat" location string, cached in parsedLocations
+     */
+    private double[] parseLocation(String s){
+        double[] parsed = parsedLocations.get(s);
+        if (parsed == null) {
+            String[] split = s.split(" ");
+            parsed = [Double.parseDouble(split[0]), Double.parseDouble(split[1])] as double[];
+            parsedLocations.put(s, parsed);
+        }
+        return parsed;
+    }
+
     /*
         TODO: Why arbitrary two locations deserializations...
     */
     public double[] deserializeLocations(String s1, String s2){
-        String[] split1 = s1.split(" ");
-        String[] split2 = s2.split(" ");
-        double x1 = Double.parseDouble(split1[0]);
-        double y1 = Double.parseDouble(split1[1]);
-        double x2 = Double.parseDouble(split2[0]);
-        double y2 = Double.parseDouble(split2[1]);
-        return [x1, y1, x2, y2];
+        double[] location1 = parseLocation(s1);
+        double[] location2 = parseLocation(s2);
+        return [location1[0], location1[1], location2[0], location2[1]];
     }
 
     public double[] deserializeTimes(String s1, String s2){
@@ -395,6 +411,22 @@ public class InferTripInfo{
     }
 
     
+    /*
+     * loadCandidates
+     * Load the target atoms preprocessing/candidates.py wrote for predicate into the
+     * target partition, returns false when there is no candidate file to load
+     */
+    private boolean loadCandidates(StandardPredicate predicate, Partition targetPartition, String filename){
+        def path = Paths.get(config.dataPath, filename);
+        if (!Files.exists(path)) {
+            return false;
+        }
+        log.info("Loading " + predicate.getName() + " candidates from " + filename);
+        Inserter inserter = ds.getInserter(predicate, targetPartition);
+        InserterUtils.loadDelimitedData(inserter, path.toString());
+        return true;
+    }
+
     private void loadData(Partition obsPartition, Partition targetsPartition, Partition truthPartition) {
         log.info("Loading data into database");
 
@@ -438,8 +470,12 @@ public class InferTripInfo{
         InserterUtils.loadDelimitedData(inserter, Paths.get(config.dataPath, "fake_trips.txt").toString());
         inserter = ds.getInserter(FrequentTripMode, targetsPartition);
         InserterUtils.loadDelimitedData(inserter, Paths.get(config.dataPath, "fake_modes.txt").toString());*/
-        crossFrequentTripTimes(obsPartition, targetsPartition);
-        crossFrequentTripModes(obsPartition, targetsPartition);
+        if (!loadCandidates(FrequentTripTime, targetsPartition, "candidate_frequent_trip_times.txt")) {
+            crossFrequentTripTimes(obsPartition, targetsPartition);
+        }
+        if (!loadCandidates(FrequentTripMode, targetsPartition, "candidate_frequent_trip_modes.txt")) {
+            crossFrequentTripModes(obsPartition, targetsPartition);
+        }
     }
 
     // Run inference
@@ -573,6 +609,11 @@ public class InferTripInfo{
         if (args.length > 0) {
             cb.setProperty('experiment.data.path', args[0]);
         }
+        if (args.length > 1) {
+            // Shards inferred side by side each need their own output directory and database
+            cb.setProperty('experiment.output.outputdir', args[1]);
+            cb.setProperty('experiment.dbpath', args[1]);
+        }
         return cb;
     }
 
@@ -0,0 +1,63 @@
+/*
+ * InferenceWorker.groovy
+ * Runs the PSL programs of a pipeline one after another in one JVM, so compiling,
+ * class loading and JIT warm-up happen once instead of once per program
+ * Reads one stage per line from stdin, its name and the program arguments separated
+ * by tabs, and answers every line on stdout with
+ *     INFERENCE_WORKER DONE <stage> <seconds>
+ *     INFERENCE_WORKER FAILED <stage> <error>
+ * An empty line or the end of stdin stops the worker, see inference/launcher.py
+ */
+
+package edu.ucsc.linqs.psl.example.worker;
+
+import edu.ucsc.linqs.psl.example.bipedal.Bipedal;
+import edu.ucsc.linqs.psl.example.infer_frequents.InferFrequentTrips;
+import edu.ucsc.linqs.psl.example.infer_merge.InferMerge;
+import edu.ucsc.linqs.psl.example.infer_time_mode.InferTripInfo;
+
+public class InferenceWorker{
+    private static final String REPLY = "INFERENCE_WORKER";
+
+    // Stage names of inference/preflight.py and the program each runs
+    private static final Map<String, Closure> STAGES = [
+        'anchors': { String[] args -> Bipedal.main(args) },
+        'frequents': { String[] args -> InferFrequentTrips.main(args) },
+        'info': { String[] args -> InferTripInfo.main(args) },
+        'merge': { String[] args -> InferMerge.main(args) }
+    ];
+
+    /*
+     * runStage
+     * Run one stage line and return the reply for it
+     */
+    private static String runStage(String line){
+        String[] fields = line.split("\t");
+        String stage = fields[0];
+        String[] args = (fields.length > 1) ? (fields[1..-1] as String[]) : new String[0];
+        Closure program = STAGES.get(stage);
+        if (program == null) {
+            return REPLY + " FAILED " + stage + " unknown stage, expected one of " + STAGES.keySet().join(", ");
+        }
+        long start = System.currentTimeMillis();
+        try {
+            program.call(args);
+        } catch (Throwable e) {
+            e.printStackTrace();
+            // The reply has to stay on one line
+            return REPLY + " FAILED " + stage + " " + e.toString().replaceAll("\\s+", " ");
+        }
+        return REPLY + " DONE " + stage + " " + ((System.currentTimeMillis() - start) / 1000.0);
+    }
+
+    public static void main(String[] args){
+        BufferedReader reader = new BufferedReader(new InputStreamReader(System.in));
+        String line = reader.readLine();
+        while (line != null && !line.trim().isEmpty()) {
+            String reply = runStage(line.trim());
+            System.out.println(reply);
+            System.out.flush();
+            line = reader.readLine();
+        }
+    }
+}
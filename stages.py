@@ -0,0 +1,157 @@
+'''
+    stages.py
+    Make-like stage graph for build.py
+    Every stage declares its input files, parameters and output files. A stage is
+    skipped when the content hashes of its inputs and its parameters match the
+    record from its last run and its outputs are still what that run left behind
+'''
+
+import hashlib
+import json
+import os
+import time
+
+READ_SIZE = 1024 * 1024
+
+class Stage(object):
+
+    '''
+        name: unique stage name
+        run: function called without arguments
+        inputs, outputs: files or directories
+        params: json serialisable dict of parameters
+        after: stages this stage depends on, a stage reruns whenever one of them does
+        rewrites: stages whose outputs this stage modifies in place, they are rerun
+                  first so this stage never runs on its own previous output
+    '''
+    def __init__(self, name, run, inputs=None, params=None, outputs=None, after=None, rewrites=None):
+        self.name = name
+        self.run = run
+        self.inputs = inputs or []
+        self.params = params or {}
+        self.outputs = outputs or []
+        self.after = after or []
+        self.rewrites = rewrites or []
+
+'''
+    StageCache
+    Stores the key each stage last ran with, the digests of its outputs and a
+    (size, mtime) -> digest cache so unchanged files are not read again
+'''
+class StageCache(object):
+
+    def __init__(self, record_path):
+        self.record_path = record_path
+        self.stages = {}
+        self.files = {}
+        if os.path.exists(record_path):
+            with open(record_path, 'r') as rf:
+                record = json.load(rf)
+            self.stages = record['stages']
+            self.files = record['files']
+
+    def save(self):
+        with open(self.record_path, 'w+') as wf:
+            json.dump({'stages': self.stages, 'files': self.files}, wf, indent=2, sort_keys=True)
+
+    def file_digest(self, path):
+        stat = os.stat(path)
+        cached = self.files.get(path)
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+            return cached[2]
+        sha = hashlib.sha1()
+        with open(path, 'rb') as rf:
+            for chunk in iter(lambda: rf.read(READ_SIZE), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        self.files[path] = [stat.st_size, stat.st_mtime, digest]
+        return digest
+
+    '''
+        digest
+        Content digest of a file or a directory, None when it does not exist
+    '''
+    def digest(self, path):
+        if not os.path.exists(path):
+            return None
+        if not os.path.isdir(path):
+            return self.file_digest(path)
+        sha = hashlib.sha1()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                sha.update(os.path.relpath(file_path, path).encode('utf-8'))
+                sha.update(self.file_digest(file_path).encode('utf-8'))
+        return sha.hexdigest()
+
+    def key(self, stage):
+        sha = hashlib.sha1()
+        sha.update(json.dumps(stage.params, sort_keys=True).encode('utf-8'))
+        for path in stage.inputs:
+            sha.update(path.encode('utf-8'))
+            sha.update(str(self.digest(path)).encode('utf-8'))
+        return sha.hexdigest()
+
+    def up_to_date(self, stage):
+        record = self.stages.get(stage.name)
+        if record is None or record['key'] != self.key(stage):
+            return False
+        return all(self.digest(path) is not None and self.digest(path) == record['outputs'].get(path) for path in stage.outputs)
+
+    def record_key(self, stage, key):
+        self.stages[stage.name] = {'key': key, 'outputs': {}}
+
+    def record_outputs(self, stage):
+        self.stages[stage.name]['outputs'] = dict((path, self.digest(path)) for path in stage.outputs)
+
+'''
+    stale_stages
+    Names of the stages that have to run, stages are given in dependency order
+'''
+def stale_stages(stages, cache, force=False):
+    stale = set()
+    for stage in stages:
+        if force or not cache.up_to_date(stage):
+            stale.add(stage.name)
+    # A stage rewriting another's outputs needs that stage rerun first, and a
+    # rerun stage makes everything after it stale, repeat until nothing changes
+    changed = True
+    while changed:
+        changed = False
+        for stage in stages:
+            if stage.name in stale:
+                needed = set(stage.rewrites) - stale
+            elif any(name in stale for name in stage.after):
+                needed = set([stage.name])
+            else:
+                needed = set()
+            if needed:
+                stale |= needed
+                changed = True
+    return stale
+
+'''
+    run_stages
+    Run the stale stages in order and record what they ran with in record_path
+'''
+def run_stages(stages, record_path, force=False):
+    cache = StageCache(record_path)
+    stale = stale_stages(stages, cache, force)
+    ran = []
+    for stage in stages:
+        if stage.name not in stale:
+            print('Skipping stage %s, inputs and parameters unchanged' % stage.name)
+            continue
+        # Inputs may have just been written by an earlier stage
+        key = cache.key(stage)
+        start = time.time()
+        stage.run()
+        print('Ran stage %s in %0.2fs' % (stage.name, time.time() - start))
+        cache.record_key(stage, key)
+        ran.append(stage)
+    # Record outputs once every stage ran, in place rewrites by later stages included
+    for stage in ran:
+        cache.record_outputs(stage)
+    cache.save()
+    return ran